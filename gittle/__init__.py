@@ -1,5 +1,25 @@
 from . import utils
 from .gittle import Gittle
-from .server import GitServer
 from .exceptions import *
-from .auth import GittleAuth
\ No newline at end of file
+from .auth import GittleAuth
+from .progress import TransferProgress
+from .pool import ClientPool
+
+
+# Imported on first use, with the modules they need (dulwich.web, asyncio, ...)
+# through the module __getattr__ (PEP 562, hence python_requires >= 3.7)
+LAZY_EXPORTS = {
+    'GitServer': 'server',
+    'AsyncGittle': 'aio',
+    'RepoManager': 'multi',
+    'SharedGittle': 'shared',
+}
+
+
+def __getattr__(name):
+    if name in LAZY_EXPORTS:
+        from importlib import import_module
+        value = getattr(import_module('.' + LAZY_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
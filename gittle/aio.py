@@ -0,0 +1,182 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import asyncio
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+# Local imports
+from gittle.gittle import Gittle
+from gittle.progress import TransferProgress
+from gittle.exceptions import OperationCancelled
+
+
+# Exports
+__all__ = ('AsyncGittle', 'AsyncRunner', 'CancellableProgress')
+
+
+# Remote operations running at once by default
+DEFAULT_CONCURRENCY = 8
+
+
+class CancellableProgress(TransferProgress):
+    """TransferProgress that makes the operation reporting to it
+    raise OperationCancelled once cancel() is called
+
+    Dulwich reports every read and write, so transfers stop right away,
+    local work (like a checkout) stops at its next progress report
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CancellableProgress, self).__init__(*args, **kwargs)
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        if self.cancelled:
+            raise OperationCancelled()
+
+    def update(self, stage=None, **counters):
+        self.check()
+        return super(CancellableProgress, self).update(stage, **counters)
+
+    def report_activity(self, nbytes, direction):
+        self.check()
+        return super(CancellableProgress, self).report_activity(nbytes, direction)
+
+    def __call__(self, message):
+        self.check()
+        return super(CancellableProgress, self).__call__(message)
+
+
+class AsyncRunner(object):
+    """Runs blocking Gittle operations in threads for asyncio code,
+    at most concurrency of them at once (others wait for a slot)
+
+    Cancelling the awaiting task cancels the operation (see CancellableProgress),
+    its slot is only given back once the thread has actually stopped
+    """
+
+    def __init__(self, concurrency=None, executor=None):
+        self.concurrency = concurrency or DEFAULT_CONCURRENCY
+        self.executor = executor or ThreadPoolExecutor(self.concurrency)
+        self._semaphore = None
+        self._loop = None
+
+    @property
+    def semaphore(self):
+        # Semaphores belong to an event loop
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    def _progress(self, callback):
+        """CancellableProgress calling callback(event) in the event loop's thread
+        """
+        if callback is None:
+            return CancellableProgress()
+        loop = asyncio.get_event_loop()
+        return CancellableProgress(lambda event: loop.call_soon_threadsafe(callback, event))
+
+    async def run(self, func, *args, **kwargs):
+        """Await func(*args, progress=<CancellableProgress>, **kwargs) run in a thread,
+        callback (a keyword argument) receives its progress events
+        """
+        progress = self._progress(kwargs.pop('callback', None))
+        call = partial(func, *args, progress=progress, **kwargs)
+
+        async with self.semaphore:
+            future = asyncio.wrap_future(self.executor.submit(call))
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                progress.cancel()
+                # Wait for the thread to notice
+                try:
+                    await future
+                except Exception:
+                    pass
+                raise
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
+
+
+# Shared by AsyncGittle instances not given a runner
+DEFAULT_RUNNER = AsyncRunner()
+
+
+class AsyncGittle(object):
+    """asyncio facade for the remote operations of a Gittle :
+        repo = await AsyncGittle.clone(uri, path)
+        await asyncio.gather(*[repo.fetch() for repo in repos])
+
+    Operations run through an AsyncRunner (bounding how many run at once),
+    those on the same repository run one after the other
+    Every operation takes a callback receiving progress event dicts
+    (see TransferProgress) in the event loop's thread
+    """
+
+    def __init__(self, repo_or_path, runner=None, *args, **kwargs):
+        if isinstance(repo_or_path, Gittle):
+            self.gittle = repo_or_path
+        else:
+            self.gittle = Gittle(repo_or_path, *args, **kwargs)
+        self.runner = runner or DEFAULT_RUNNER
+        self._lock = None
+
+    @property
+    def lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _run(self, method, *args, **kwargs):
+        async with self.lock:
+            return await self.runner.run(method, *args, **kwargs)
+
+    @classmethod
+    async def clone(cls, origin_uri, local_path, runner=None, callback=None, **kwargs):
+        runner = runner or DEFAULT_RUNNER
+        repo = await runner.run(Gittle.clone, origin_uri, local_path, callback=callback, **kwargs)
+        return cls(repo, runner=runner)
+
+    async def fetch(self, origin_uri=None, callback=None, **kwargs):
+        return await self._run(self.gittle.fetch, origin_uri, callback=callback, **kwargs)
+
+    async def fetch_remote(self, origin_uri=None, callback=None, **kwargs):
+        return await self._run(self.gittle.fetch_remote, origin_uri, callback=callback, **kwargs)
+
+    async def push(self, origin_uri=None, callback=None, **kwargs):
+        return await self._run(self.gittle.push, origin_uri, callback=callback, **kwargs)
+
+    async def pull(self, origin_uri=None, callback=None, **kwargs):
+        return await self._run(self.gittle.pull, origin_uri, callback=callback, **kwargs)
+
+    def _sync(self, origin_uri=None, progress=None):
+        self.gittle.push(origin_uri, progress=progress)
+        return self.gittle.pull(origin_uri, progress=progress)
+
+    async def sync(self, origin_uri=None, callback=None):
+        """Push then pull, like Gittle.sync
+        """
+        return await self._run(self._sync, origin_uri, callback=callback)
+
+    def __getattr__(self, name):
+        # Everything else is the (blocking) Gittle's
+        if name == 'gittle':
+            raise AttributeError(name)
+        return getattr(self.gittle, name)
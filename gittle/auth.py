@@ -6,6 +6,8 @@
 
 # Python imports
 import os
+import threading
+from hashlib import sha1
 try:
     # Try importing the faster version
     from io import StringIO
@@ -14,15 +16,8 @@ except ImportError:
     from io import StringIO
 
 
-# Paramiko imports
-try:
-    import paramiko
-    HAS_PARAMIKO = True
-except ImportError:
-    HAS_PARAMIKO = False
-
 # Local imports
-from .exceptions import InvalidRSAKey
+from .exceptions import InvalidRSAKey, InvalidPrivateKey
 
 
 # Exports
@@ -31,6 +26,31 @@ __all__ = ('GittleAuth',)
 if os.sys.version_info.major > 2 or (os.sys.version_info.major == 2 and os.sys.version_info.minor < 7):
     str = str
 
+# Paramiko key classes tried in order (Ed25519Key needs paramiko >= 2.2)
+KEY_CLASS_NAMES = (
+    'RSAKey',
+    'ECDSAKey',
+    'Ed25519Key',
+    'DSSKey',
+)
+
+# Parsed keys shared by all GittleAuth instances of the process
+# {('path', path, mtime, size) or ('data', sha1): key}
+_key_cache = {}
+_key_cache_lock = threading.Lock()
+
+
+def get_paramiko():
+    """The paramiko module or None if it isn't installed,
+    only imported once a key is needed (it is slow to import)
+    """
+    try:
+        import paramiko
+    except ImportError:
+        return None
+    return paramiko
+
+
 def get_pkey_file(pkey):
     if isinstance(pkey, str):
         if os.path.exists(pkey):
@@ -43,6 +63,68 @@ def get_pkey_file(pkey):
     return pkey_file
 
 
+def _key_classes():
+    paramiko = get_paramiko()
+    return [
+        getattr(paramiko, name)
+        for name in KEY_CLASS_NAMES
+        if hasattr(paramiko, name)
+    ]
+
+
+def parse_private_key(data, password=None):
+    """Paramiko key from the text of a private key, whatever its type
+    """
+    for key_class in _key_classes():
+        try:
+            return key_class.from_private_key(StringIO(data), password=password)
+        except (get_paramiko().SSHException, ValueError, TypeError):
+            continue
+    raise InvalidPrivateKey('Not a private key paramiko can read')
+
+
+def clear_key_cache():
+    with _key_cache_lock:
+        _key_cache.clear()
+
+
+def load_private_key(pkey, password=None):
+    """Paramiko key from a path, the raw key or a file object,
+    cached by path and mtime or by content hash so that each key
+    is only decoded once per process
+    Paramiko keys are returned as they are
+    """
+    if not isinstance(pkey, str) and not hasattr(pkey, 'read'):
+        return pkey
+    if get_paramiko() is None:
+        raise InvalidRSAKey('Requires paramiko to build RSA key')
+
+    data = None
+    if isinstance(pkey, str) and os.path.exists(pkey):
+        st = os.stat(pkey)
+        cache_key = ('path', os.path.abspath(pkey), st.st_mtime, st.st_size)
+    else:
+        data = pkey if isinstance(pkey, str) else pkey.read()
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        cache_key = ('data', sha1(data.encode('utf-8')).hexdigest())
+    if password is not None:
+        cache_key += (sha1(password.encode('utf-8')).hexdigest(),)
+
+    with _key_cache_lock:
+        if cache_key in _key_cache:
+            return _key_cache[cache_key]
+
+    if data is None:
+        with open(pkey) as f:
+            data = f.read()
+    key = parse_private_key(data, password)
+
+    with _key_cache_lock:
+        _key_cache[cache_key] = key
+    return key
+
+
 class GittleAuth(object):
     KWARG_KEYS = (
         'username',
@@ -52,22 +134,20 @@ class GittleAuth(object):
         'allow_agent'
     )
 
-    def __init__(self, username=None, password=None, pkey=None, look_for_keys=None, allow_agent=None):
+    def __init__(self, username=None, password=None, pkey=None, look_for_keys=None, allow_agent=None, passphrase=None):
         self.username = username
         self.password = password
         self.allow_agent = allow_agent
         self.look_for_keys = look_for_keys
+        # Decrypts pkey, which is then passed on already decrypted
+        self.passphrase = passphrase
 
         self.pkey = self.setup_pkey(pkey)
 
     def setup_pkey(self, pkey):
-        pkey_file = get_pkey_file(pkey)
-        if not pkey_file:
+        if not pkey:
             return None
-        if HAS_PARAMIKO:
-            return paramiko.RSAKey.from_private_key(pkey_file)
-        else:
-            raise InvalidRSAKey('Requires paramiko to build RSA key')
+        return load_private_key(pkey, password=self.passphrase)
 
     @property
     def can_password(self):
@@ -5,3 +5,27 @@ class InvalidRemoteUrl(Exception):
 class InvalidRSAKey(Exception):
     """Can't generate key ..."""
     pass
+
+class InvalidPrivateKey(InvalidRSAKey):
+    """The private key isn't a RSA, ECDSA, Ed25519 or DSA key paramiko can read"""
+    pass
+
+class NonFastForward(Exception):
+    """The branch can't be fast forwarded, it has diverged"""
+    pass
+
+class WorkingChangesConflict(Exception):
+    """Local changes in the working directory would be overwritten"""
+    pass
+
+class OperationCancelled(Exception):
+    """The operation was cancelled while in progress"""
+    pass
+
+class ReadOnlyRepository(Exception):
+    """The repository was opened read-only"""
+    pass
+
+class RefChanged(ValueError):
+    """The ref was changed by someone else while it was being updated"""
+    pass
@@ -13,15 +13,18 @@
 import os
 import copy
 import logging
-from hashlib import sha1
+from stat import S_ISREG
 from shutil import rmtree
 from functools import partial, wraps
 
 # Dulwich imports
 from dulwich.repo import Repo as DulwichRepo
 from dulwich.client import get_transport_and_path
-from dulwich.index import build_index_from_tree, changes_from_tree
-from dulwich.objects import Tree, Blob
+from dulwich.index import build_index_from_tree, changes_from_tree, index_entry_from_stat
+from dulwich.objects import Tree, Blob, Commit, Tag, S_ISGITLINK
+from dulwich.object_store import tree_lookup_path
+from dulwich.pack import write_pack_data, write_pack_objects, create_delta
+from dulwich.protocol import ZERO_SHA
 from dulwich.server import update_server_info
 from dulwich.refs import SYMREF
 from dulwich.errors import NotGitRepository
@@ -31,7 +34,8 @@ import funky
 
 # Local imports
 from gittle.auth import GittleAuth
-from gittle.exceptions import InvalidRemoteUrl
+from gittle.exceptions import InvalidRemoteUrl, NonFastForward, WorkingChangesConflict, ReadOnlyRepository
+from gittle.progress import TransferProgress
 from gittle import utils
 
 
@@ -67,6 +71,15 @@ def bare_only(method):
     return f
 
 
+def read_write(method):
+    @wraps(method)
+    def f(self, *args, **kwargs):
+        if self.readonly:
+            raise ReadOnlyRepository("%s can not be called on a read-only repository" % method.__name__)
+        return method(self, *args, **kwargs)
+    return f
+
+
 class Gittle(object):
     """All paths used in Gittle external methods must be paths relative to the git repository
     """
@@ -96,6 +109,16 @@ class Gittle(object):
     REFS_REMOTES = 'refs/remotes/'
     REFS_TAGS = 'refs/tags/'
 
+    # Formats tried in order when resolving a short reference
+    DWIM_FORMATS = (
+        "%s",
+        "refs/%s",
+        "refs/tags/%s",
+        "refs/heads/%s",
+        "refs/remotes/%s",
+        "refs/remotes/%s/HEAD",
+    )
+
     # Name pattern truths
     # Used for detecting if files are :
     # - deleted
@@ -111,43 +134,109 @@ class Gittle(object):
     # Tree depth
     MAX_TREE_DEPTH = 1000
 
+    # Pool of SSH connections to remotes, see pool.ClientPool
+    # (None, the default, builds a new transport every time)
+    CLIENT_POOL = None
+
+    # How objects are read : None (dulwich's default) or OBJECT_ACCESS_MMAP
+    # (packs and indexes are memory-mapped, see utils.mmaps.MmapObjectStore)
+    OBJECT_ACCESS = None
+    OBJECT_ACCESS_MMAP = 'mmap'
+
+    # Files at least this big are staged by streaming them into the object store
+    STREAM_BLOB_SIZE = 1024 * 1024
+
+    # Remote commits whose trees are searched for thin pack delta bases
+    MAX_THIN_BASES = 8
+
     # Acceptable Root paths
     ROOT_PATHS = (os.path.curdir, os.path.sep)
 
     def __init__(self, repo_or_path, origin_uri=None, auth=None, report_activity=None, *args, **kwargs):
+        # Read-only handles refuse every write (see open_readonly)
+        self.readonly = kwargs.pop('readonly', False)
+        self.object_access = kwargs.pop('object_access', self.OBJECT_ACCESS)
+
+        # The dulwich repo is opened on first use
+        self._repo = None
         if isinstance(repo_or_path, DulwichRepo):
-            self.repo = repo_or_path
+            self._repo = repo_or_path
+            self.path = repo_or_path.path
         elif isinstance(repo_or_path, Gittle):
-            self.repo = DulwichRepo(repo_or_path.path)
+            self.path = repo_or_path.path
         elif isinstance(repo_or_path, str):
-            path = os.path.abspath(repo_or_path)
-            self.repo = DulwichRepo(path)
+            self.path = os.path.abspath(repo_or_path)
         else:
             logging.warning('Repo is of type %s' % type(repo_or_path))
             raise Exception('Gittle must be initialized with either a dulwich repository or a string to the path')
 
-        # Set path
-        self.path = self.repo.path
-
         # The remote url
         self.origin_uri = origin_uri
 
         # Report client activty
         self._report_activity = report_activity
 
-        # Build ignore filter
-        self.hidden_regexes = copy.copy(self.HIDDEN_REGEXES)
-        self.hidden_regexes.extend(self._get_ignore_regexes())
-        self.ignore_filter = utils.paths.path_filter_regex(self.hidden_regexes)
-        self.filters = [
-            self.ignore_filter,
-        ]
+        # Ignore filters and authenticator are built on first use
+        self._filters = None
+        self._authenticator = auth
+        self._auth_args = (args, kwargs)
 
-        # Get authenticator
-        if auth:
-            self.authenticator = auth
-        else:
+    @classmethod
+    def open_readonly(cls, path):
+        """Lightweight handle for reading a (bare) repository :
+        ignore rules and authenticator are only built if used,
+        writes raise ReadOnlyRepository
+        """
+        return cls(path, readonly=True)
+
+    @property
+    def repo(self):
+        if self._repo is None:
+            self._repo = self._setup_object_access(DulwichRepo(self.path))
+        return self._repo
+
+    def _setup_object_access(self, repo):
+        if self.object_access == self.OBJECT_ACCESS_MMAP:
+            repo.object_store = utils.mmaps.MmapObjectStore(repo.object_store.path)
+        elif self.object_access is not None:
+            raise ValueError('Unknown object access mode: %s' % self.object_access)
+        return repo
+
+    @repo.setter
+    def repo(self, repo):
+        self._repo = repo
+
+    @property
+    def filters(self):
+        if self._filters is None:
+            self._filters = [
+                self.ignore_filter,
+            ]
+        return self._filters
+
+    @property
+    def hidden_regexes(self):
+        if getattr(self, '_hidden_regexes', None) is None:
+            self._hidden_regexes = copy.copy(self.HIDDEN_REGEXES)
+            self._hidden_regexes.extend(self._get_ignore_regexes())
+        return self._hidden_regexes
+
+    @property
+    def ignore_filter(self):
+        if getattr(self, '_ignore_filter', None) is None:
+            self._ignore_filter = utils.paths.path_filter_regex(self.hidden_regexes)
+        return self._ignore_filter
+
+    @property
+    def authenticator(self):
+        if self._authenticator is None:
+            args, kwargs = self._auth_args
             self.auth(*args, **kwargs)
+        return self._authenticator
+
+    @authenticator.setter
+    def authenticator(self, authenticator):
+        self._authenticator = authenticator
 
     def report_activity(self, *args, **kwargs):
         if not self._report_activity:
@@ -261,14 +350,47 @@ class Gittle(object):
     # Generate a branch selector (used for pushing)
     def _wants_branch(self, branch_name=None):
         branch_name = branch_name or self.active_branch
-        refs_key = self._format_ref_branch(branch_name)
-        sha = self.branches[branch_name]
+        return self._wants_push([self._format_ref_branch(branch_name)])
+
+    def _push_updates(self, refs):
+        """Map the refs (names or "src:dst" refspecs) to push
+        to a dict of {remote_ref: sha}, an empty src deletes dst
+        """
+        updates = {}
+        for ref in refs:
+            force, src, dst = utils.git.parse_refspec(ref)
+            src_ref = ''
+            if src:
+                src_ref = self.dwim_reference(src)
+            if src_ref == 'HEAD':
+                src_ref = self._format_ref_branch(self.active_branch)
+
+            # Short destinations are branches (or tags when pushing a tag)
+            dst = dst or src_ref
+            if not dst.startswith('refs/'):
+                if src_ref.startswith(self.REFS_TAGS):
+                    dst = self._format_ref_tag(dst)
+                else:
+                    dst = self._format_ref_branch(dst)
+
+            # Deletion (":dst")
+            if not src_ref:
+                updates[dst] = ZERO_SHA
+                continue
+            updates[dst] = self.repo.refs[src_ref]
+        return updates
+
+    # Generate a refs selector (used for pushing several refs at once)
+    def _wants_push(self, refs):
+        updates = self._push_updates(refs)
 
         def wants_func(old):
-            refs_key = self._format_ref_branch(branch_name)
-            return {
-                refs_key: sha
-            }
+            wants_func.remote_refs.update(old)
+            new = dict(old)
+            new.update(updates)
+            return new
+        wants_func.updates = updates
+        wants_func.remote_refs = {}
         return wants_func
 
     def _get_ignore_regexes(self):
@@ -323,13 +445,26 @@ class Gittle(object):
     def is_repo(cls, path):
         """Returns True if path is a git repository, False if it is not"""
         try:
-            repo = Gittle(path)
+            # Gittle opens its repo lazily, open it here
+            DulwichRepo(path)
         except NotGitRepository:
             return False
         else:
             return True
 
-    def get_client(self, origin_uri=None, **kwargs):
+    def _report_activity_func(self, progress=None):
+        """Client activity reporter also feeding a TransferProgress's byte counts
+        """
+        progress = TransferProgress.wrap(progress)
+        if not progress:
+            return self.report_activity
+
+        def report_activity(*args, **kwargs):
+            progress.report_activity(*args, **kwargs)
+            return self.report_activity(*args, **kwargs)
+        return report_activity
+
+    def get_client(self, origin_uri=None, progress=None, **kwargs):
         # Get the remote URL
         origin_uri = origin_uri or self.origin_uri
 
@@ -343,27 +478,162 @@ class Gittle(object):
         client_kwargs.update(auth_kwargs)
         client_kwargs.update(kwargs)
         client_kwargs.update({
-            'report_activity': self.report_activity
+            'report_activity': self._report_activity_func(progress)
         })
 
+        if self.CLIENT_POOL is not None:
+            return self.CLIENT_POOL.get_client(origin_uri, auth=self.authenticator, **client_kwargs)
         client, remote_path = get_transport_and_path(origin_uri, **client_kwargs)
         return client, remote_path
 
-    def push_to(self, origin_uri, branch_name=None, progress=None):
-        selector = self._wants_branch(branch_name=branch_name)
-        client, remote_path = self.get_client(origin_uri)
-        return client.send_pack(
+    def _generate_pack_contents(self, progress=None, generate_pack_contents=None):
+        """Object generator for sending packs, counting objects for progress
+        """
+        generate_pack_contents = generate_pack_contents or self.repo.object_store.generate_pack_contents
+        progress = TransferProgress.wrap(progress)
+        if not progress:
+            return generate_pack_contents
+
+        def generate(have, want):
+            objects = generate_pack_contents(have, want)
+            progress.update('counting', objects_counted=len(objects))
+            return objects
+        return generate
+
+    def _thin_bases(self, haves, selector):
+        """Remote commits we have, whose trees hold candidate delta bases
+        The remote's current values of the refs we update come first
+        """
+        object_store = self.repo.object_store
+        remote_refs = selector.remote_refs
+        old_shas = [
+            remote_refs[ref]
+            for ref in selector.updates
+            if ref in remote_refs
+        ]
+        bases = []
+        for sha in old_shas + list(haves):
+            if len(bases) >= self.MAX_THIN_BASES:
+                break
+            if sha in bases or not sha in object_store:
+                continue
+            if isinstance(object_store[sha], Commit):
+                bases.append(sha)
+        return bases
+
+    def _sent_blob_paths(self, objects):
+        """{blob sha: full path} of the blobs sent, found by walking the trees
+        sent from the commits' roots (unchanged subtrees aren't sent and hold
+        no new blobs), the paths the object finder gives are only basenames
+        """
+        sent_trees = dict(
+            (obj.id, obj)
+            for obj, path in objects
+            if isinstance(obj, Tree)
+        )
+        roots = [obj.tree for obj, path in objects if isinstance(obj, Commit)]
+        paths = {}
+        stack = [('', sha) for sha in roots if sha in sent_trees]
+        seen = set()
+        while stack:
+            prefix, tree_sha = stack.pop()
+            if tree_sha in seen:
+                continue
+            seen.add(tree_sha)
+            for entry in list(sent_trees[tree_sha].items()):
+                full_path = prefix + entry.path
+                if entry.mode == self.MODE_DIRECTORY:
+                    if entry.sha in sent_trees:
+                        stack.append((full_path + '/', entry.sha))
+                elif not entry.sha in paths:
+                    paths[entry.sha] = full_path
+        return paths
+
+    def _thin_pack_records(self, objects, bases):
+        """Pack records where blobs are deltas against the remote's blob
+        at the same path, when there is one and the delta is smaller
+        """
+        object_store = self.repo.object_store
+        trees = [object_store[sha].tree for sha in bases]
+        full_paths = self._sent_blob_paths(objects)
+
+        def base_blob(path):
+            for tree in trees:
+                try:
+                    mode, sha = tree_lookup_path(object_store.__getitem__, tree, path)
+                except KeyError:
+                    continue
+                if sha in object_store:
+                    return object_store[sha]
+            return None
+
+        for obj, path in objects:
+            raw = obj.as_raw_string()
+            base = None
+            if path and isinstance(obj, Blob):
+                base = base_blob(full_paths.get(obj.id, path))
+            if base is None or base.id == obj.id:
+                yield obj.type_num, obj.sha().digest(), None, raw
+                continue
+            delta = create_delta(base.as_raw_string(), raw)
+            if not isinstance(delta, type(raw)):
+                delta = type(raw)().join(delta)
+            if len(delta) >= len(raw):
+                yield obj.type_num, obj.sha().digest(), None, raw
+                continue
+            yield obj.type_num, obj.sha().digest(), base.sha().digest(), delta
+
+    def _thin_pack_writer(self, selector):
+        """Returns a (generate_pack_contents, write_pack) couple
+        for sending thin packs deltified against the remote's objects
+        """
+        generate_pack_contents = self.repo.object_store.generate_pack_contents
+        state = {}
+
+        def generate(have, want):
+            state['bases'] = self._thin_bases(have, selector)
+            return generate_pack_contents(have, want)
+
+        def write_pack(f, objects):
+            records = self._thin_pack_records(objects, state.get('bases', []))
+            return write_pack_data(f, len(objects), records)
+        return generate, write_pack
+
+    def push_to(self, origin_uri, branch_name=None, progress=None, refs=None, thin=True):
+        """Push refs (branch or tag names, "src:dst" refspecs) in a single round trip,
+        defaults to branch_name or the active branch
+
+        Only objects missing from the remote's advertised refs are sent and
+        with thin set, blobs are sent as deltas against the remote's version
+
+        progress can be a dulwich style message function or a TransferProgress
+        """
+        refs = refs or [self._format_ref_branch(branch_name or self.active_branch)]
+        selector = self._wants_push(refs)
+        client, remote_path = self.get_client(origin_uri, progress=progress)
+
+        generate, write_pack = self._thin_pack_writer(selector)
+        if not thin:
+            generate = self.repo.object_store.generate_pack_contents
+            write_pack = write_pack_objects
+
+        refs = client.send_pack(
             remote_path,
             selector,
-            self.repo.object_store.generate_pack_contents,
-            progress=progress
+            self._generate_pack_contents(progress, generate),
+            progress=progress,
+            write_pack=write_pack
         )
+        if TransferProgress.wrap(progress):
+            progress.finish()
+        return refs
 
     # Like: git push
-    def push(self, origin_uri=None, branch_name=None, progress=None):
-        return self.push_to(origin_uri, branch_name, progress)
+    def push(self, origin_uri=None, branch_name=None, progress=None, refs=None, thin=True):
+        return self.push_to(origin_uri, branch_name, progress, refs=refs, thin=thin)
 
     # Not recommended at ALL ... !!!
+    @read_write
     def dirty_pull_from(self, origin_uri, branch_name=None):
         # Remove all previously existing data
         rmtree(self.path)
@@ -373,92 +643,341 @@ class Gittle(object):
         # Fetch brand new copy from remote
         return self.pull_from(origin_uri, branch_name)
 
-    def pull_from(self, origin_uri, branch_name=None):
-        return self.fetch(origin_uri)
+    @read_write
+    def pull_from(self, origin_uri, branch_name=None, progress=None, origin=None):
+        """Fetch branch_name (defaults to the active branch) and fast forward
+        the local branch to it, returns the branch's new SHA
+
+        Raises NonFastForward if the branches have diverged
+        """
+        origin = origin or self.DEFAULT_REMOTE
+        branch_name = branch_name or self.active_branch
+        refs = [branch_name] if branch_name else None
+        self.fetch(origin_uri, refs=refs, origin=origin, progress=progress)
+
+        remote_ref = self._format_ref_remote('%s/%s' % (origin, branch_name))
+        if not branch_name or not remote_ref in self.repo.refs:
+            return None
+        return self._merge_fast_forward(branch_name, self.repo.refs[remote_ref], progress=progress)
 
     # Like: git pull
-    def pull(self, origin_uri=None, branch_name=None):
-        return self.pull_from(origin_uri, branch_name)
+    def pull(self, origin_uri=None, branch_name=None, progress=None):
+        return self.pull_from(origin_uri, branch_name, progress=progress)
+
+    def _fetch_refspecs(self, refs=None, origin=None, bare=None):
+        """Refspecs selecting the remote refs a fetch asks for,
+        either the explicit refs given or the remote's "fetch" refspec
+        """
+        if refs:
+            return list(refs)
+
+        origin = origin or self.DEFAULT_REMOTE
+        refspecs = self.remote_refspecs(origin)
+
+        # Unknown remote (e.g: clone), get all branches and tags
+        if not refspecs:
+            heads_base = self.REFS_BRANCHES if bare else self._format_ref_remote(origin + '/')
+            refspecs = [
+                '+%s*:%s*' % (self.REFS_BRANCHES, heads_base),
+                '+%s*:%s*' % (self.REFS_TAGS, self.REFS_TAGS),
+            ]
+        return refspecs + ['HEAD']
+
+    def _map_fetched_refs(self, remote_refs, refspecs, origin=None, bare=None):
+        """Maps remote refs through refspecs
+        Returns a dict of {local_ref: remote_ref}
+        """
+        origin = origin or self.DEFAULT_REMOTE
+        heads_base = self.REFS_BRANCHES if bare else self._format_ref_remote(origin + '/')
+        refs = utils.git.clean_refs(remote_refs)
+
+        mapping = {}
+        for refspec in refspecs:
+            force, src, dst = utils.git.parse_refspec(refspec)
+
+            # Glob refspec
+            if '*' in src:
+                for ref in refs:
+                    local_ref = utils.git.refspec_expand(src, dst, ref)
+                    if local_ref:
+                        mapping[local_ref] = ref
+                continue
+
+            # Short names are resolved like dwim_reference does
+            candidates = [f % src for f in self.DWIM_FORMATS]
+            ref = funky.first([c for c in candidates if c in refs], None)
+            if ref is None:
+                continue
+            if dst is None and ref.startswith(self.REFS_BRANCHES):
+                dst = heads_base + ref[len(self.REFS_BRANCHES):]
+            mapping[dst or ref] = ref
+        return mapping
+
+    def _followed_tags(self, remote_refs, shas):
+        """Remote tags pointing at one of the given SHAs or at an object
+        we already have, like git's automatic tag following
+        """
+        object_store = self.repo.object_store
+        peeled = utils.git.peeled_refs(remote_refs)
+        return {
+            ref: remote_refs[ref]
+            for ref, sha in list(peeled.items())
+            if ref.startswith(self.REFS_TAGS) and (sha in shas or sha in object_store)
+        }
+
+    # Generate a refs selector (used for fetching)
+    def _wants_refs(self, refspecs, origin=None, bare=None):
+        object_store = self.repo.object_store
+
+        def wants_func(remote_refs):
+            mapping = self._map_fetched_refs(remote_refs, refspecs, origin, bare)
+            shas = set([remote_refs[ref] for ref in list(mapping.values())])
+            shas.update(list(self._followed_tags(remote_refs, shas).values()))
+            return [
+                sha
+                for sha in shas
+                if not sha in object_store
+            ]
+        return wants_func
+
+    def _pack_names(self):
+        return set([pack.name() for pack in self.repo.object_store.packs])
+
+    def _pack_spool(self):
+        return utils.packs.PackSpool(self.repo.object_store.pack_dir)
+
+    def _complete_commits(self, commits, shas):
+        """Returns the commits whose trees and history are all present,
+        objects outside of shas that we have are assumed to be complete
+        """
+        object_store = self.repo.object_store
+        complete = set()
+        incomplete = set()
+
+        def is_complete(sha):
+            if sha in complete:
+                return True
+            if sha in incomplete or not sha in object_store:
+                return False
+            if not sha in shas:
+                return True
+            obj = object_store[sha]
+            if isinstance(obj, Commit):
+                children = [obj.tree] + obj.parents
+            elif isinstance(obj, Tree):
+                children = [
+                    entry.sha
+                    for entry in list(obj.items())
+                    # Skip submodules
+                    if not S_ISGITLINK(entry.mode)
+                ]
+            else:
+                children = []
+            ok = all(map(is_complete, children))
+            (complete if ok else incomplete).add(sha)
+            return ok
+
+        # Parents first, so checking history never recurses deeply
+        commits = [sha for sha in commits if sha in object_store]
+        for sha in reversed(self._topo_order(commits)):
+            is_complete(sha)
+        return set(commits) & complete
+
+    def _topo_order(self, commits):
+        """Order commits so that parents come after their children
+        """
+        object_store = self.repo.object_store
+        commits = set(commits)
+        parents = {
+            sha: [p for p in object_store[sha].parents if p in commits]
+            for sha in commits
+        }
+        children_count = dict.fromkeys(commits, 0)
+        for sha in commits:
+            for parent in parents[sha]:
+                children_count[parent] += 1
+        ordered = []
+        todo = [sha for sha, count in list(children_count.items()) if not count]
+        while todo:
+            sha = todo.pop()
+            ordered.append(sha)
+            for parent in parents[sha]:
+                children_count[parent] -= 1
+                if not children_count[parent]:
+                    todo.append(parent)
+        return ordered
+
+    def _resume_heads(self, spool):
+        """Salvage an interrupted download and return the tips of
+        the complete history it contains, to be advertised as haves
+        """
+        pack = spool.salvage(self.repo.object_store)
+        if pack is None:
+            return []
+        object_store = self.repo.object_store
+        commits = self._complete_commits(spool.commits, set(pack))
+        parents = set([
+            parent
+            for sha in commits
+            for parent in object_store[sha].parents
+        ])
+        return list(commits - parents)
+
+    def _fetch_resumable(self, client, remote_path, determine_wants, progress=None):
+        """Fetch spooling the pack to objects/pack, if a previous spool was
+        interrupted its whole objects are kept and used when negotiating
+        """
+        object_store = self.repo.object_store
+        spool = self._pack_spool()
+
+        heads = [
+            sha
+            for sha in list(self.branches.values())
+            if sha in object_store
+        ]
+        heads.extend(self._resume_heads(spool))
+        graph_walker = self.repo.get_graph_walker(heads=list(set(heads)))
 
-    def fetch_remote(self, origin_uri=None):
+        try:
+            remote_refs = client.fetch_pack(remote_path, determine_wants, graph_walker, spool.write, progress=progress)
+        finally:
+            # Keep what we got for the next attempt
+            spool.close()
+        spool.commit(object_store)
+        return remote_refs
+
+    @read_write
+    def fetch_remote(self, origin_uri=None, refs=None, origin=None, bare=None, progress=None, resumable=False):
+        """Fetch the objects for the remote refs selected by refs (names or refspecs)
+        or the remote's configured refspecs, returns all of the remote's refs
+
+        progress can be a dulwich style message function or a TransferProgress
+        resumable spools the download so that an interrupted fetch can be resumed
+        """
         # Get client
-        client, remote_path = self.get_client(origin_uri=origin_uri)
+        client, remote_path = self.get_client(origin_uri=origin_uri, progress=progress)
+
+        refspecs = self._fetch_refspecs(refs, origin, bare)
+        determine_wants = self._wants_refs(refspecs, origin, bare)
+
+        transfer = TransferProgress.wrap(progress)
+        if transfer:
+            old_packs = self._pack_names()
 
         # Fetch data from remote repository
-        remote_refs = client.fetch(remote_path, self.repo)
+        if resumable:
+            remote_refs = self._fetch_resumable(client, remote_path, determine_wants, progress=progress)
+        else:
+            remote_refs = client.fetch(remote_path, self.repo, determine_wants=determine_wants, progress=progress)
+
+        # Count objects of the newly added packs
+        if transfer:
+            new_packs = [
+                pack
+                for pack in self.repo.object_store.packs
+                if not pack.name() in old_packs
+            ]
+            transfer.update(
+                'indexing',
+                objects_indexed=sum(map(len, new_packs)),
+                objects_resolved=max(transfer.stats['objects_resolved'], transfer.total_deltas),
+            )
 
         return remote_refs
 
 
-    def _setup_fetched_refs(self, refs, origin, bare):
-        remote_tags = utils.git.subrefs(refs, 'refs/tags')
-        remote_heads = utils.git.subrefs(refs, 'refs/heads')
+    def _setup_fetched_refs(self, refs, origin, bare, fetch_refs=None, update_heads=True):
+        refspecs = self._fetch_refspecs(fetch_refs, origin, bare)
+        mapping = self._map_fetched_refs(refs, refspecs, origin, bare)
 
-        # Filter refs
-        clean_remote_tags = utils.git.clean_refs(remote_tags)
-        clean_remote_heads = utils.git.clean_refs(remote_heads)
-
-        # Base of new refs
-        heads_base = 'refs/remotes/' + origin
-        if bare:
-            heads_base = 'refs/heads'
+        # Remote tracking refs (or branches if bare)
+        updates = {
+            local_ref: refs[remote_ref]
+            for local_ref, remote_ref in list(mapping.items())
+        }
 
-        # Import branches
-        self.import_refs(
-            heads_base,
-            clean_remote_heads
-        )
+        # Tags
+        shas = set(updates.values())
+        for ref, sha in list(self._followed_tags(refs, shas).items()):
+            updates.setdefault(ref, sha)
 
-        # Import tags
-        self.import_refs(
-            'refs/tags',
-            clean_remote_tags
-        )
+        # Update fetched branches and HEAD (bare mirrors and first fetch only,
+        # otherwise local branches are moved by pull)
+        fetched = set(mapping.values())
+        for ref, sha in list(utils.git.clean_refs(refs).items()):
+            if not update_heads:
+                break
+            if ref in fetched and (ref == 'HEAD' or ref.startswith(self.REFS_BRANCHES)):
+                updates[ref] = sha
 
-        # Update HEAD
-        for k, v in list(utils.git.clean_refs(refs).items()):
-            self[k] = v
+        # Write all refs in one pass
+        self.set_refs(updates)
 
 
-    def fetch(self, origin_uri=None, bare=None, origin=None):
+    @read_write
+    def fetch(self, origin_uri=None, bare=None, origin=None, refs=None, progress=None, resumable=False):
         bare = bare or False
         origin = origin or self.DEFAULT_REMOTE
 
+        # Local branches are only set from the remote's in bare repos
+        # or when we have nothing yet (e.g: clone)
+        update_heads = bare or not self.has_commits
+
         # Remote refs
-        remote_refs = self.fetch_remote(origin_uri)
+        remote_refs = self.fetch_remote(origin_uri, refs=refs, origin=origin, bare=bare, progress=progress, resumable=resumable)
 
         # Update head
         # Hit repo because head doesn't yet exist so
         # print("REFS = %s" % remote_refs)
 
+        transfer = TransferProgress.wrap(progress)
+
         # If no refs (empty repository()
         if not remote_refs:
+            if transfer:
+                transfer.finish()
             return
 
         # Update refs (branches, tags, HEAD)
-        self._setup_fetched_refs(remote_refs, origin, bare)
+        self._setup_fetched_refs(remote_refs, origin, bare, fetch_refs=refs, update_heads=update_heads)
 
         # Checkout working directories
-        if not bare and self.has_commits:
-            self.checkout_all()
-        else:
-            self.update_server_info()
+        # (bare repositories had their server info updated with the refs)
+        if not bare and update_heads and self.has_commits:
+            self.checkout_all(progress=progress)
+
+        if transfer:
+            transfer.finish()
 
 
     @classmethod
-    def clone(cls, origin_uri, local_path, auth=None, mkdir=True, bare=False, *args, **kwargs):
-        """Clone a remote repository"""
+    def clone(cls, origin_uri, local_path, auth=None, mkdir=True, bare=False, progress=None, resumable=False, *args, **kwargs):
+        """Clone a remote repository
+        progress can be a dulwich style message function or a TransferProgress
+
+        resumable clones keep what was downloaded if interrupted, cloning again
+        to the same path resumes. Otherwise a failed clone removes the repository
+        """
+        created = not os.path.exists(local_path)
         mkdir_safe(local_path)
 
-        # Initialize the local repository
-        if bare:
+        # Initialize the local repository (or reuse the interrupted one)
+        if resumable and cls.is_repo(local_path):
+            local_repo = cls(local_path)
+        elif bare:
             local_repo = cls.init_bare(local_path)
         else:
             local_repo = cls.init(local_path)
 
         repo = cls(local_repo, origin_uri=origin_uri, auth=auth, *args, **kwargs)
 
-        repo.fetch(bare=bare)
+        try:
+            repo.fetch(bare=bare, progress=progress, resumable=resumable)
+        except:
+            # Don't leave a half initialised repository behind
+            if created and not resumable:
+                rmtree(local_path)
+            raise
 
         # Add origin
         repo.add_remote('origin', origin_uri)
@@ -472,6 +991,7 @@ class Gittle(object):
         kwargs.setdefault('bare', True)
         return cls.clone(*args, **kwargs)
 
+    @read_write
     def _commit(self, committer=None, author=None, message=None, files=None, tree=None, *args, **kwargs):
 
         if not tree:
@@ -502,25 +1022,24 @@ class Gittle(object):
 
             # str only
             try:
-                data = file_info['data'].encode('ascii')
+                data = file_info['data']
+                if isinstance(data, str):
+                    data = data.encode('ascii')
                 name = file_info['name'].encode('ascii')
                 mode = file_info['mode']
             except:
                 # Skip file on encoding errors
                 continue
 
-            blob = Blob()
-
-            blob.data = data
-
-            # Store file's contents
-            self.repo.object_store.add_object(blob)
+            # Store file's contents, data can also be a file object
+            # or an iterator of strings, written in chunks
+            blob_id = utils.streams.write_blob(self.repo.object_store, data, file_info.get('size'))
 
             # Add blob entry
             tree.add(
                 name,
                 mode,
-                blob.id
+                blob_id
             )
 
         # Store tree
@@ -543,6 +1062,7 @@ class Gittle(object):
             **kwargs
         )
 
+    @read_write
     def commit_structure(self, name=None, email=None, message=None, structure=None, *args, **kwargs):
         """Main use is to do commits directly to bare repositories
         For example doing a first Initial Commit so the repo can be cloned and worked on right away
@@ -576,13 +1096,7 @@ class Gittle(object):
             raise KeyError
 
         abspath = self.abspath(relpath)
-
-        with open(abspath, 'rb') as git_file:
-            data = git_file.read()
-            s = sha1()
-            s.update("blob %u\0" % len(data))
-            s.update(data)
-        return (s.hexdigest(), os.stat(abspath).st_mode)
+        return (utils.streams.hash_blob_file(abspath), os.lstat(abspath).st_mode)
 
     @property
     @funky.transform(set)
@@ -716,14 +1230,41 @@ class Gittle(object):
 
     # Like: git add
     @funky.arglist_method
+    @read_write
     def stage(self, files):
-        return self.repo.stage(files)
+        # Big files are hashed and compressed in chunks, dulwich reads them whole
+        small_files = []
+        big_files = []
+        for path in files:
+            try:
+                st = os.lstat(self.abspath(path))
+            except OSError:
+                small_files.append(path)
+                continue
+            if S_ISREG(st.st_mode) and st.st_size >= self.STREAM_BLOB_SIZE:
+                big_files.append(path)
+            else:
+                small_files.append(path)
+
+        result = None
+        if small_files:
+            result = self.repo.stage(small_files)
+        if big_files:
+            index = self.index
+            for path in big_files:
+                with open(self.abspath(path), 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    sha = utils.streams.write_blob(self.repo.object_store, f, st.st_size)
+                index[path] = index_entry_from_stat(st, sha, 0)
+            index.write()
+        return result
 
     def add(self, *args, **kwargs):
         return self.stage(*args, **kwargs)
 
     # Like: git rm
     @funky.arglist_method
+    @read_write
     def rm(self, files, force=False):
         index = self.index
         index_files = [f for f in files if f in index]
@@ -737,6 +1278,7 @@ class Gittle(object):
 
     # Like: git mv
     @funky.arglist_method
+    @read_write
     def mv(self, files_pair):
         index = self.index
         files_in_index = [f for f in files_pair if f[0] in index]
@@ -749,29 +1291,37 @@ class Gittle(object):
         return
 
     @working_only
-    def _checkout_tree(self, tree):
-        return build_index_from_tree(
+    def _checkout_tree(self, tree, progress=None):
+        result = build_index_from_tree(
             self.repo.path,
             self.repo.index_path(),
             self.repo.object_store,
             tree
         )
+        transfer = TransferProgress.wrap(progress)
+        if transfer:
+            transfer.update('checkout', files_written=len(self.index))
+        return result
 
-    def checkout_all(self, commit_sha=None):
+    @read_write
+    def checkout_all(self, commit_sha=None, progress=None):
         commit_sha = commit_sha or self.head
         commit_tree = self._commit_tree(commit_sha)
         # Rebuild index from the current tree
-        return self._checkout_tree(commit_tree)
+        return self._checkout_tree(commit_tree, progress=progress)
 
+    @read_write
     def checkout(self, ref):
         """Checkout a given ref or SHA
         """
-        self.repo.refs.set_symbolic_ref('HEAD', ref)
+        with self.ref_transaction() as transaction:
+            transaction.set_symbolic('HEAD', ref)
         commit_tree = self._commit_tree(ref)
         # Rebuild index from the current tree
         return self._checkout_tree(commit_tree)
 
     @funky.arglist_method
+    @read_write
     def reset(self, files, commit='HEAD'):
         pass
 
@@ -802,34 +1352,61 @@ class Gittle(object):
 
     def dwim_reference(self, ref):
         """Dwim resolves a short reference to a full reference
+        Uses a single refs snapshot, resolutions are cached until refs change
         """
+        if utils.git.is_sha(ref) and ref in self.repo.object_store:
+            return ref
 
-        # Formats of refs we want to try in order
-        formats = [
-            "%s",
-            "refs/%s",
-            "refs/tags/%s",
-            "refs/heads/%s",
-            "refs/remotes/%s",
-            "refs/remotes/%s/HEAD",
-        ]
-
-        for f in formats:
-            try:
-                fullref = f % ref
-                if not fullref in self.repo:
-                    continue
-                return fullref
-            except:
-                continue
-
-        raise Exception("Could not resolve ref")
+        fullref = self.refs_cache.resolve(ref, self.DWIM_FORMATS)
+        if fullref is None:
+            raise Exception("Could not resolve ref")
+        return fullref
 
     def blob_data(self, sha):
         """Return a blobs content for a given SHA
         """
         return self[sha].data
 
+    def blob_view(self, sha):
+        """memoryview of a blob's content, sharing the decompressed buffer
+        of the object store when it can (see OBJECT_ACCESS_MMAP)
+        """
+        object_store = self.repo.object_store
+        if hasattr(object_store, 'get_raw_view'):
+            type_num, view = object_store.get_raw_view(sha)
+            if type_num != Blob.type_num:
+                raise KeyError('%s is not a blob' % sha)
+            return view
+        return memoryview(self.blob_data(sha))
+
+    def _blob_sha(self, sha_or_path, ref=None):
+        if ref is None and utils.git.is_sha(sha_or_path) and sha_or_path in self.repo.object_store:
+            return sha_or_path
+        tree = self._commit_tree(ref or self.DEFAULT_COMMIT)
+        mode, sha = tree_lookup_path(self.repo.object_store.__getitem__, tree, sha_or_path)
+        return sha
+
+    def open_blob(self, sha_or_path, ref=None):
+        """Read-only file of a blob (by SHA, or by path in ref, HEAD by default)
+        inflated as it's read, so that big files are never all in memory
+        (deltified blobs are, see utils.streams.open_object)
+        Its size attribute is the blob's size
+        """
+        stream = utils.streams.open_object(self.repo.object_store, self._blob_sha(sha_or_path, ref))
+        if stream.type_num != Blob.type_num:
+            stream.close()
+            raise KeyError('%s is not a blob' % sha_or_path)
+        return stream
+
+    def read_blob_range(self, sha_or_path, start, length=None, ref=None):
+        """Bytes [start, start + length) of a blob (to its end if length is None)
+        """
+        stream = self.open_blob(sha_or_path, ref=ref)
+        try:
+            return utils.streams.read_range(stream, start, length)
+        finally:
+            stream.close()
+
     # Get the nth parent back for a given commit
     def get_parent_commit(self, commit, n=None):
         """ Recursively gets the nth parent for a given commit
@@ -851,19 +1428,221 @@ class Gittle(object):
         return self.get_parent_commit(parent, n - 1)
 
     def get_previous_commit(self, commit_ref, n=None):
+        """SHA of the commit n first parents back
+        or commit_ref's own SHA if its history is shorter
+        """
         commit_sha = self._parse_reference(commit_ref)
         n = n or 1
-        commits = self.commits()
-        return funky.next(commits, commit_sha, n=n, default=commit_sha)
+        try:
+            return self.rev_parse('%s~%d' % (commit_sha, n))
+        except KeyError:
+            return commit_sha
 
     def _parse_reference(self, ref_string):
-        # COMMIT_REF~x
-        if '~' in ref_string:
-            ref, count = ref_string.split('~')
-            count = int(count)
-            commit_sha = self._commit_sha(ref)
-            return self.get_previous_commit(commit_sha, count)
-        return self._commit_sha(ref_string)
+        return self.rev_parse(ref_string)
+
+    @property
+    def sha_index(self):
+        """Abbreviated SHA lookups, see utils.packs.ShaPrefixIndex
+        """
+        object_store = self.repo.object_store
+        if getattr(self, '_sha_index', None) is None or self._sha_index.object_store is not object_store:
+            self._sha_index = utils.packs.ShaPrefixIndex(object_store)
+        return self._sha_index
+
+    def _upstream_ref(self, branch_name):
+        """The remote tracking ref a branch merges from
+        (branch.<name>.remote and merge in the config or the default remote)
+        """
+        config = self.repo.get_config()
+        section = ('branch', branch_name)
+        try:
+            remote = config.get(section, 'remote')
+            merge = config.get(section, 'merge')
+        except KeyError:
+            return self._format_ref_remote('%s/%s' % (self.DEFAULT_REMOTE, branch_name))
+        if remote == '.':
+            return merge
+        if merge.startswith(self.REFS_BRANCHES):
+            merge = merge[len(self.REFS_BRANCHES):]
+        return self._format_ref_remote('%s/%s' % (remote, merge))
+
+    def _resolve_revision_name(self, name):
+        """SHA for the name part of a revision : ref, SHA, abbreviated SHA
+        or "NAME@{upstream}" (also "@{u}")
+        """
+        if utils.git.is_sha(name):
+            return name
+        if name in ('', '@'):
+            name = 'HEAD'
+
+        for suffix in ('@{upstream}', '@{u}'):
+            if not name.endswith(suffix):
+                continue
+            branch_name = name[:-len(suffix)]
+            if branch_name in ('', '@', 'HEAD'):
+                branch_name = self.active_branch
+            if branch_name is None:
+                raise KeyError(name)
+            name = self._upstream_ref(branch_name)
+
+        try:
+            fullref = self.dwim_reference(name)
+        except Exception:
+            fullref = None
+        if fullref:
+            return self.repo.refs[fullref]
+
+        if utils.git.is_abbreviated_sha(name):
+            matches = self.sha_index.lookup(name)
+            if len(matches) > 1:
+                raise KeyError("Ambiguous abbreviated SHA %s" % name)
+            if matches:
+                return matches.pop()
+        raise KeyError(name)
+
+    def _peel(self, sha, type_name=None):
+        """Follow tags (and a commit's tree for "tree") to an object of type_name
+        or to the first non tag object
+        """
+        object_store = self.repo.object_store
+        obj = object_store[sha]
+        while isinstance(obj, Tag) and obj.type_name != type_name:
+            obj = object_store[obj.object[1]]
+        if type_name == 'tree' and isinstance(obj, Commit):
+            obj = object_store[obj.tree]
+        if type_name and obj.type_name != type_name:
+            raise KeyError("%s is a %s, not a %s" % (sha, obj.type_name, type_name))
+        return obj.id
+
+    def rev_parse(self, rev):
+        """Resolve a revision to a SHA, like: git rev-parse
+            name : a ref, a SHA, an abbreviated SHA, NAME@{upstream}
+            suffixes : "^" and "^N" (Nth parent), "~N" (N first parents back),
+                       "^{}" and "^{type}" (peeling)
+        "HEAD~500" only reads 500 commits
+        """
+        try:
+            name, operators = utils.git.split_revision(rev)
+        except ValueError:
+            raise KeyError(rev)
+        sha = self._resolve_revision_name(name)
+
+        object_store = self.repo.object_store
+        for operator, arg in operators:
+            if operator == '^{}':
+                sha = self._peel(sha, arg or None)
+                continue
+
+            commit = object_store[self._peel(sha, 'commit')]
+            if operator == '^':
+                if arg == 0:
+                    sha = commit.id
+                    continue
+                if len(commit.parents) < arg:
+                    raise KeyError("%s has no parent %d" % (commit.id, arg))
+                sha = commit.parents[arg - 1]
+                continue
+
+            # "~N"
+            for i in range(arg):
+                if not commit.parents:
+                    raise KeyError("%s has no parent" % commit.id)
+                sha = commit.parents[0]
+                if i < arg - 1:
+                    commit = object_store[sha]
+            if not arg:
+                sha = commit.id
+        return sha
+
+    @property
+    def commit_graph(self):
+        """Cached parents and generation numbers, see utils.graph.CommitGraph
+        """
+        object_store = self.repo.object_store
+        if getattr(self, '_commit_graph', None) is None or self._commit_graph.object_store is not object_store:
+            self._commit_graph = utils.graph.CommitGraph(object_store)
+        return self._commit_graph
+
+    def _revision_commit(self, rev):
+        return self._peel(self.rev_parse(rev), 'commit')
+
+    def merge_bases(self, a, b):
+        """List of the best common ancestors of two revisions
+        (more than one for criss-cross merges)
+        """
+        return self.commit_graph.merge_bases(self._revision_commit(a), self._revision_commit(b))
+
+    def merge_base(self, a, b):
+        """SHA of the best common ancestor of two revisions or None
+        """
+        bases = self.merge_bases(a, b)
+        return bases[0] if bases else None
+
+    def ahead_behind(self, a, b):
+        """Tuple (ahead, behind) : number of commits in a but not in b
+        and in b but not in a
+        """
+        return self.ahead_behind_many([(a, b)])[(a, b)]
+
+    def ahead_behind_many(self, pairs):
+        """ahead_behind for many pairs of revisions in a single history walk
+        Returns a dict of {(a, b): (ahead, behind)}
+        """
+        pairs = list(pairs)
+        shas = dict(
+            (rev, self._revision_commit(rev))
+            for pair in pairs
+            for rev in pair
+        )
+        counts = self.commit_graph.ahead_behind(
+            (shas[a], shas[b])
+            for a, b in pairs
+        )
+        return dict(
+            ((a, b), counts[(shas[a], shas[b])])
+            for a, b in pairs
+        )
+
+    def branches_ahead_behind(self, remote=None):
+        """Dict of {branch_name: (ahead, behind)} comparing each local branch
+        to its remote tracking branch (branches without one are left out)
+        """
+        remote = remote or self.DEFAULT_REMOTE
+        remote_branches = self.remote_branches
+        pairs = [
+            (self._format_ref_branch(name), self._format_ref_remote('%s/%s' % (remote, name)))
+            for name in self.branches
+            if '%s/%s' % (remote, name) in remote_branches
+        ]
+        counts = self.ahead_behind_many(pairs)
+        return dict(
+            (branch[len(self.REFS_BRANCHES):], counts[(branch, remote_branch)])
+            for branch, remote_branch in pairs
+        )
+
+    def rev_range(self, expr):
+        """Parse "A..B", "A...B" or a single revision into (include, exclude) lists of SHAs
+            A..B : commits in B but not in A
+            A...B : commits in either A or B but not in both
+        An empty side means HEAD
+        """
+        parts = utils.git.split_range(expr)
+        if parts is None:
+            return [self._peel(self.rev_parse(expr), 'commit')], []
+        a, b, symmetric = parts
+        a = self._peel(self.rev_parse(a or 'HEAD'), 'commit')
+        b = self._peel(self.rev_parse(b or 'HEAD'), 'commit')
+        if symmetric:
+            return [a, b], self.commit_graph.merge_bases(a, b)
+        return [b], [a]
+
+    def rev_list(self, expr):
+        """SHAs of the commits of a revision range (see rev_range), newest first
+        """
+        include, exclude = self.rev_range(expr)
+        for entry in self.repo.get_walker(include=include, exclude=exclude):
+            yield entry.commit.id
 
     def _commit_tree(self, commit_sha):
         """Return the tree object for a given commit
@@ -889,7 +1668,7 @@ class Gittle(object):
             filter_binary=filter_binary
         )
 
-    def get_commit_files(self, commit_sha, parent_path=None, is_tree=None, paths=None):
+    def get_commit_files(self, commit_sha, parent_path=None, is_tree=None, paths=None, data=True):
         """Returns a dict of the following Format :
             {
                 "directory/filename.txt": {
@@ -901,6 +1680,7 @@ class Gittle(object):
                 },
                 ...
             }
+        "data" is left out when data is False
         """
         # Default values
         context = {}
@@ -916,7 +1696,7 @@ class Gittle(object):
             # Check if entry is a directory
             if entry.mode == self.MODE_DIRECTORY:
                 context.update(
-                    self.get_commit_files(entry.sha, parent_path=os.path.join(parent_path, entry.path), is_tree=True, paths=paths)
+                    self.get_commit_files(entry.sha, parent_path=os.path.join(parent_path, entry.path), is_tree=True, paths=paths, data=data)
                 )
                 continue
 
@@ -932,8 +1712,10 @@ class Gittle(object):
                 'path': subpath,
                 'mode': entry.mode,
                 'sha': entry.sha,
-                'data': self.blob_data(entry.sha),
             }
+            # Big files are better read with open_blob
+            if data:
+                context[subpath]['data'] = self.blob_data(entry.sha)
         return context
 
     def file_versions(self, path):
@@ -962,6 +1744,43 @@ class Gittle(object):
             versions.append(file_data)
         return versions
 
+    @property
+    def blamer(self):
+        """Cached line origins, see utils.blame.Blamer
+        """
+        commit_graph = self.commit_graph
+        if getattr(self, '_blamer', None) is None or self._blamer.commit_graph is not commit_graph:
+            self._blamer = utils.blame.Blamer(self.repo.object_store, commit_graph)
+        return self._blamer
+
+    def blame(self, path, ref=None):
+        """Line by line origins of a file, like : git blame
+        Returns a list of the following Format :
+            [
+                {
+                    'lineno': 1,
+                    'line': "blablabla\n",
+                    'sha': "xxxxxxxxxxxxxxxxxxxx",
+                    'orig_lineno': 3,
+                },
+                ...
+            ]
+        Where sha is the commit that introduced the line and
+        orig_lineno its line number in that commit
+        """
+        commit_sha = self._revision_commit(ref or 'HEAD')
+        origins = self.blamer.origins(commit_sha, path)
+        lines = self.blamer.lines(self.blamer.blob_sha(commit_sha, path))
+        return [
+            {
+                'lineno': i + 1,
+                'line': line,
+                'sha': origin_sha,
+                'orig_lineno': origin_line + 1,
+            }
+            for i, (line, (origin_sha, origin_line)) in enumerate(zip(lines, origins))
+        ]
+
     def _diff_between(self, old_commit_sha, new_commit_sha, diff_function=None, filter_binary=True):
         """Internal method for getting a diff between two commits
             Please use .diff method unless you have very specific needs
@@ -995,38 +1814,76 @@ class Gittle(object):
         return len(self.changes(*args, **kwargs))
 
     def _refs_by_pattern(self, pattern):
-        refs = self.refs
+        # Only reads the refs under pattern, cached until they change
+        return dict(self.refs_cache.namespace(pattern))
 
-        def item_filter(key_value):
-            """Filter only concered refs"""
-            key, value = key_value
-            return key.startswith(pattern)
+    @property
+    def refs_cache(self):
+        # Not created in __init__ since Gittle's repo can be replaced
+        if getattr(self, '_refs_cache', None) is None or self._refs_cache.controldir != self.repo.controldir():
+            self._refs_cache = utils.refs.RefsCache(self.repo.controldir())
+        return self._refs_cache
 
-        def item_map(key_value):
-            """Rewrite keys"""
-            key, value = key_value
-            new_key = key[len(pattern):]
-            return (new_key, value)
+    @property
+    def refs(self):
+        return self.refs_cache.all()
 
-        return dict(
-            list(map(item_map,
-                list(filter(
-                    item_filter,
-                    list(refs.items())
-                ))
-            ))
+    @read_write
+    def ref_transaction(self, pack=False):
+        """Returns a RefTransaction applying many ref changes atomically,
+        with a single update_server_info call (refs are written loose,
+        pack moves the refs under refs/ to packed-refs) :
+
+            with repo.ref_transaction() as transaction:
+                transaction.set('refs/heads/master', sha)
+                transaction.delete('refs/tags/old')
+        """
+        return utils.refs.RefTransaction(
+            self.repo.controldir(),
+            object_store=self.repo.object_store,
+            on_commit=self._refs_changed,
+            pack=pack
         )
 
-    @property
-    def refs(self):
-        return self.repo.get_refs()
+    def _refs_changed(self):
+        self.refs_cache.invalidate()
+        # Dulwich caches packed-refs and wouldn't see our rewrite
+        for attr in ('_packed_refs', '_peeled_refs'):
+            if getattr(self.repo.refs, attr, None) is not None:
+                setattr(self.repo.refs, attr, None)
+        self.update_server_info()
 
-    def set_refs(refs_dict):
-        for k, v in list(refs_dict.items()):
-            self.repo[k] = v
+    def set_refs(self, refs_dict):
+        with self.ref_transaction() as transaction:
+            for k, v in list(refs_dict.items()):
+                transaction.set(k, v)
 
     def import_refs(self, base, other):
-        return self.repo.refs.import_refs(base, other)
+        with self.ref_transaction() as transaction:
+            for name, sha in list(other.items()):
+                transaction.set('/'.join([base, name]), sha)
+
+    def pack_refs(self):
+        """Move all loose refs into packed-refs, like: git pack-refs --all
+        Symbolic refs stay loose, refs updated meanwhile are left as they are
+        """
+        loose, stamps = utils.refs.read_loose_refs(self.repo.controldir(), 'refs/')
+        with self.ref_transaction(pack=True) as transaction:
+            for ref, contents in list(loose.items()):
+                if not contents.startswith(SYMREF):
+                    transaction.set(ref, contents, expected=contents, skip_changed=True)
+
+    @read_write
+    def gc(self):
+        """Pack refs and loose objects, like: git gc (without pruning)
+        Returns counts of what was done
+        """
+        self.pack_refs()
+        packed, removed = utils.packs.pack_loose_objects(self.repo.object_store)
+        return {
+            'objects_packed': packed,
+            'loose_removed': removed,
+        }
 
     @property
     def branches(self):
@@ -1075,6 +1932,17 @@ class Gittle(object):
             if keys[0] == 'remote'
         }
 
+    def remote_refspecs(self, remote_name=None):
+        """List of the "fetch" refspecs configured for a remote
+        """
+        remote_name = remote_name or self.DEFAULT_REMOTE
+        config = self.repo.get_config()
+        try:
+            return [config.get(('remote', remote_name), 'fetch')]
+        except KeyError:
+            return []
+
+    @read_write
     def add_remote(self, remote_name, remote_url):
         # Get repo's config
         config = self.repo.get_config()
@@ -1088,18 +1956,21 @@ class Gittle(object):
 
         return remote_name
 
+    @read_write
     def add_ref(self, new_ref, old_ref):
-        self.repo.refs[new_ref] = old_ref
-        self.update_server_info()
+        with self.ref_transaction() as transaction:
+            transaction.set(new_ref, old_ref)
 
+    @read_write
     def remove_ref(self, ref_name):
         # Returns False if ref doesn't exist
         if not ref_name in self.repo.refs:
             return False
-        del self.repo.refs[ref_name]
-        self.update_server_info()
+        with self.ref_transaction() as transaction:
+            transaction.delete(ref_name)
         return True
 
+    @read_write
     def create_branch(self, base_branch, new_branch, tracking=None):
         """Try creating a new branch which tracks the given remote
             if such a branch does not exist then branch off a local branch
@@ -1107,16 +1978,17 @@ class Gittle(object):
 
         # The remote to track
         tracking = self.DEFAULT_REMOTE
+        branches = self.branches
 
         # Already exists
-        if new_branch in self.branches:
+        if new_branch in branches:
             raise Exception("branch %s already exists" % new_branch)
 
         # Get information about remote_branch
         remote_branch = os.path.sep.join([tracking, base_branch])
 
         # Fork Local
-        if base_branch in self.branches:
+        if base_branch in branches:
             base_ref = self._format_ref_branch(base_branch)
         # Fork remote
         elif remote_branch in self.remote_branches:
@@ -1133,6 +2005,7 @@ class Gittle(object):
 
         return new_ref
 
+    @read_write
     def create_orphan_branch(self, new_branch, empty_index=None):
         """ Create a new branch with no commits in it.
         Technically, just points HEAD to a non-existent branch.  The actual branch will
@@ -1151,7 +2024,8 @@ class Gittle(object):
             raise Exception("branch %s already exists" % new_branch)
 
         new_ref = self._format_ref_branch(new_branch)
-        self.repo.refs.set_symbolic_ref('HEAD', new_ref)
+        with self.ref_transaction() as transaction:
+            transaction.set_symbolic('HEAD', new_ref)
 
         if self.is_working:
             if empty_index:
@@ -1164,6 +2038,7 @@ class Gittle(object):
         ref = self._format_ref_branch(branch_name)
         return self.remove_ref(ref)
 
+    @read_write
     def switch_branch(self, branch_name, tracking=None, create=None):
         """Changes the current branch
         """
@@ -1178,7 +2053,8 @@ class Gittle(object):
         branch_ref = self._format_ref_branch(branch_name)
 
         # Change main branch
-        self.repo.refs.set_symbolic_ref('HEAD', branch_ref)
+        with self.ref_transaction() as transaction:
+            transaction.set_symbolic('HEAD', branch_ref)
 
         if self.is_working:
             # Remove all files
@@ -1187,14 +2063,17 @@ class Gittle(object):
             # Add files for the current branch
             self.checkout_all()
 
+    @read_write
     def create_tag(self, tag_name, target):
         ref = self._format_ref_tag(tag_name)
         return self.add_ref(ref, self._parse_reference(target))
 
+    @read_write
     def remove_tag(self, tag_name):
         ref = self._format_ref_tag(tag_name)
         return self.remove_ref(ref)
 
+    @read_write
     def clean(self, force=None, directories=None):
         untracked_files = self.untracked_files
         list(map(os.remove, untracked_files))
@@ -1254,16 +2133,95 @@ class Gittle(object):
         tree_sha = self._commit_tree(ref)
         return self._get_fs_structure(tree_sha, *args, **kwargs)
 
+    @read_write
     def update_server_info(self):
         if not self.is_bare:
             return
         update_server_info(self.repo)
 
-    def _is_fast_forward(self):
-        pass
+    def _is_fast_forward(self, old_sha, new_sha):
+        """True if old_sha is an ancestor of (or equal to) new_sha
+        """
+        if old_sha is None or old_sha == new_sha:
+            return True
+        if not old_sha in self.repo.object_store:
+            return False
+        return self.commit_graph.is_ancestor(old_sha, new_sha)
 
-    def _merge_fast_forward(self):
-        pass
+    @read_write
+    def _merge_fast_forward(self, branch_name, new_sha, progress=None):
+        """Move branch_name to new_sha if it is a fast forward and
+        update the working directory with only the files that changed
+        """
+        branch_ref = self._format_ref_branch(branch_name)
+        old_sha = None
+        if branch_ref in self.repo.refs:
+            old_sha = self.repo.refs[branch_ref]
+        if old_sha == new_sha:
+            return new_sha
+        if not self._is_fast_forward(old_sha, new_sha):
+            raise NonFastForward("%s can not be fast forwarded to %s" % (branch_name, new_sha))
+
+        is_active = self.is_working and branch_name == self.active_branch
+        if is_active:
+            # Fails before touching anything if local changes are in the way
+            changes = self._working_changes(old_sha, new_sha)
+
+        # Raises RefChanged if the branch moved meanwhile,
+        # before the working directory and index are touched
+        with self.ref_transaction() as transaction:
+            transaction.set(branch_ref, new_sha, expected=old_sha or ZERO_SHA)
+
+        if is_active:
+            self._apply_working_changes(changes, progress=progress)
+        return new_sha
+
+    @working_only
+    def _working_changes(self, old_sha, new_sha):
+        """Changes between two commits' trees, checking that
+        the working copy of every changed file is unmodified
+        """
+        old_tree = self._commit_tree(old_sha) if old_sha else None
+        new_tree = self._commit_tree(new_sha)
+        changes = list(self.repo.object_store.tree_changes(old_tree, new_tree))
+
+        conflicts = []
+        for (old_path, new_path), (old_mode, new_mode), (old_blob, new_blob) in changes:
+            for path in set([old_path, new_path]):
+                if not path or not os.path.lexists(self.abspath(path)):
+                    continue
+                if utils.streams.hash_blob_file(self.abspath(path)) in (old_blob, new_blob):
+                    continue
+                conflicts.append(path)
+            # A deleted tracked file is a local change too
+            if old_path == new_path and not os.path.lexists(self.abspath(old_path)):
+                conflicts.append(old_path)
+        if conflicts:
+            raise WorkingChangesConflict("Local changes would be overwritten: %s" % ', '.join(sorted(set(conflicts))))
+        return changes
+
+    @working_only
+    def _apply_working_changes(self, changes, progress=None):
+        """Write tree changes to the working directory and index
+        """
+        object_store = self.repo.object_store
+        index = self.index
+        written = 0
+        for (old_path, new_path), (old_mode, new_mode), (old_blob, new_blob) in changes:
+            if old_path and old_path != new_path:
+                utils.paths.remove_file(self.path, old_path)
+                if old_path in index:
+                    del index[old_path]
+            if not new_path or S_ISGITLINK(new_mode):
+                continue
+            st = utils.git.checkout_blob(object_store, new_blob, new_mode, self.abspath(new_path))
+            index[new_path] = index_entry_from_stat(st, new_blob, 0)
+            written += 1
+        index.write()
+
+        transfer = TransferProgress.wrap(progress)
+        if transfer:
+            transfer.update('checkout', files_written=written)
 
     def __hash__(self):
         """This is required otherwise the memoize function will just mess it up
@@ -1277,6 +2235,7 @@ class Gittle(object):
             raise KeyError(key)
         return self.repo[sha]
 
+    @read_write
     def __setitem__(self, key, value):
         try:
             key = self.dwim_reference(key)
@@ -1291,6 +2250,7 @@ class Gittle(object):
             pass
         return key in self.repo
 
+    @read_write
     def __delitem__(self, key):
         try:
             key = self.dwim_reference(key)
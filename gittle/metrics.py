@@ -0,0 +1,341 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import json
+import time
+import socket
+import tempfile
+import logging
+import threading
+from contextlib import contextmanager
+
+
+# Exports
+__all__ = ('RequestTrace', 'MetricsSink', 'MultiSink', 'JSONLinesExporter', 'PrometheusExporter')
+
+
+logger = logging.getLogger(__name__)
+
+# Prometheus help of the RequestTrace counters
+COUNTER_HELP = {
+    'bytes_sent': 'Bytes sent to clients',
+    'bytes_received': 'Bytes received from clients',
+    'objects': 'Objects sent in packs',
+}
+
+# Request duration histogram buckets (seconds)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class RequestTrace(object):
+    """Timings and counters of a single server request
+
+    Phases are timed with span(name) and add up if repeated,
+    bytes are counted through report_activity (a dulwich Protocol hook)
+    """
+    COUNTERS = (
+        'bytes_sent',
+        'bytes_received',
+        'objects',
+    )
+
+    def __init__(self, service, repo=None, client=None, clock=None):
+        self.service = service
+        self.repo = repo
+        self.client = client
+        self.clock = clock or time.time
+
+        self.started = self.clock()
+        self.duration = None
+        self.error = None
+        self.cached = False
+        self.spans = {}
+        self.stats = dict.fromkeys(self.COUNTERS, 0)
+
+    @property
+    def status(self):
+        if self.duration is None:
+            return 'running'
+        return 'error' if self.error else 'ok'
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(name, self.clock() - start)
+
+    def increment(self, **counters):
+        for key, value in list(counters.items()):
+            self.stats[key] += value
+
+    # Can be used as a Protocol's "report_activity" function
+    def report_activity(self, nbytes, direction):
+        if direction == 'read':
+            self.stats['bytes_received'] += nbytes
+        else:
+            self.stats['bytes_sent'] += nbytes
+
+    def finish(self, error=None):
+        self.duration = self.clock() - self.started
+        if error is not None:
+            self.error = '%s: %s' % (type(error).__name__, error)
+
+    def as_dict(self):
+        data = dict(self.stats)
+        data.update({
+            'service': self.service,
+            'repo': self.repo,
+            'client': self.client,
+            'started': self.started,
+            'duration': self.duration,
+            'status': self.status,
+            'error': self.error,
+            'cached': self.cached,
+            'spans': dict(self.spans),
+        })
+        return data
+
+
+class MetricsSink(object):
+    """Receives the finished RequestTraces of a server
+    """
+    def record(self, trace):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MultiSink(MetricsSink):
+    """Sends traces to several sinks
+    """
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def record(self, trace):
+        for sink in self.sinks:
+            try:
+                sink.record(trace)
+            except Exception:
+                logger.exception('Metrics sink %r failed', sink)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class Output(object):
+    """Where exporters write to :
+        "/some/path" : a local file
+        "unix:/some/path" : a unix stream socket
+        ("host", port) : a TCP socket
+    Sockets are (re)connected on demand, data is dropped while they're down
+    """
+    UNIX_PREFIX = 'unix:'
+
+    def __init__(self, target):
+        self.target = target
+        self._socket = None
+
+    @property
+    def is_socket(self):
+        return isinstance(self.target, tuple) or self.target.startswith(self.UNIX_PREFIX)
+
+    def _connect(self):
+        if isinstance(self.target, tuple):
+            return socket.create_connection(self.target, timeout=5)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect(self.target[len(self.UNIX_PREFIX):])
+        return sock
+
+    def _send(self, data):
+        try:
+            if self._socket is None:
+                self._socket = self._connect()
+            self._socket.sendall(data)
+        except (socket.error, OSError) as e:
+            logger.warning('Dropping metrics, could not send to %s: %s', self.target, e)
+            self.close()
+
+    def append(self, data):
+        if self.is_socket:
+            return self._send(data)
+        with open(self.target, 'ab') as f:
+            f.write(data)
+
+    def replace(self, data):
+        """Replace a file's content atomically (sockets just get the data)
+        """
+        if self.is_socket:
+            return self._send(data)
+        # A unique file per call, threads may replace it at the same time
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=os.path.basename(self.target) + '.',
+            suffix='.tmp',
+            dir=os.path.dirname(self.target) or '.',
+        )
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # mkstemp's files are private, collectors must read it
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, self.target)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except (socket.error, OSError):
+                pass
+            self._socket = None
+
+
+class JSONLinesExporter(MetricsSink):
+    """Writes every trace as a line of JSON (see RequestTrace.as_dict)
+    """
+    def __init__(self, target):
+        self.output = Output(target)
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        line = json.dumps(trace.as_dict(), sort_keys=True) + '\n'
+        with self._lock:
+            self.output.append(line.encode('utf-8'))
+
+    def close(self):
+        self.output.close()
+
+
+class PrometheusExporter(MetricsSink):
+    """Aggregates traces by service and repository, in the Prometheus text
+    format. The exposition is rewritten every interval seconds (a file
+    suits node_exporter's textfile collector), render() returns it
+
+    Clients aren't labels (too many of them), see JSONLinesExporter
+    """
+    def __init__(self, target=None, interval=None, prefix='gittle'):
+        self.output = Output(target) if target else None
+        self.interval = 10 if interval is None else interval
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._last_write = None
+
+        # {(service, repo): {...}}
+        self._series = {}
+
+    def _new_series(self):
+        return {
+            'requests': {},
+            'cached': 0,
+            'stats': dict.fromkeys(RequestTrace.COUNTERS, 0),
+            'spans': {},
+            'buckets': [0] * len(DURATION_BUCKETS),
+            'duration_sum': 0.0,
+            'duration_count': 0,
+        }
+
+    def record(self, trace):
+        with self._lock:
+            key = (trace.service, trace.repo or '')
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = self._new_series()
+            requests = series['requests']
+            requests[trace.status] = requests.get(trace.status, 0) + 1
+            series['cached'] += int(trace.cached)
+            for name, value in list(trace.stats.items()):
+                series['stats'][name] += value
+            for name, seconds in list(trace.spans.items()):
+                series['spans'][name] = series['spans'].get(name, 0.0) + seconds
+            duration = trace.duration or 0.0
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    series['buckets'][i] += 1
+            series['duration_sum'] += duration
+            series['duration_count'] += 1
+
+            if self.output is None:
+                return
+            now = time.time()
+            if self._last_write is not None and now - self._last_write < self.interval:
+                return
+            self._last_write = now
+            text = self._render()
+        self.output.replace(text.encode('utf-8'))
+
+    def flush(self):
+        if self.output is not None:
+            self.output.replace(self.render().encode('utf-8'))
+
+    def close(self):
+        self.flush()
+        if self.output is not None:
+            self.output.close()
+
+    def render(self):
+        with self._lock:
+            return self._render()
+
+    def _labels(self, **labels):
+        return '{%s}' % ','.join(
+            '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in sorted(labels.items())
+        )
+
+    def _render(self):
+        p = self.prefix
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP %s_%s %s' % (p, name, help_text))
+            lines.append('# TYPE %s_%s %s' % (p, name, kind))
+            for suffix, labels, value in samples:
+                lines.append('%s_%s%s%s %s' % (p, name, suffix, self._labels(**labels), value))
+
+        items = sorted(self._series.items())
+        metric('requests_total', 'counter', 'Requests served', [
+            ('', dict(service=service, repo=repo, status=status), count)
+            for (service, repo), series in items
+            for status, count in sorted(series['requests'].items())
+        ])
+        metric('cached_packs_total', 'counter', 'Packs sent from the pack cache', [
+            ('', dict(service=service, repo=repo), series['cached'])
+            for (service, repo), series in items
+        ])
+        for name in RequestTrace.COUNTERS:
+            metric('%s_total' % name, 'counter', COUNTER_HELP[name], [
+                ('', dict(service=service, repo=repo), series['stats'][name])
+                for (service, repo), series in items
+            ])
+        metric('phase_seconds_total', 'counter', 'Time spent in each phase of requests', [
+            ('', dict(service=service, repo=repo, phase=phase), seconds)
+            for (service, repo), series in items
+            for phase, seconds in sorted(series['spans'].items())
+        ])
+
+        samples = []
+        for (service, repo), series in items:
+            labels = dict(service=service, repo=repo)
+            for bound, count in zip(DURATION_BUCKETS, series['buckets']):
+                samples.append(('_bucket', dict(labels, le=bound), count))
+            samples.append(('_bucket', dict(labels, le='+Inf'), series['duration_count']))
+            samples.append(('_sum', labels, series['duration_sum']))
+            samples.append(('_count', labels, series['duration_count']))
+        metric('request_duration_seconds', 'histogram', 'Request durations', samples)
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,219 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Local imports
+from gittle.gittle import Gittle
+from gittle.pool import DEFAULT_POOL
+
+
+# Exports
+__all__ = ('RepoManager', 'RepoResult')
+
+
+logger = logging.getLogger(__name__)
+
+# Repositories worked on at once by default
+DEFAULT_WORKERS = 8
+
+
+class RepoResult(object):
+    """Outcome of an operation on one repository
+    """
+
+    def __init__(self, path, operation):
+        self.path = path
+        self.operation = operation
+        self.started = time.time()
+        self.duration = None
+        self.value = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def finish(self, value=None, error=None):
+        self.duration = time.time() - self.started
+        self.value = value
+        if error is not None:
+            self.error = '%s: %s' % (type(error).__name__, error)
+
+    def as_dict(self):
+        return {
+            'path': self.path,
+            'operation': self.operation,
+            'ok': self.ok,
+            'value': self.value,
+            'error': self.error,
+            'started': self.started,
+            'duration': self.duration,
+        }
+
+    def __repr__(self):
+        return '<RepoResult %s %s %s (%.3fs)>' % (
+            self.operation, self.path, 'ok' if self.ok else self.error, self.duration or 0.0
+        )
+
+
+class RepoManager(object):
+    """Runs status, fetch and gc (or any function of a Gittle)
+    over many repositories with a pool of worker threads :
+
+        manager = RepoManager(paths, workers=16)
+        for result in manager.fetch():
+            if not result.ok:
+                print(result.path, result.error)
+
+    Gittle handles are kept between runs, so their caches (refs, commit graph,
+    pack indexes) are reused. Given a pool (a ClientPool, DEFAULT_POOL...)
+    they all share its SSH connections
+    Operations on the same repository never run at once
+    """
+
+    def __init__(self, paths=None, workers=None, pool=None, **gittle_kwargs):
+        self.workers = workers or DEFAULT_WORKERS
+        self.pool = pool
+        self.gittle_kwargs = gittle_kwargs
+        self.paths = []
+        self._lock = threading.Lock()
+        # {path: Gittle}
+        self._repos = {}
+        # {path: Lock}
+        self._repo_locks = {}
+        self.add(*(paths or []))
+
+    def add(self, *paths):
+        with self._lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                if not path in self._repo_locks:
+                    self.paths.append(path)
+                    self._repo_locks[path] = threading.Lock()
+
+    def remove(self, *paths):
+        with self._lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                if path in self._repo_locks:
+                    self.paths.remove(path)
+                    del self._repo_locks[path]
+                    self._repos.pop(path, None)
+
+    def clear_cache(self):
+        """Forget the Gittle handles (they're reopened on demand)
+        """
+        with self._lock:
+            self._repos = {}
+
+    def get(self, path):
+        """The (cached) Gittle of a managed repository
+        """
+        path = os.path.abspath(path)
+        repo = self._repos.get(path)
+        if repo is None:
+            repo = Gittle(path, **self.gittle_kwargs)
+            if self.pool is not None:
+                repo.CLIENT_POOL = self.pool
+            with self._lock:
+                self._repos[path] = repo
+        return repo
+
+    def _run_one(self, path, operation, func, args, kwargs):
+        result = RepoResult(path, operation)
+        try:
+            with self._repo_locks[path]:
+                value = func(self.get(path), *args, **kwargs)
+        except Exception as e:
+            logger.debug('%s failed on %s', operation, path, exc_info=True)
+            # The handle may be in a bad state
+            with self._lock:
+                self._repos.pop(path, None)
+            result.finish(error=e)
+        else:
+            result.finish(value)
+        return result
+
+    def run(self, func, *args, **kwargs):
+        """Call func(gittle, *args, **kwargs) for every repository,
+        returns their RepoResults in the order of paths
+
+        paths (a keyword argument) restricts it to some repositories,
+        callback (a keyword argument) is called with each result as it's done
+        """
+        paths = kwargs.pop('paths', None)
+        callback = kwargs.pop('callback', None)
+        operation = kwargs.pop('operation', None) or getattr(func, '__name__', 'run')
+        if paths is None:
+            paths = list(self.paths)
+        else:
+            paths = [os.path.abspath(path) for path in paths]
+            self.add(*paths)
+
+        with ThreadPoolExecutor(min(self.workers, len(paths) or 1)) as executor:
+            futures = [
+                executor.submit(self._run_one, path, operation, func, args, kwargs)
+                for path in paths
+            ]
+            if callback is not None:
+                for future in futures:
+                    future.add_done_callback(lambda future: callback(future.result()))
+            return [future.result() for future in futures]
+
+    def _status(self, repo):
+        status = {
+            'branch': repo.active_branch,
+            'head': repo.head if repo.has_commits else None,
+            'bare': repo.is_bare,
+        }
+        if not repo.is_bare:
+            status['files'] = repo.pending_files_by_state
+        return status
+
+    def status(self, **kwargs):
+        """Branch, HEAD and pending files (path => state) of each repository
+        """
+        return self.run(self._status, operation='status', **kwargs)
+
+    def _fetch(self, repo, *args, **kwargs):
+        before = dict(repo.refs)
+        repo.fetch(*args, **kwargs)
+        after = dict(repo.refs)
+        return {
+            'updated': dict(
+                (ref, sha)
+                for ref, sha in list(after.items())
+                if before.get(ref) != sha
+            ),
+            'removed': sorted(set(before) - set(after)),
+        }
+
+    def fetch(self, *args, **kwargs):
+        """Gittle.fetch each repository, returns the refs it changed
+        """
+        return self.run(self._fetch, operation='fetch', *args, **kwargs)
+
+    def gc(self, **kwargs):
+        """Gittle.gc each repository
+        """
+        return self.run(Gittle.gc, operation='gc', **kwargs)
+
+    def close(self):
+        self.clear_cache()
+        if self.pool is not None and self.pool is not DEFAULT_POOL:
+            self.pool.close()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
@@ -0,0 +1,265 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import time
+import logging
+import threading
+from hashlib import sha1
+
+# Dulwich imports
+from dulwich.client import get_transport_and_path
+
+# Local imports
+from gittle.auth import get_paramiko
+
+
+# Exports
+__all__ = ('ClientPool', 'DEFAULT_POOL')
+
+
+logger = logging.getLogger(__name__)
+
+# Pooled connections unused for longer are reopened (seconds)
+DEFAULT_MAX_IDLE = 5 * 60
+
+# What to do with hosts missing from the known_hosts files
+# (paramiko policy names), hosts are rejected by default
+HOST_KEY_POLICIES = {
+    'reject': 'RejectPolicy',
+    'warn': 'WarningPolicy',
+    'accept': 'AutoAddPolicy',
+}
+DEFAULT_HOST_KEY_POLICY = 'reject'
+
+# Known hosts files read besides the user's ~/.ssh/known_hosts
+SYSTEM_KNOWN_HOSTS = ('/etc/ssh/ssh_known_hosts',)
+
+# Keyword arguments of paramiko's SSHClient.connect we pass on
+SSH_CONNECT_KWARGS = (
+    'password',
+    'pkey',
+    'key_filename',
+    'look_for_keys',
+    'allow_agent',
+    'timeout',
+)
+
+
+def auth_identity(kwargs):
+    """Hashable identity of the credentials in a client's kwargs
+    (secrets are hashed, keys reduced to their fingerprint)
+    """
+    identity = []
+    for key in ('username',) + SSH_CONNECT_KWARGS:
+        value = kwargs.get(key)
+        if value is None:
+            continue
+        if key == 'pkey' and hasattr(value, 'get_fingerprint'):
+            value = value.get_fingerprint()
+        if key in ('password', 'pkey'):
+            value = sha1(value if isinstance(value, bytes) else str(value).encode('utf-8')).hexdigest()
+        identity.append((key, value))
+    return tuple(identity)
+
+
+class PooledChannel(object):
+    """A command's channel on a shared SSH connection,
+    with the read/write/close interface dulwich expects
+    """
+
+    def __init__(self, channel, progress_stderr=None):
+        self.channel = channel
+        self._stderr_thread = None
+        if progress_stderr is not None:
+            self._stderr_thread = threading.Thread(target=self._read_stderr, args=(progress_stderr,))
+            self._stderr_thread.daemon = True
+            self._stderr_thread.start()
+
+    def _read_stderr(self, progress_stderr):
+        while True:
+            data = self.channel.recv_stderr(1024)
+            if not data:
+                return
+            progress_stderr(data)
+
+    def can_read(self):
+        return self.channel.recv_ready()
+
+    def read(self, n=None):
+        data = self.channel.recv(n)
+        # Read more if needed (until the channel closes)
+        while n and data and len(data) < n:
+            more = self.channel.recv(n - len(data))
+            if not more:
+                break
+            data += more
+        return data
+
+    def write(self, data):
+        return self.channel.sendall(data)
+
+    def close(self):
+        # Only the channel, the connection stays in the pool
+        self.channel.close()
+
+
+class PooledSSHVendor(object):
+    """Dulwich SSH vendor running commands on one shared paramiko connection
+    per (host, port, username, credentials), each command gets its own channel
+
+    Connections that died or stayed unused for max_idle seconds are reopened
+
+    Host keys are checked against the system and user known_hosts files,
+    unknown hosts are handled by host_key_policy ("reject", "warn", "accept"
+    or a paramiko MissingHostKeyPolicy), "reject" by default
+    """
+
+    def __init__(self, max_idle=None, host_key_policy=None):
+        self.max_idle = DEFAULT_MAX_IDLE if max_idle is None else max_idle
+        self.host_key_policy = host_key_policy or DEFAULT_HOST_KEY_POLICY
+        self._lock = threading.Lock()
+        # {key: [SSHClient, last_used]}
+        self._connections = {}
+        # {key: Lock}, held while connecting so that other keys don't wait
+        self._key_locks = {}
+
+    def _missing_host_key_policy(self, paramiko):
+        policy = self.host_key_policy
+        if not isinstance(policy, str):
+            return policy
+        return getattr(paramiko, HOST_KEY_POLICIES[policy])()
+
+    def _connect(self, host, port, username, kwargs):
+        paramiko = get_paramiko()
+        client = paramiko.SSHClient()
+        for path in SYSTEM_KNOWN_HOSTS:
+            if os.path.exists(path):
+                client.load_system_host_keys(path)
+        # ~/.ssh/known_hosts
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(self._missing_host_key_policy(paramiko))
+        connect_kwargs = dict(
+            (key, kwargs[key])
+            for key in SSH_CONNECT_KWARGS
+            if kwargs.get(key) is not None
+        )
+        client.connect(host, port=port or 22, username=username, **connect_kwargs)
+        return client
+
+    def _connection(self, key, host, port, username, kwargs, fresh=False):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._connections.get(key)
+            now = time.time()
+            if entry is not None and not fresh:
+                client, last_used = entry
+                transport = client.get_transport()
+                if transport is not None and transport.is_active() and now - last_used <= self.max_idle:
+                    entry[1] = now
+                    return client
+            if entry is not None:
+                entry[0].close()
+            logger.debug('Opening SSH connection to %s@%s:%s', username, host, port)
+            client = self._connect(host, port, username, kwargs)
+            with self._lock:
+                self._connections[key] = [client, now]
+            return client
+
+    def run_command(self, host, command, username=None, port=None, progress_stderr=None, **kwargs):
+        if not isinstance(command, (str, bytes)):
+            command = ' '.join(command)
+        if isinstance(command, bytes):
+            command = command.decode('utf-8')
+
+        key = (host, port, username, auth_identity(kwargs))
+        client = self._connection(key, host, port, username, kwargs)
+        try:
+            channel = client.get_transport().open_session()
+        except (get_paramiko().SSHException, EOFError, AttributeError):
+            # The server closed it under us
+            client = self._connection(key, host, port, username, kwargs, fresh=True)
+            channel = client.get_transport().open_session()
+        channel.exec_command(command)
+        return PooledChannel(channel, progress_stderr)
+
+    def with_auth(self, auth):
+        """Vendor for dulwich clients running commands with a GittleAuth's
+        credentials (dulwich only passes the host, port and username)
+        """
+        return AuthSSHVendor(self, auth.kwargs() if auth is not None else {})
+
+    def close(self):
+        with self._lock:
+            for client, last_used in list(self._connections.values()):
+                client.close()
+            self._connections = {}
+
+
+class AuthSSHVendor(object):
+    """PooledSSHVendor running commands with the given credentials
+    (the kwargs of a GittleAuth), the URL's username comes first
+    """
+
+    def __init__(self, vendor, credentials):
+        self.vendor = vendor
+        self.credentials = credentials
+
+    def run_command(self, host, command, username=None, port=None, **kwargs):
+        run_kwargs = dict(self.credentials)
+        run_kwargs.update((key, value) for key, value in kwargs.items() if value is not None)
+        run_kwargs['username'] = username or self.credentials.get('username')
+        return self.vendor.run_command(host, command, port=port, **run_kwargs)
+
+
+class ClientPool(object):
+    """Builds dulwich clients whose SSH commands run on pooled paramiko
+    connections (one handshake and key exchange per remote and credentials)
+    shared across operations and Gittle instances
+
+    Pooling is opt-in (Gittle.CLIENT_POOL = DEFAULT_POOL or a ClientPool) :
+    paramiko replaces the ssh command, so ~/.ssh/config (host aliases,
+    ProxyCommand...) doesn't apply and credentials come from the Gittle's
+    authenticator. host_key_policy is passed to PooledSSHVendor ("accept"
+    turns off host key checking)
+    """
+
+    def __init__(self, max_idle=None, host_key_policy=None):
+        self.max_idle = max_idle
+        self.host_key_policy = host_key_policy
+        self._ssh_vendor = None
+        self._lock = threading.Lock()
+
+    @property
+    def ssh_vendor(self):
+        # Paramiko is only imported once an SSH remote is used
+        with self._lock:
+            if self._ssh_vendor is None and get_paramiko() is not None:
+                self._ssh_vendor = PooledSSHVendor(self.max_idle, self.host_key_policy)
+            return self._ssh_vendor
+
+    def get_client(self, uri, auth=None, **kwargs):
+        """Same as dulwich's get_transport_and_path(uri, **kwargs),
+        SSH clients authenticate with auth (a GittleAuth)
+        """
+        client, path = get_transport_and_path(uri, **kwargs)
+
+        if hasattr(client, 'ssh_vendor') and self.ssh_vendor is not None:
+            client.ssh_vendor = self.ssh_vendor.with_auth(auth)
+
+        return client, path
+
+    def close(self):
+        if self._ssh_vendor is not None:
+            self._ssh_vendor.close()
+
+
+# Shared by the Gittle instances opting in to pooling
+DEFAULT_POOL = ClientPool()
@@ -0,0 +1,169 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import re
+import time
+
+
+# Exports
+__all__ = ('TransferProgress',)
+
+
+# Server side progress lines, like :
+# "Counting objects: 42, done." or "Compressing objects:  50% (3/6)"
+PROGRESS_REGEX = re.compile(r'^(?P<title>[A-Za-z ]+):\s+(?:\d+% \((?P<done>\d+)/\d+\)|(?P<count>\d+))')
+
+# "Total 42 (delta 12), reused 0 (delta 0)"
+TOTAL_REGEX = re.compile(r'^Total (?P<total>\d+) \(delta (?P<deltas>\d+)\)')
+
+# Map progress titles to the counters they update
+PROGRESS_COUNTERS = {
+    'Counting objects': 'objects_counted',
+    'Compressing objects': 'objects_compressed',
+    'Receiving objects': 'objects_received',
+    'Resolving deltas': 'objects_resolved',
+}
+
+
+class TransferProgress(object):
+    """Structured progress for clone, fetch, pull and push
+
+    Reports events as dicts to callback, like :
+        {
+            'stage': 'receiving',
+            'bytes_received': 1024,
+            'bytes_received_rate': 512.0,
+            'objects_counted': 42,
+            ...
+            'elapsed': 2.0,
+        }
+
+    Instances can be used directly as dulwich progress functions,
+    events are throttled to one every interval seconds unless the stage changes
+    """
+    COUNTERS = (
+        'bytes_received',
+        'bytes_sent',
+        'objects_counted',
+        'objects_compressed',
+        'objects_received',
+        'objects_indexed',
+        'objects_resolved',
+        'files_written',
+    )
+
+    def __init__(self, callback=None, interval=None, clock=None):
+        self.callback = callback
+        self.interval = 0.5 if interval is None else interval
+        self.clock = clock or time.time
+
+        self.stage = None
+        self.last_message = None
+        self.stats = dict.fromkeys(self.COUNTERS, 0)
+        self.total_deltas = 0
+
+        self.started = self.clock()
+        self._last_event = None
+        self._buffer = ''
+
+    @classmethod
+    def wrap(cls, progress):
+        """Returns progress if it's already a TransferProgress, else None
+        (plain functions are dulwich style message callbacks)
+        """
+        if isinstance(progress, cls):
+            return progress
+        return None
+
+    @property
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def rate(self, key):
+        """Per second rate of a counter since the transfer started
+        """
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+        return self.stats[key] / elapsed
+
+    def snapshot(self):
+        event = dict(self.stats)
+        event.update({
+            '%s_rate' % key: self.rate(key)
+            for key in self.COUNTERS
+        })
+        event['stage'] = self.stage
+        event['message'] = self.last_message
+        event['elapsed'] = self.elapsed
+        return event
+
+    def emit(self, force=False):
+        if not self.callback:
+            return
+        now = self.clock()
+        if not force and self._last_event is not None and now - self._last_event < self.interval:
+            return
+        self._last_event = now
+        self.callback(self.snapshot())
+
+    def update(self, stage=None, **counters):
+        """Set counters, an event is always sent when the stage changes
+        """
+        stage_changed = stage is not None and stage != self.stage
+        if stage is not None:
+            self.stage = stage
+        self.stats.update(counters)
+        self.emit(force=stage_changed)
+
+    def increment(self, stage=None, **counters):
+        for key, value in list(counters.items()):
+            counters[key] = self.stats[key] + value
+        self.update(stage, **counters)
+
+    def finish(self, stage=None):
+        self.stage = stage or 'done'
+        self.emit(force=True)
+
+    # Can be used as a client's "report_activity" function
+    def report_activity(self, nbytes, direction):
+        if direction == 'read':
+            self.increment(bytes_received=nbytes)
+        else:
+            self.increment(bytes_sent=nbytes)
+
+    def _parse_line(self, line):
+        self.last_message = line
+
+        total = TOTAL_REGEX.match(line)
+        if total:
+            self.total_deltas = int(total.group('deltas'))
+            self.update(
+                'receiving',
+                objects_counted=int(total.group('total')),
+            )
+            return
+
+        match = PROGRESS_REGEX.match(line)
+        if not match:
+            return
+        key = PROGRESS_COUNTERS.get(match.group('title'))
+        if not key:
+            return
+        value = match.group('done') or match.group('count')
+        stage = match.group('title').split()[0].lower()
+        self.update(stage, **{key: int(value)})
+
+    # Can be used as a dulwich "progress" function
+    def __call__(self, message):
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'replace')
+        lines = re.split(r'[\r\n]', self._buffer + message)
+        self._buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                self._parse_line(line.strip())
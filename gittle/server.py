@@ -6,13 +6,384 @@
 
 # Python imports
 import os
+import sys
+import time
+import queue
+import signal
+import socket
+import stat
+import struct
+import logging
+import tempfile
+import threading
+from hashlib import sha1
+from collections import OrderedDict
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, make_server
 
 # Dulwich imports
-from dulwich.server import FileSystemBackend, TCPGitServer, UploadPackHandler, ReceivePackHandler
+from dulwich.errors import NotGitRepository
+from dulwich.pack import write_pack_objects
+from dulwich.protocol import (
+    ReceivableProtocol, ProtocolFile, SIDE_BAND_CHANNEL_DATA, CAPABILITY_NO_DONE,
+)
+from dulwich.server import (
+    FileSystemBackend, TCPGitServer, UploadPackHandler, ReceivePackHandler,
+    ProtocolGraphWalker,
+)
+from dulwich.web import (
+    HTTP_OK, HTTPGitApplication, GunzipFilter, LimitedInputFilter,
+    handle_service_request, url_prefix,
+)
+
+# Local imports
+from gittle import utils
+from gittle.metrics import RequestTrace
+
+
+logger = logging.getLogger(__name__)
+
+# Pack cache limits
+DEFAULT_PACK_CACHE_SIZE = 1024 * 1024 * 1024
+DEFAULT_PACK_CACHE_AGE = 24 * 60 * 60
+
+# Client capabilities changing the pack sent for the same wants and haves
+PACK_CAPABILITIES = ('thin-pack', 'ofs-delta', 'include-tag')
+
+
+class PackCache(object):
+    """Packs sent by upload-pack, kept on disk to be sent again when
+    another client negotiates the same thing
+
+    Entries are keyed by the repository, the ref tips it had, the client's
+    wants and haves and the capabilities changing the pack, so a ref update
+    never serves a stale pack. Entries older than max_age seconds are dropped
+    and the least recently used ones go once the cache holds more than
+    max_size bytes. The index is the directory itself (entry mtime is its
+    creation, atime its last use), forked workers can share it
+
+    Without a path the cache is a new private temporary directory.
+    Packs from the directory are sent to clients as they are, so it must
+    belong to us and not be writable by anyone else
+    """
+    SUFFIX = '.pack'
+
+    def __init__(self, path=None, max_size=None, max_age=None):
+        self.max_size = DEFAULT_PACK_CACHE_SIZE if max_size is None else max_size
+        self.max_age = DEFAULT_PACK_CACHE_AGE if max_age is None else max_age
+        if path is None:
+            self.path = tempfile.mkdtemp(prefix='gittle-pack-cache-')
+        else:
+            self.path = path
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path, 0o700)
+            self._check_private()
+
+    def _check_private(self):
+        st = os.stat(self.path)
+        if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise ValueError('Pack cache %s must be owned by us and not writable by others' % self.path)
+
+    def key(self, repo_path, refs, wants, haves, capabilities):
+        digest = sha1()
+        parts = [repo_path] + sorted('%s %s' % item for item in list(refs.items()))
+        parts += ['want %s' % sha for sha in sorted(set(wants))]
+        parts += ['have %s' % sha for sha in sorted(set(haves))]
+        parts += sorted(capabilities)
+        for part in parts:
+            digest.update(utils.refs.to_bytes(part + '\n'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.path, key + self.SUFFIX)
+
+    def _is_expired(self, st, now):
+        return self.max_age and now - st.st_mtime > self.max_age
+
+    def get(self, key):
+        """Open file of a cached pack or None
+        """
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if self._is_expired(st, time.time()):
+                os.remove(path)
+                return None
+            f = open(path, 'rb')
+        except (IOError, OSError):
+            return None
+        # Mark as used for eviction
+        try:
+            os.utime(path, (time.time(), st.st_mtime))
+        except OSError:
+            pass
+        return f
+
+    def writer(self, key):
+        return PackCacheWriter(self, key)
+
+    def _entries(self):
+        entries = []
+        for filename in os.listdir(self.path):
+            if not filename.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.path, filename)
+            try:
+                entries.append((path, os.stat(path)))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """Remove expired entries then least recently used ones over max_size
+        """
+        now = time.time()
+        entries = []
+        for path, st in self._entries():
+            if self._is_expired(st, now):
+                self._remove(path)
+            else:
+                entries.append((st.st_atime, st.st_size, path))
+
+        total = sum(size for atime, size, path in entries)
+        for atime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        for path, st in self._entries():
+            self._remove(path)
+
+
+class PackCacheWriter(object):
+    """Copies a pack to the cache as it's sent, it's only added
+    (atomically) by commit(), abort() drops it
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.path, suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+        self.size = 0
+
+    def write(self, data):
+        if self.file is None:
+            return
+        self.size += len(data)
+        if self.size > self.cache.max_size:
+            # Too big to ever be kept
+            self.abort()
+            return
+        self.file.write(data)
+
+    def commit(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        os.rename(self.tmp_path, self.cache._path(self.key))
+        self.cache.evict()
+
+    def abort(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        self.cache._remove(self.tmp_path)
+
+
+# Client of the connection handled by the current thread (GitServer sets it)
+_connection = threading.local()
+
+
+def current_client():
+    return getattr(_connection, 'client', None)
+
+
+class TracedHandlerMixin(object):
+    """Times a handler and counts its bytes in a RequestTrace (self.trace),
+    sent to the backend's metrics sink (if any) when done
+    """
+    service = None
+
+    def _client_id(self):
+        http_req = getattr(self, 'http_req', None)
+        if http_req is not None:
+            environ = http_req.environ
+            client = environ.get('REMOTE_ADDR')
+            if environ.get('REMOTE_USER'):
+                client = '%s@%s' % (environ['REMOTE_USER'], client)
+            return client
+        client = current_client()
+        if isinstance(client, tuple):
+            return '%s:%s' % client[:2]
+        return client
+
+    def _handle(self):
+        raise NotImplementedError
+
+    def handle(self):
+        self.trace = RequestTrace(self.service, getattr(self.repo, 'path', None), self._client_id())
+        self.proto.report_activity = self.trace.report_activity
+        sink = getattr(self.backend, 'metrics', None)
+        error = None
+        try:
+            self._handle()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.trace.finish(error)
+            if sink is not None:
+                try:
+                    sink.record(self.trace)
+                except Exception:
+                    logger.exception('Could not record metrics')
+
+
+class RecordingGraphWalker(ProtocolGraphWalker):
+    """ProtocolGraphWalker remembering the refs, wants and common haves
+    it negotiated, which key the pack cache
+    """
+
+    def __init__(self, *args, **kwargs):
+        ProtocolGraphWalker.__init__(self, *args, **kwargs)
+        self.refs = None
+        self.wants = []
+        self.common = []
+
+    def determine_wants(self, heads, *args, **kwargs):
+        self.refs = heads
+        self.wants = ProtocolGraphWalker.determine_wants(self, heads, *args, **kwargs)
+        return self.wants
+
+    def ack(self, have_ref):
+        # find_common_revisions acks every have the repository has
+        self.common.append(have_ref)
+        return ProtocolGraphWalker.ack(self, have_ref)
+
+
+class CachingUploadPackHandler(TracedHandlerMixin, UploadPackHandler):
+    """UploadPackHandler reusing the packs of its backend's pack_cache (if any)
+
+    Negotiates like dulwich's handler (through the repository's fetch_objects),
+    then looks the wants and common haves up in the cache before counting and
+    packing objects. Shallow fetches aren't cached. Traces the "negotiation",
+    "counting", "packing" (generation) and "transfer" phases
+    """
+    service = 'git-upload-pack'
+
+    # Bytes of a cached pack per side band write
+    CHUNK_SIZE = 64 * 1024
+
+    def _cache_key(self, pack_cache, graph_walker):
+        if pack_cache is None or not graph_walker.wants:
+            return None
+        if getattr(graph_walker, 'shallow', None) or getattr(graph_walker, 'client_shallow', None):
+            return None
+        capabilities = [cap for cap in PACK_CAPABILITIES if self.has_capability(cap)]
+        return pack_cache.key(self.repo.path, graph_walker.refs, graph_walker.wants,
+                              graph_walker.common, capabilities)
+
+    def _handle(self):
+        trace = self.trace
+        pack_cache = getattr(self.backend, 'pack_cache', None)
+
+        def write(data):
+            with trace.span('transfer'):
+                self.proto.write_sideband(SIDE_BAND_CHANNEL_DATA, data)
+
+        with trace.span('negotiation'):
+            graph_walker = RecordingGraphWalker(self, self.repo.object_store, self.repo.get_peeled)
+            objects_iter = self.repo.fetch_objects(
+                graph_walker.determine_wants, graph_walker, self.progress,
+                get_tagged=self.get_tagged)
+
+        # The client only expects answers to its have lines until negotiation ends
+        self._processing_have_lines = True
+
+        # Shallow requests with nothing to send
+        if objects_iter is None:
+            return
+
+        key = self._cache_key(pack_cache, graph_walker)
+        cached = pack_cache.get(key) if key else None
+
+        if cached is None:
+            with trace.span('counting'):
+                count = len(objects_iter)
+            if count == 0:
+                return
+
+        self._processing_have_lines = False
+
+        with trace.span('negotiation'):
+            done = graph_walker.handle_done(
+                not self.has_capability(CAPABILITY_NO_DONE), self._done_received)
+        if not done:
+            if cached is not None:
+                cached.close()
+            return
+
+        if cached is not None:
+            logger.info('Sending cached pack %s', key)
+            trace.cached = True
+            self.progress('using cached pack.\n')
+            with cached:
+                data = cached.read(self.CHUNK_SIZE)
+                # Object count from the pack header
+                trace.increment(objects=struct.unpack('>L', data[8:12])[0] if len(data) >= 12 else 0)
+                while data:
+                    write(data)
+                    data = cached.read(self.CHUNK_SIZE)
+        else:
+            trace.increment(objects=count)
+            self.progress('counting objects: %d, done.\n' % count)
+            writer = pack_cache.writer(key) if key else None
+            def tee(data):
+                write(data)
+                if writer is not None:
+                    writer.write(data)
+            start = time.time()
+            transfer_before = trace.spans.get('transfer', 0.0)
+            try:
+                write_pack_objects(ProtocolFile(None, tee), objects_iter)
+            except Exception:
+                if writer is not None:
+                    writer.abort()
+                raise
+            if writer is not None:
+                writer.commit()
+            # Generating and sending are interleaved, packing is what isn't sending
+            trace.add('packing', time.time() - start - (trace.spans.get('transfer', 0.0) - transfer_before))
+
+        # we are done
+        self.proto.write_pkt_line(None)
+
+
+class TracedReceivePackHandler(TracedHandlerMixin, ReceivePackHandler):
+    """ReceivePackHandler traced as a single "receive" phase
+    """
+    service = 'git-receive-pack'
+
+    def _handle(self):
+        with self.trace.span('receive'):
+            ReceivePackHandler.handle(self)
+
 
 # Dict entries
-WRITE = (('git-upload-pack', UploadPackHandler),)
-READ = (('git-receive-pack', ReceivePackHandler),)
+# Reading a repository is serving git-upload-pack, writing is git-receive-pack
+READ = (('git-upload-pack', CachingUploadPackHandler),)
+WRITE = (('git-receive-pack', TracedReceivePackHandler),)
 
 READ_HANDLERS = dict(READ)
 
@@ -27,40 +398,516 @@ PERM_MAPPING = {
    'wr': READ_WRITE_HANDLERS,
 }
 
+# Worker pool modes
+MODE_THREAD = 'thread'
+MODE_FORK = 'fork'
+
+# Open repositories kept by SubFileSystemBackend
+DEFAULT_REPO_CACHE_SIZE = 32
+
+# Threads running the git services of GitHTTPApplication
+DEFAULT_HTTP_WORKERS = 8
+DEFAULT_HTTP_PORT = 8000
+
+# Bytes of service output gathered into a response chunk
+# and pending chunks before a service waits for the client
+HTTP_CHUNK_SIZE = 64 * 1024
+HTTP_MAX_PENDING = 64
+
+# Seconds between checks for a shutdown request while serving
+POLL_INTERVAL = 0.5
+
 
 class SubFileSystemBackend(FileSystemBackend):
     """A simple FileSystemBackend restricted to a given path
+
+    Opened repositories are kept in a LRU of cache_size handles (per thread,
+    dulwich's pack files aren't safe to share between threads). A handle is
+    reopened when its pack directory, packed-refs or config changes, loose
+    refs are read from disk on every access anyway
+
+    pack_cache is the PackCache used by CachingUploadPackHandler and
+    metrics the gittle.metrics.MetricsSink handlers send their traces to
     """
-    def __init__(self, root_path):
+    # Files and directories whose changes invalidate a cached handle
+    STAMPED_PATHS = (
+        os.path.join('objects', 'pack'),
+        utils.refs.PACKED_REFS,
+        'config',
+    )
+
+    def __init__(self, root_path, cache_size=None, pack_cache=None, metrics=None):
         self.root_path = root_path
+        self.pack_cache = pack_cache
+        self.metrics = metrics
+        self.cache_size = DEFAULT_REPO_CACHE_SIZE if cache_size is None else cache_size
+        self._local = threading.local()
 
     def rewrite_path(self, path):
         return os.path.join(self.root_path, path)
 
+    @property
+    def _repos(self):
+        if not hasattr(self._local, 'repos'):
+            self._local.repos = OrderedDict()
+        return self._local.repos
+
+    def _stamp(self, full_path):
+        controldir = full_path
+        if os.path.isdir(os.path.join(full_path, '.git')):
+            controldir = os.path.join(full_path, '.git')
+        return tuple(
+            utils.refs.file_stamp(os.path.join(controldir, path))
+            for path in self.STAMPED_PATHS
+        )
+
+    def clear_cache(self):
+        self._repos.clear()
+
     def open_repository(self, path):
         stripped_path = path.strip('/')
         full_path = self.rewrite_path(stripped_path)
+        logger.debug('Opening %s (%s)', path, full_path)
+
+        if not self.cache_size:
+            return super(SubFileSystemBackend, self).open_repository(full_path)
+
+        repos = self._repos
+        stamp = self._stamp(full_path)
+        cached = repos.pop(full_path, None)
+        if cached is not None and cached[0] == stamp:
+            repos[full_path] = cached
+            return cached[1]
+
+        repo = super(SubFileSystemBackend, self).open_repository(full_path)
+        repos[full_path] = (stamp, repo)
+        while len(repos) > self.cache_size:
+            repos.popitem(last=False)
+        return repo
+
 
-        print(('opening %s' % path))
-        print(('full path = %s' % full_path))
+class WorkerThreads(object):
+    """A fixed number of threads running handle(*args) for every submitted job
+    """
+    def __init__(self, count, handle):
+        self.handle = handle
+        self.jobs = queue.Queue()
+        self.threads = [
+            threading.Thread(target=self._run, name='gittle-worker-%d' % i)
+            for i in range(count)
+        ]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            self.handle(*job)
+
+    def submit(self, *args):
+        self.jobs.put(args)
 
-        return super(SubFileSystemBackend, self).open_repository(full_path)
+    def stop(self, timeout=None):
+        """Let the threads finish the submitted jobs, waiting at most timeout seconds
+        Returns True if they all finished
+        """
+        for thread in self.threads:
+            self.jobs.put(None)
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.time()))
+        return not any(thread.is_alive() for thread in self.threads)
 
 
 class GitServer(TCPGitServer):
     """Server using the git protocol over TCP
+
+    Serves one connection at a time unless given a number of workers :
+        mode='thread' : connections are handled by a pool of threads
+        mode='fork' : workers processes are forked, each accepting
+                      and handling connections on the shared socket
+    Other options :
+        max_connections : connections beyond this (handled or waiting
+                          for a thread) are closed right away
+        idle_timeout : seconds a client can stay silent before being disconnected
+        repo_cache_size : open repositories kept, see SubFileSystemBackend
+        pack_cache : a PackCache reused for identical fetches and clones
+        metrics : a gittle.metrics.MetricsSink receiving a trace per request
+
+    serve() returns once stop() is called (or on SIGTERM/SIGINT when serving
+    from the main thread), after the connections in flight are done
+    or shutdown_timeout seconds have passed
     """
     def __init__(self, root_path=None, listen_addr=None, perm=None, *args, **kwargs):
+        # Concurrency options
+        self.workers = kwargs.pop('workers', None)
+        self.mode = kwargs.pop('mode', None) or MODE_THREAD
+        self.max_connections = kwargs.pop('max_connections', None)
+        self.idle_timeout = kwargs.pop('idle_timeout', None)
+        self.shutdown_timeout = kwargs.pop('shutdown_timeout', None)
+        repo_cache_size = kwargs.pop('repo_cache_size', None)
+        pack_cache = kwargs.pop('pack_cache', None)
+        metrics = kwargs.pop('metrics', None)
+        if not self.mode in (MODE_THREAD, MODE_FORK):
+            raise ValueError("Unknown server mode %s" % self.mode)
+
         # Default values
         self.perm = perm or 'r'
         self.root_path = root_path or '/'
         self.listen_addr = listen_addr or 'localhost'
 
         # Backend
-        backend = SubFileSystemBackend(self.root_path)
+        backend = SubFileSystemBackend(self.root_path, cache_size=repo_cache_size, pack_cache=pack_cache, metrics=metrics)
 
         # Handlers by permissions
         handlers = PERM_MAPPING.get(self.perm, READ_HANDLERS)
 
         # This is ugly and due to the fact that TCPGitServer is and old style class
         TCPGitServer.__init__(self, backend, self.listen_addr, handlers=handlers, *args, **kwargs)
+
+        # Dulwich merges handlers into its defaults (which include git-receive-pack),
+        # only serve the ones perm allows, other commands are refused as invalid services
+        self.handlers = dict(handlers)
+
+        # handle_request() returns every POLL_INTERVAL to check for shutdown,
+        # a non blocking socket also keeps forked workers from blocking in accept()
+        # when another one got the connection
+        self.timeout = POLL_INTERVAL
+        self.socket.setblocking(False)
+
+        self.pool = None
+        self.children = set()
+        self._stopping = False
+        self._active = 0
+        self._active_lock = threading.Lock()
+
+    @property
+    def active_connections(self):
+        return self._active
+
+    def verify_request(self, request, client_address):
+        with self._active_lock:
+            if self.max_connections and self._active >= self.max_connections:
+                logger.warning('Refusing connection from %s, %d connections open', client_address, self._active)
+                return False
+            self._active += 1
+        return TCPGitServer.verify_request(self, request, client_address)
+
+    def process_request(self, request, client_address):
+        if self.idle_timeout:
+            request.settimeout(self.idle_timeout)
+        if self.pool is not None:
+            self.pool.submit(request, client_address)
+        else:
+            self._handle_connection(request, client_address)
+
+    def _handle_connection(self, request, client_address):
+        _connection.client = client_address
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            _connection.client = None
+            self.shutdown_request(request)
+            with self._active_lock:
+                self._active -= 1
+
+    def handle_error(self, request, client_address):
+        # Dulwich may wrap the timeout in a protocol error
+        error = sys.exc_info()[1]
+        while error is not None:
+            if isinstance(error, socket.timeout):
+                logger.info('Disconnecting idle client %s', client_address)
+                return
+            error = getattr(error, '__cause__', None) or getattr(error, '__context__', None)
+        TCPGitServer.handle_error(self, request, client_address)
+
+    def stop(self):
+        """Ask serve() to return, can be called from any thread or a signal handler
+        """
+        self._stopping = True
+
+    def _on_signal(self, signum, frame):
+        logger.info('Received signal %d, shutting down', signum)
+        self.stop()
+
+    def _install_signals(self, handler):
+        """Returns the previous handlers, None if not in the main thread
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return None
+        return dict(
+            (signum, signal.signal(signum, handler))
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        )
+
+    def _restore_signals(self, previous):
+        for signum, handler in list((previous or {}).items()):
+            signal.signal(signum, handler)
+
+    def _serve_loop(self):
+        while not self._stopping:
+            self.handle_request()
+
+    def serve(self, shutdown_timeout=None):
+        """Serve connections until stopped
+        """
+        if shutdown_timeout is None:
+            shutdown_timeout = self.shutdown_timeout
+        self._stopping = False
+        if self.workers and self.mode == MODE_FORK:
+            return self._serve_forked(shutdown_timeout)
+
+        previous = self._install_signals(self._on_signal)
+        if self.workers:
+            self.pool = WorkerThreads(self.workers, self._handle_connection)
+        try:
+            self._serve_loop()
+        finally:
+            self._restore_signals(previous)
+            if self.pool is not None:
+                if not self.pool.stop(shutdown_timeout):
+                    logger.warning('Shutting down with %d connections still open', self._active)
+                self.pool = None
+            self.server_close()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children.add(pid)
+            return pid
+
+        # Worker process, the parent handles Ctrl-C and tells us to stop with SIGTERM
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self._on_signal)
+        status = 0
+        try:
+            self._serve_loop()
+        except Exception:
+            logger.exception('Worker %d crashed', os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _reap(self):
+        """Forget exited workers, returns how many there were
+        """
+        count = 0
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                break
+            if not pid:
+                break
+            self.children.discard(pid)
+            count += 1
+        return count
+
+    def _serve_forked(self, shutdown_timeout):
+        previous = self._install_signals(self._on_signal)
+        try:
+            for i in range(self.workers):
+                self._spawn()
+            # Replace workers that die until we're asked to stop
+            while not self._stopping:
+                time.sleep(POLL_INTERVAL)
+                for i in range(self._reap()):
+                    if not self._stopping:
+                        logger.warning('Worker exited, starting a new one')
+                        self._spawn()
+        finally:
+            self._restore_signals(previous)
+            self._stop_children(shutdown_timeout)
+            self.server_close()
+
+    def _stop_children(self, timeout):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                self.children.discard(pid)
+
+        deadline = None if timeout is None else time.time() + timeout
+        while self.children and (deadline is None or time.time() < deadline):
+            self._reap()
+            time.sleep(0.05)
+
+        for pid in list(self.children):
+            logger.warning('Killing worker %d', pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.children.clear()
+
+
+class ResponseStream(object):
+    """Body of a WSGI response written to by a git service running in
+    another thread, small writes (pkt-lines) are gathered in chunks of up to
+    HTTP_CHUNK_SIZE bytes and sent as soon as they're written, without a
+    Content-Length so that HTTP/1.1 servers use chunked transfer encoding
+
+    The service blocks once HTTP_MAX_PENDING writes wait for a slow client
+    and is aborted if the client goes away (the WSGI server closes the body)
+    """
+    # Marks the end of the service's output
+    DONE = object()
+
+    def __init__(self, run, pool=None):
+        self.run = run
+        self.pool = pool
+        self.pending = queue.Queue(HTTP_MAX_PENDING)
+        self.closed = False
+
+    def _put(self, item):
+        while not self.closed:
+            try:
+                self.pending.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def write(self, data):
+        if not self._put(data):
+            raise IOError('Client went away')
+
+    def _produce(self):
+        try:
+            self.run(self.write)
+        except Exception:
+            if not self.closed:
+                logger.exception('Git service failed')
+        finally:
+            self._put(self.DONE)
+
+    def _start(self):
+        if self.pool is not None:
+            self.pool.submit(self)
+            return
+        thread = threading.Thread(target=self._produce)
+        thread.daemon = True
+        thread.start()
+
+    def __iter__(self):
+        self._start()
+        try:
+            done = False
+            while not done:
+                chunk = [self.pending.get()]
+                if chunk[0] is self.DONE:
+                    break
+                size = len(chunk[0])
+                while size < HTTP_CHUNK_SIZE:
+                    try:
+                        data = self.pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    if data is self.DONE:
+                        done = True
+                        break
+                    chunk.append(data)
+                    size += len(data)
+                yield b''.join(chunk)
+        finally:
+            self.closed = True
+
+
+def handle_streaming_service_request(req, backend, mat):
+    """Like dulwich's handle_service_request but streaming the service's output
+    (see ResponseStream) instead of writing it with start_response's write()
+    """
+    service = mat.group().lstrip('/')
+    handler_cls = req.handlers.get(service, None)
+    if handler_cls is None:
+        return [req.forbidden('Unsupported service %s' % service)]
+    try:
+        backend.open_repository(url_prefix(mat))
+    except NotGitRepository as e:
+        return [req.not_found(str(e))]
+
+    req.nocache()
+    req.respond(HTTP_OK, 'application/x-%s-result' % service)
+
+    def run(write):
+        proto = ReceivableProtocol(req.environ['wsgi.input'].read, write)
+        handler = handler_cls(backend, [url_prefix(mat)], proto, http_req=req)
+        handler.handle()
+
+    return ResponseStream(run, req.environ.get('gittle.workers'))
+
+
+class GitHTTPApplication(HTTPGitApplication):
+    """Smart HTTP git server as a WSGI application, serving the repositories
+    under root_path with the same permissions as GitServer (see PERM_MAPPING)
+
+    Services run in a pool of workers threads (so SubFileSystemBackend's
+    repository cache is reused), use make_wsgi_app to also accept
+    gzip request bodies
+    """
+    services = dict(
+        (key, handle_streaming_service_request if handler is handle_service_request else handler)
+        for key, handler in list(HTTPGitApplication.services.items())
+    )
+
+    def __init__(self, root_path=None, perm=None, workers=None, repo_cache_size=None, pack_cache=None,
+                 metrics=None, dumb=False, fallback_app=None):
+        # Default values
+        self.perm = perm or 'r'
+        self.root_path = root_path or '/'
+
+        # Backend
+        backend = SubFileSystemBackend(self.root_path, cache_size=repo_cache_size, pack_cache=pack_cache, metrics=metrics)
+
+        # Handlers by permissions
+        handlers = PERM_MAPPING.get(self.perm, READ_HANDLERS)
+
+        HTTPGitApplication.__init__(self, backend, dumb=dumb, handlers=handlers, fallback_app=fallback_app)
+
+        # Dulwich always adds its default handlers, only allow ours
+        self.handlers = dict(handlers)
+
+        self.pool = WorkerThreads(workers or DEFAULT_HTTP_WORKERS, self._run_stream)
+
+    def _run_stream(self, stream):
+        stream._produce()
+
+    def __call__(self, environ, start_response):
+        environ['gittle.workers'] = self.pool
+        return HTTPGitApplication.__call__(self, environ, start_response)
+
+    def close(self, timeout=None):
+        """Stop the worker threads once the running services are done
+        """
+        return self.pool.stop(timeout)
+
+
+def make_wsgi_app(*args, **kwargs):
+    """GitHTTPApplication(*args, **kwargs) accepting gzip encoded
+    and Content-Length limited request bodies
+    """
+    return GunzipFilter(LimitedInputFilter(GitHTTPApplication(*args, **kwargs)))
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def make_http_server(root_path=None, listen_addr=None, port=None, perm=None, **kwargs):
+    """Standalone smart HTTP server (wsgiref, one thread per request),
+    any other threaded WSGI server can run make_wsgi_app() instead
+    """
+    app = make_wsgi_app(root_path, perm, **kwargs)
+    return make_server(
+        listen_addr or 'localhost',
+        DEFAULT_HTTP_PORT if port is None else port,
+        app,
+        server_class=ThreadingWSGIServer,
+    )
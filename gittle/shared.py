@@ -0,0 +1,208 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import weakref
+import threading
+from collections import OrderedDict
+
+# Dulwich imports
+from dulwich.object_store import BaseObjectStore, DiskObjectStore
+
+# Local imports
+from gittle.gittle import Gittle
+
+
+# Exports
+__all__ = ('SharedGittle', 'SharedObjectStore', 'ObjectCache')
+
+
+# Bytes of (raw) objects kept in a SharedObjectStore's cache by default
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+
+
+class ObjectCache(object):
+    """Thread-safe LRU of parsed objects, bounded by their raw size
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = DEFAULT_CACHE_SIZE if max_size is None else max_size
+        self.size = 0
+        self._lock = threading.Lock()
+        # {sha: (object, size)}
+        self._objects = OrderedDict()
+
+    def get(self, sha):
+        with self._lock:
+            entry = self._objects.pop(sha, None)
+            if entry is None:
+                return None
+            self._objects[sha] = entry
+            return entry[0]
+
+    def add(self, obj):
+        size = obj.raw_length()
+        if size > self.max_size:
+            return
+        with self._lock:
+            if obj.id in self._objects:
+                return
+            self._objects[obj.id] = (obj, size)
+            self.size += size
+            while self.size > self.max_size:
+                old_sha, (old_obj, old_size) = self._objects.popitem(last=False)
+                self.size -= old_size
+
+    def clear(self):
+        with self._lock:
+            self._objects = OrderedDict()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._objects)
+
+
+def _close_store(store):
+    if hasattr(store, 'close'):
+        store.close()
+
+
+class ThreadStore(object):
+    """A thread's DiskObjectStore, closed when the thread (holding the only
+    reference to this, in a threading.local) ends
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.finalizer = weakref.finalize(self, _close_store, store)
+
+
+class SharedObjectStore(BaseObjectStore):
+    """Object store that threads can share : each thread reads through its own
+    DiskObjectStore (they seek their pack files) while parsed objects are
+    cached for all. A thread's store is closed when the thread ends
+
+    Objects are immutable, they're fully parsed before being shared
+    """
+
+    def __init__(self, path, cache_size=None, store_class=None):
+        self.path = path
+        self.store_class = store_class or DiskObjectStore
+        self.cache = ObjectCache(cache_size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Finalizers of the threads' stores, to close them all
+        self._finalizers = []
+
+    @property
+    def store(self):
+        """This thread's DiskObjectStore
+        """
+        thread_store = getattr(self._local, 'thread_store', None)
+        if thread_store is None:
+            thread_store = ThreadStore(self.store_class(self.path))
+            with self._lock:
+                self._finalizers = [f for f in self._finalizers if f.alive]
+                self._finalizers.append(thread_store.finalizer)
+            self._local.thread_store = thread_store
+        return thread_store.store
+
+    def __getitem__(self, sha):
+        obj = self.cache.get(sha)
+        if obj is not None:
+            return obj
+        obj = self.store[sha]
+        # Older dulwichs parse objects on first access
+        if hasattr(obj, '_ensure_parsed'):
+            obj._ensure_parsed()
+        self.cache.add(obj)
+        return obj
+
+    def __contains__(self, sha):
+        return self.cache.get(sha) is not None or sha in self.store
+
+    def contains_loose(self, sha):
+        return self.store.contains_loose(sha)
+
+    def contains_packed(self, sha):
+        return self.store.contains_packed(sha)
+
+    @property
+    def packs(self):
+        return self.store.packs
+
+    def get_raw(self, name):
+        return self.store.get_raw(name)
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def add_object(self, obj):
+        return self.store.add_object(obj)
+
+    def add_objects(self, objects, *args, **kwargs):
+        return self.store.add_objects(objects, *args, **kwargs)
+
+    def __getattr__(self, name):
+        # The rest of DiskObjectStore (pack_dir, add_thin_pack...)
+        if name.startswith('__') or name in ('store', '_local'):
+            raise AttributeError(name)
+        return getattr(self.store, name)
+
+    def close(self):
+        with self._lock:
+            finalizers, self._finalizers = self._finalizers, []
+        # Threads still running get a new store
+        self._local = threading.local()
+        for finalizer in finalizers:
+            finalizer()
+        self.cache.clear()
+
+
+def _locked(prop):
+    """Gittle property built under the handle's lock, threads may all ask for it at once
+    """
+    def getter(self):
+        with self._lock:
+            return prop.fget(self)
+    return property(getter, prop.fset, doc=prop.__doc__)
+
+
+class SharedGittle(Gittle):
+    """Read-only handle of a bare repository that any number of threads
+    can use at once, so that request threads can share one per repository :
+
+        repo = SharedGittle(path)
+        repo.refs, repo.blob_data(sha), repo.commit_info(...), repo.blame(...)
+
+    Objects come from a SharedObjectStore (shared parsed objects,
+    per thread pack files), refs are immutable snapshots (see RefsCache),
+    the commit graph is only ever added to and blame results are an LRU
+    Writes raise ReadOnlyRepository
+    """
+
+    def __init__(self, path, cache_size=None, *args, **kwargs):
+        self.cache_size = cache_size
+        # Reentrant, blamer builds the commit graph
+        self._lock = threading.RLock()
+        kwargs['readonly'] = True
+        super(SharedGittle, self).__init__(path, *args, **kwargs)
+
+    def _setup_object_access(self, repo):
+        if not repo.bare:
+            raise ValueError('SharedGittle only opens bare repositories: %s' % self.path)
+        repo.object_store = SharedObjectStore(repo.object_store.path, self.cache_size)
+        return repo
+
+    repo = _locked(Gittle.repo)
+    commit_graph = _locked(Gittle.commit_graph)
+    refs_cache = _locked(Gittle.refs_cache)
+    sha_index = _locked(Gittle.sha_index)
+    blamer = _locked(Gittle.blamer)
+
+    def close(self):
+        if self._repo is not None:
+            self._repo.object_store.close()
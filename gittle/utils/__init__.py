@@ -1 +1 @@
-from . import paths, urls, git
+from . import paths, urls, git, packs, mmaps, streams, refs, graph, blame
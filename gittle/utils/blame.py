@@ -0,0 +1,154 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import threading
+from difflib import SequenceMatcher
+from collections import OrderedDict
+
+# Dulwich imports
+from dulwich.object_store import tree_lookup_path
+
+
+# Line origins kept by a Blamer (the sum of the cached lists' lengths)
+DEFAULT_CACHE_LINES = 1000 * 1000
+
+
+class Blamer(object):
+    """Line origins of a file's versions
+
+    The origins of the blob a commit has at a path are a list with,
+    for each line, a tuple (commit_sha, line_number) of the commit that
+    introduced it and its (0 based) position there. They are computed from
+    the parents' origins :
+        - a parent with the same blob passes all its origins on unchanged
+          (so commits not touching the path cost a tree lookup, no diff)
+        - otherwise lines matched by a diff against each parent's blob take
+          that parent's origins, the others are the commit's own
+
+    Origins are cached by (path, commit_sha, blob_sha), so blaming after a new
+    commit only diffs the versions that commit changed. The least recently
+    used ones are dropped once the cache holds more than cache_lines lines
+    """
+
+    def __init__(self, object_store, commit_graph, cache_lines=None):
+        self.object_store = object_store
+        self.commit_graph = commit_graph
+        self.cache_lines = DEFAULT_CACHE_LINES if cache_lines is None else cache_lines
+        self._lock = threading.Lock()
+        # {(path, commit_sha, blob_sha): origins}
+        self._origins = OrderedDict()
+        self._lines = 0
+
+    def clear(self):
+        with self._lock:
+            self._origins = OrderedDict()
+            self._lines = 0
+
+    def _cached(self, key):
+        with self._lock:
+            origins = self._origins.pop(key, None)
+            if origins is not None:
+                self._origins[key] = origins
+            return origins
+
+    def _cache(self, key, origins):
+        with self._lock:
+            if key in self._origins:
+                return
+            self._origins[key] = origins
+            self._lines += len(origins)
+            while self._lines > self.cache_lines and self._origins:
+                old_key, old_origins = self._origins.popitem(last=False)
+                self._lines -= len(old_origins)
+
+    def blob_sha(self, commit_sha, path):
+        """SHA of the blob at path in a commit or None
+        """
+        try:
+            mode, sha = tree_lookup_path(self.object_store.__getitem__, self.commit_graph.tree(commit_sha), path)
+        except KeyError:
+            return None
+        return sha
+
+    def lines(self, blob_sha):
+        return self.object_store[blob_sha].data.splitlines(True)
+
+    def _sources(self, node):
+        """(path, parent_sha, blob_sha) nodes a commit's lines can come from
+        """
+        path, commit_sha, blob_sha = node
+        sources = []
+        for parent in self.commit_graph.parents(commit_sha):
+            parent_blob = self.blob_sha(parent, path)
+            if parent_blob == blob_sha:
+                # Unchanged in this parent, everything comes from there
+                return [(path, parent, parent_blob)]
+            if parent_blob is not None:
+                sources.append((path, parent, parent_blob))
+        return sources
+
+    def _compute(self, node, sources, computed):
+        path, commit_sha, blob_sha = node
+        if len(sources) == 1 and sources[0][2] == blob_sha:
+            # Share the parent's list, no copy
+            return computed[sources[0]]
+
+        lines = self.lines(blob_sha)
+        origins = [(commit_sha, i) for i in range(len(lines))]
+        unassigned = set(range(len(lines)))
+        for source in sources:
+            if not unassigned:
+                break
+            source_origins = computed[source]
+            matcher = SequenceMatcher(None, self.lines(source[2]), lines, autojunk=False)
+            for old_start, new_start, size in matcher.get_matching_blocks():
+                for offset in range(size):
+                    line = new_start + offset
+                    if line in unassigned:
+                        origins[line] = source_origins[old_start + offset]
+                        unassigned.discard(line)
+        return origins
+
+    def origins(self, commit_sha, path):
+        """Origins of the lines of path in a commit (see class docstring)
+        Raises KeyError if path doesn't exist there
+        """
+        blob_sha = self.blob_sha(commit_sha, path)
+        if blob_sha is None:
+            raise KeyError("%s not in %s" % (path, commit_sha))
+
+        # Origins used by this walk, held here so that evictions can't drop them
+        # {node: origins}
+        computed = {}
+
+        def lookup(node):
+            if not node in computed:
+                origins = self._cached(node)
+                if origins is None:
+                    return False
+                computed[node] = origins
+            return True
+
+        # Iterative post order walk, histories are deeper than the stack
+        root = (path, commit_sha, blob_sha)
+        sources = {}
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            if lookup(node):
+                stack.pop()
+                continue
+            if not node in sources:
+                sources[node] = self._sources(node)
+            missing = [source for source in sources[node] if not lookup(source)]
+            if missing:
+                stack.extend(missing)
+                continue
+            computed[node] = self._compute(node, sources.pop(node), computed)
+            self._cache(node, computed[node])
+            stack.pop()
+        return computed[root]
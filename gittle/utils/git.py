@@ -7,6 +7,8 @@
 
 # Python imports
 import os
+import re
+import stat
 
 try:
     from io import StringIO
@@ -234,6 +236,27 @@ def blob_from_path(basepath, path):
     return (path, os.stat(fullpath).st_mode, blob)
 
 
+def checkout_blob(object_store, sha, mode, fullpath):
+    """Write a blob to fullpath in the working directory (as a symlink if mode
+    says so), returns the file's lstat for the index entry
+    """
+    dirname = os.path.dirname(fullpath)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    data = object_store[sha].as_raw_string()
+    if os.path.islink(fullpath):
+        os.remove(fullpath)
+    if stat.S_ISLNK(mode):
+        if os.path.lexists(fullpath):
+            os.remove(fullpath)
+        os.symlink(data, fullpath)
+    else:
+        with open(fullpath, 'wb') as working_file:
+            working_file.write(data)
+        os.chmod(fullpath, stat.S_IMODE(mode))
+    return os.lstat(fullpath)
+
+
 def subkey(base, refkey):
     if not refkey.startswith(base):
         return None
@@ -265,3 +288,77 @@ def clean_refs(refs):
         for ref, sha in list(refs.items())
         if not ref.endswith('^{}')
     }
+
+
+def parse_refspec(refspec):
+    """Split a refspec like "+refs/heads/*:refs/remotes/origin/*"
+    into a (force, src, dst) tuple, dst is None if not given
+    """
+    force = refspec.startswith('+')
+    src, sep, dst = refspec.lstrip('+').partition(':')
+    return force, src, dst or None
+
+
+def refspec_expand(src, dst, ref):
+    """Returns the ref that "ref" maps to for a glob refspec (src, dst)
+    or None if src doesn't match it
+    """
+    prefix, sep, suffix = src.partition('*')
+    if dst is None or len(ref) < len(prefix) + len(suffix):
+        return None
+    if not (ref.startswith(prefix) and ref.endswith(suffix)):
+        return None
+    match = ref[len(prefix):len(ref) - len(suffix)]
+    return dst.replace('*', match, 1)
+
+
+def peeled_refs(refs):
+    """Map refs to the SHA they point at once peeled (for annotated tags)
+    """
+    return {
+        ref: refs.get(ref + '^{}', sha)
+        for ref, sha in list(clean_refs(refs).items())
+    }
+
+
+# Revision suffixes : "^{tree}", "^{}", "^2", "^", "~3", "~"
+REV_OPERATOR_REGEX = re.compile(r'\^\{(?P<peel>[a-z]*)\}|(?P<op>[~^])(?P<n>\d*)')
+
+
+def split_revision(rev):
+    """Split "NAME~2^2^{tree}" into ('NAME', [('~', 2), ('^', 2), ('^{}', 'tree')])
+    Raises ValueError on malformed suffixes
+    """
+    match = re.search(r'[~^]', rev)
+    if not match:
+        return rev, []
+    base, suffixes = rev[:match.start()], rev[match.start():]
+
+    operators = []
+    position = 0
+    for match in REV_OPERATOR_REGEX.finditer(suffixes):
+        if match.start() != position:
+            break
+        position = match.end()
+        if match.group('peel') is not None:
+            operators.append(('^{}', match.group('peel')))
+        else:
+            n = match.group('n')
+            operators.append((match.group('op'), int(n) if n else 1))
+    if position != len(suffixes):
+        raise ValueError("Invalid revision %s" % rev)
+    return base, operators
+
+
+def split_range(expr):
+    """Split "A..B" or "A...B" into (A, B, symmetric), None if expr isn't a range
+    """
+    for separator, symmetric in (('...', True), ('..', False)):
+        if separator in expr:
+            a, b = expr.split(separator, 1)
+            return a, b, symmetric
+    return None
+
+
+def is_abbreviated_sha(name):
+    return bool(re.match(r'^[0-9a-fA-F]{4,39}$', name))
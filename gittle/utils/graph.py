@@ -0,0 +1,261 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import heapq
+
+
+class CommitGraph(object):
+    """Parents, dates and generation numbers of the commits of an object store
+
+    A commit's generation is 1 + the highest generation of its parents
+    (roots are 1), so a commit can only be an ancestor of commits with a
+    higher generation. Walks ordered by generation can stop as soon as
+    everything left in their queue is settled, and never need to revisit
+    a commit.
+
+    Computing a generation walks the whole history down to the roots, so walks
+    only use them once they're known and are otherwise ordered by date : they
+    cost the distance to what they look for, and revisit the commits clock skew
+    made them see too early
+
+    Commits are immutable so nothing here is ever invalidated, generations
+    are computed the first time an exact answer needs them and reused afterwards
+    """
+
+    # Clock skew allowed between a commit and its parents by date bounded walks
+    DATE_SLACK = 24 * 60 * 60
+
+    def __init__(self, object_store):
+        self.object_store = object_store
+        self._parents = {}
+        self._times = {}
+        self._trees = {}
+        self._generations = {}
+
+    def _load(self, sha):
+        commit = self.object_store[sha]
+        # Parents missing from a shallow clone are treated as roots
+        self._parents[sha] = [
+            parent
+            for parent in commit.parents
+            if parent in self._parents or parent in self.object_store
+        ]
+        self._times[sha] = commit.commit_time
+        self._trees[sha] = commit.tree
+
+    def parents(self, sha):
+        if not sha in self._parents:
+            self._load(sha)
+        return self._parents[sha]
+
+    def commit_time(self, sha):
+        if not sha in self._times:
+            self._load(sha)
+        return self._times[sha]
+
+    def tree(self, sha):
+        if not sha in self._trees:
+            self._load(sha)
+        return self._trees[sha]
+
+    def generation(self, sha):
+        generations = self._generations
+        if sha in generations:
+            return generations[sha]
+
+        # Iterative depth first walk, histories are deeper than the stack
+        stack = [sha]
+        while stack:
+            current = stack[-1]
+            if current in generations:
+                stack.pop()
+                continue
+            parents = self.parents(current)
+            missing = [parent for parent in parents if not parent in generations]
+            if missing:
+                stack.extend(missing)
+                continue
+            generations[current] = 1 + max([generations[parent] for parent in parents] or [0])
+            stack.pop()
+        return generations[sha]
+
+    def _key(self, tips):
+        """Queue order of a walk from tips : highest generation first if the
+        tips' (and so their ancestors') generations are known, else newest first
+        """
+        if all(sha in self._generations for sha in tips):
+            return lambda sha: (-self.generation(sha), -self.commit_time(sha))
+        return lambda sha: (-self.commit_time(sha),)
+
+    def _reaches(self, old_sha, new_sha, is_below):
+        """True if a walk from new_sha skipping commits is_below(sha) finds old_sha
+        """
+        seen = set([new_sha])
+        queue = [new_sha]
+        while queue:
+            sha = queue.pop()
+            if sha == old_sha:
+                return True
+            for parent in self.parents(sha):
+                if parent in seen or is_below(parent):
+                    continue
+                seen.add(parent)
+                queue.append(parent)
+        return False
+
+    def is_ancestor(self, old_sha, new_sha):
+        """True if old_sha is an ancestor of (or equal to) new_sha
+
+        Until old_sha's generation is known, commits older than old_sha by more
+        than DATE_SLACK are skipped first, so finding it only walks the commits
+        since. Not finding it that way (or clock skew beyond DATE_SLACK) falls
+        back to a walk pruned below old_sha's generation, which is exact
+        """
+        if old_sha == new_sha:
+            return True
+        if not old_sha in self._generations:
+            oldest = self.commit_time(old_sha) - self.DATE_SLACK
+            if self._reaches(old_sha, new_sha, lambda sha: self.commit_time(sha) < oldest):
+                return True
+        old_generation = self.generation(old_sha)
+        # Nothing below old_sha's generation can lead to it
+        return self._reaches(old_sha, new_sha, lambda sha: self.generation(sha) < old_generation)
+
+    def merge_bases(self, one, two):
+        """Best common ancestors of two commits (none of them an ancestor of another)
+        """
+        if one == two:
+            return [one]
+        ONE, TWO, STALE = 1, 2, 4
+        key = self._key([one, two])
+        flags = {one: ONE, two: TWO}
+        queue = [key(one) + (one,), key(two) + (two,)]
+        heapq.heapify(queue)
+        # Queued commits that aren't STALE, the walk ends when there are none
+        active = set([one, two])
+        # {sha: flags it was visited with}
+        visited = {}
+
+        bases = []
+        while active:
+            sha = heapq.heappop(queue)[-1]
+            commit_flags = flags[sha]
+            if visited.get(sha) == commit_flags:
+                # Queued again, nothing changed since
+                continue
+            active.discard(sha)
+            if commit_flags == ONE | TWO:
+                # Generation order means no base found later can be below this one
+                # without having been reached through it (and marked STALE)
+                bases.append(sha)
+                commit_flags |= STALE
+                flags[sha] = commit_flags
+            visited[sha] = commit_flags
+            for parent in self.parents(sha):
+                parent_flags = flags.get(parent, 0) | commit_flags
+                if parent_flags == flags.get(parent):
+                    continue
+                # Date ordered walks revisit commits whose flags changed
+                flags[parent] = parent_flags
+                heapq.heappush(queue, key(parent) + (parent,))
+                if parent_flags & STALE:
+                    active.discard(parent)
+                else:
+                    active.add(parent)
+
+        # Date ordered walks can find a base before one of its descendants
+        if len(bases) > 1:
+            bases = [
+                base for base in bases
+                if not any(other != base and self.is_ancestor(base, other) for other in bases)
+            ]
+        return bases
+
+    def ahead_behind(self, pairs):
+        """Dict of {(a, b): (ahead, behind)} for pairs of commits, where ahead
+        counts the commits reachable from a but not b and behind the opposite
+
+        All pairs are counted in a single walk, each commit carrying the bit
+        mask of the tips it is reachable from. A commit is settled once it is
+        reachable from both or neither commit of every pair, and the walk stops
+        when only settled commits are left to visit. Walks ordered by date (see
+        _key) are exact unless clocks were skewed by more than DATE_SLACK
+        """
+        pairs = list(pairs)
+        tips = []
+        for pair in pairs:
+            for sha in pair:
+                if not sha in tips:
+                    tips.append(sha)
+        bits = dict((sha, 1 << i) for i, sha in enumerate(tips))
+        pair_masks = [(bits[a], bits[b]) for a, b in pairs]
+        counts = [[0, 0] for pair in pairs]
+
+        settled_masks = {}
+
+        def is_settled(mask):
+            if not mask in settled_masks:
+                settled_masks[mask] = all(
+                    bool(mask & a_bit) == bool(mask & b_bit)
+                    for a_bit, b_bit in pair_masks
+                )
+            return settled_masks[mask]
+
+        def count(mask, step):
+            for count, (a_bit, b_bit) in zip(counts, pair_masks):
+                if mask & a_bit and not mask & b_bit:
+                    count[0] += step
+                elif mask & b_bit and not mask & a_bit:
+                    count[1] += step
+
+        key = self._key(tips)
+        masks = dict(bits)
+        # {sha: mask it was counted with}
+        counted = {}
+        queue = [key(sha) + (sha,) for sha in tips]
+        heapq.heapify(queue)
+        # Queued commits that aren't settled yet
+        unsettled = set(sha for sha in tips if not is_settled(masks[sha]))
+
+        # Date ordered walks go on past the last unsettled commit while queued
+        # commits are recent enough to still reach counted ones (clock skew)
+        by_date = not all(sha in self._generations for sha in tips)
+        oldest_counted = None
+
+        while unsettled or (by_date and queue and oldest_counted is not None
+                            and self.commit_time(queue[0][-1]) >= oldest_counted - self.DATE_SLACK):
+            sha = heapq.heappop(queue)[-1]
+            mask = masks[sha]
+            if counted.get(sha) == mask:
+                # Queued again, nothing changed since
+                continue
+            unsettled.discard(sha)
+            # In generation order everything reaching sha was visited, date
+            # ordered walks recount commits reached again with a new mask
+            if sha in counted:
+                count(counted[sha], -1)
+            count(mask, 1)
+            counted[sha] = mask
+            if not is_settled(mask):
+                time = self.commit_time(sha)
+                if oldest_counted is None or time < oldest_counted:
+                    oldest_counted = time
+
+            for parent in self.parents(sha):
+                if masks.get(parent, 0) | mask == masks.get(parent):
+                    continue
+                masks[parent] = masks.get(parent, 0) | mask
+                heapq.heappush(queue, key(parent) + (parent,))
+                if is_settled(masks[parent]) and not parent in counted:
+                    unsettled.discard(parent)
+                else:
+                    unsettled.add(parent)
+
+        return dict(
+            (pair, tuple(count))
+            for pair, count in zip(pairs, counts)
+        )
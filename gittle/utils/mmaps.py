@@ -0,0 +1,414 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import mmap
+import zlib
+import struct
+import threading
+from itertools import chain
+from collections import OrderedDict
+
+# Dulwich imports
+from dulwich.objects import hex_to_sha, sha_to_hex
+from dulwich.object_store import DiskObjectStore
+from dulwich.pack import apply_delta, OFS_DELTA, REF_DELTA
+
+
+# Compressed data is fed to zlib in slices of this size
+INFLATE_CHUNK_SIZE = 64 * 1024
+
+# Bytes of resolved delta bases kept per pack
+DEFAULT_BASE_CACHE_SIZE = 16 * 1024 * 1024
+
+IDX_V2_MAGIC = b'\377tOc'
+
+
+def map_file(path):
+    """Read-only mmap of a whole file, the pages are shared with
+    every other process mapping it
+    """
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MmapIndex(object):
+    """Pack index (version 1 or 2) searched directly in its mmap
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.map = map_file(path)
+        if self.map[:4] == IDX_V2_MAGIC:
+            self.version = struct.unpack('>L', self.map[4:8])[0]
+            fanout_offset = 8
+        else:
+            self.version = 1
+            fanout_offset = 0
+        self.fanout = struct.unpack('>256L', self.map[fanout_offset:fanout_offset + 1024])
+        self.count = self.fanout[-1]
+
+        if self.version == 1:
+            self._entries = 1024
+        else:
+            self._names = fanout_offset + 1024
+            self._offsets = self._names + self.count * 24
+            self._large_offsets = self._offsets + self.count * 4
+
+    def __len__(self):
+        return self.count
+
+    def name(self, i):
+        """Binary SHA of the ith object (in SHA order)
+        """
+        if self.version == 1:
+            start = self._entries + i * 24 + 4
+        else:
+            start = self._names + i * 20
+        return self.map[start:start + 20]
+
+    def offset(self, i):
+        """Offset in the pack of the ith object
+        """
+        if self.version == 1:
+            start = self._entries + i * 24
+            return struct.unpack('>L', self.map[start:start + 4])[0]
+        start = self._offsets + i * 4
+        offset = struct.unpack('>L', self.map[start:start + 4])[0]
+        if offset & 0x80000000:
+            start = self._large_offsets + (offset & 0x7fffffff) * 8
+            offset = struct.unpack('>Q', self.map[start:start + 8])[0]
+        return offset
+
+    def __iter__(self):
+        """Hex SHAs of the objects, like dulwich's indexes
+        """
+        for i in range(self.count):
+            yield sha_to_hex(self.name(i))
+
+    def find(self, sha):
+        """Offset of a (binary or hex) SHA in the pack or None
+        """
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        first_byte = sha[0] if isinstance(sha[0], int) else ord(sha[0])
+        low = self.fanout[first_byte - 1] if first_byte else 0
+        high = self.fanout[first_byte]
+        while low < high:
+            middle = (low + high) // 2
+            name = self.name(middle)
+            if name < sha:
+                low = middle + 1
+            elif name > sha:
+                high = middle
+            else:
+                return self.offset(middle)
+        return None
+
+    def __contains__(self, sha):
+        return self.find(sha) is not None
+
+    def close(self):
+        self.map.close()
+
+
+class MmapPack(object):
+    """Objects of a pack read straight from its mmap, without seeking
+    (so threads can share it) or copying compressed data
+
+    ext_ref(sha) returns (type_num, data) of REF_DELTA bases missing
+    from the pack
+    """
+
+    def __init__(self, basename, ext_ref=None, base_cache_size=None):
+        self.basename = basename
+        # What dulwich calls it
+        self._basename = basename
+        self.index = MmapIndex(basename + '.idx')
+        self.map = map_file(basename + '.pack')
+        self.view = memoryview(self.map)
+        self.ext_ref = ext_ref
+        self.base_cache_size = DEFAULT_BASE_CACHE_SIZE if base_cache_size is None else base_cache_size
+        self._lock = threading.Lock()
+        # {offset: (type_num, data)}
+        self._bases = OrderedDict()
+        self._bases_size = 0
+
+    def name(self):
+        return os.path.basename(self.basename)
+
+    def __contains__(self, sha):
+        return sha in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def _header(self, offset):
+        """(type_num, size, data offset, base) of the entry at offset,
+        base is the base's offset (OFS_DELTA) or binary SHA (REF_DELTA)
+        """
+        data = self.map
+        byte = data[offset]
+        type_num = (byte >> 4) & 7
+        size = byte & 15
+        shift = 4
+        pos = offset + 1
+        while byte & 0x80:
+            byte = data[pos]
+            size |= (byte & 0x7f) << shift
+            shift += 7
+            pos += 1
+
+        base = None
+        if type_num == OFS_DELTA:
+            byte = data[pos]
+            delta_offset = byte & 0x7f
+            pos += 1
+            while byte & 0x80:
+                byte = data[pos]
+                delta_offset = ((delta_offset + 1) << 7) | (byte & 0x7f)
+                pos += 1
+            base = offset - delta_offset
+        elif type_num == REF_DELTA:
+            base = data[pos:pos + 20]
+            pos += 20
+        return type_num, size, pos, base
+
+    def _inflate(self, pos, size):
+        inflater = zlib.decompressobj()
+        chunks = []
+        while not inflater.eof:
+            chunk = self.view[pos:pos + INFLATE_CHUNK_SIZE]
+            if not len(chunk):
+                raise zlib.error('Truncated object in %s.pack' % self.basename)
+            chunks.append(inflater.decompress(chunk))
+            pos += INFLATE_CHUNK_SIZE
+        data = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+        if len(data) != size:
+            raise zlib.error('Object size mismatch in %s.pack' % self.basename)
+        return data
+
+    def _cached_base(self, offset):
+        with self._lock:
+            entry = self._bases.pop(offset, None)
+            if entry is not None:
+                self._bases[offset] = entry
+            return entry
+
+    def _cache_base(self, offset, entry):
+        size = len(entry[1])
+        if size > self.base_cache_size:
+            return
+        with self._lock:
+            if offset in self._bases:
+                return
+            self._bases[offset] = entry
+            self._bases_size += size
+            while self._bases_size > self.base_cache_size:
+                old_offset, (old_type, old_data) = self._bases.popitem(last=False)
+                self._bases_size -= len(old_data)
+
+    def _resolve(self, base):
+        if isinstance(base, int):
+            entry = self._cached_base(base)
+            if entry is None:
+                entry = self.get_raw_at(base)
+                self._cache_base(base, entry)
+            return entry
+        offset = self.index.find(base)
+        if offset is not None:
+            return self._resolve(offset)
+        if self.ext_ref is None:
+            raise KeyError(sha_to_hex(base))
+        return self.ext_ref(base)
+
+    def get_raw_at(self, offset):
+        """(type_num, data) of the object at offset, deltas resolved
+        """
+        type_num, size, pos, base = self._header(offset)
+        if base is None:
+            return type_num, self._inflate(pos, size)
+
+        # Resolve the delta chain iteratively, chains can be long
+        deltas = [self._inflate(pos, size)]
+        while True:
+            if isinstance(base, int):
+                entry = self._cached_base(base)
+                if entry is None:
+                    base_type, base_size, base_pos, next_base = self._header(base)
+                    if next_base is not None:
+                        deltas.append(self._inflate(base_pos, base_size))
+                        base = next_base
+                        continue
+                    entry = (base_type, self._inflate(base_pos, base_size))
+                    self._cache_base(base, entry)
+            else:
+                entry = self._resolve(base)
+            break
+
+        type_num, data = entry
+        for delta in reversed(deltas):
+            data = apply_delta(data, delta)
+            if isinstance(data, list):
+                data = b''.join(data)
+        return type_num, data
+
+    def get_raw(self, sha):
+        """(type_num, data) of a SHA, raises KeyError if missing
+        """
+        offset = self.index.find(sha)
+        if offset is None:
+            raise KeyError(sha if len(sha) == 40 else sha_to_hex(sha))
+        return self.get_raw_at(offset)
+
+    def close(self):
+        # Slices still in use keep the mapping exported, it's then
+        # left for the garbage collector to unmap
+        try:
+            self.view.release()
+            self.map.close()
+            self.index.close()
+        except BufferError:
+            pass
+
+
+class MmapObjectStore(DiskObjectStore):
+    """DiskObjectStore whose packs are MmapPacks, loose objects
+    (and anything else) are read by dulwich
+
+    packs lists the MmapPacks so that dulwich's own lookups
+    (contains_packed, __iter__...) go through them too : each pack is
+    mapped once and dulwich never opens its Packs
+
+    Several processes reading the same repository share its packs
+    through the page cache instead of each reading them into their own buffers
+    """
+
+    def __init__(self, path, base_cache_size=None):
+        super(MmapObjectStore, self).__init__(path)
+        self.base_cache_size = base_cache_size
+        self._mmap_lock = threading.Lock()
+        # {basename: MmapPack}
+        self._mmap_packs = {}
+        # Pack directory's mtime when it was last scanned
+        self._scan_mtime = None
+
+    def _ext_ref(self, sha):
+        return self.get_raw(sha)
+
+    def _scan_packs(self):
+        """Map the packs of the pack directory
+
+        Removed packs are only forgotten, not closed : other threads and
+        open streams may still be reading them, they're unmapped once
+        nothing references them (the mapping outlives the deleted file)
+        """
+        pack_dir = self.pack_dir
+        try:
+            names = os.listdir(pack_dir)
+        except OSError:
+            names = []
+        basenames = set(
+            os.path.join(pack_dir, name[:-len('.idx')])
+            for name in names
+            if name.endswith('.idx') and name[:-len('.idx')] + '.pack' in names
+        )
+        with self._mmap_lock:
+            for basename in set(self._mmap_packs) - basenames:
+                del self._mmap_packs[basename]
+            for basename in basenames - set(self._mmap_packs):
+                try:
+                    self._mmap_packs[basename] = MmapPack(basename, self._ext_ref, self.base_cache_size)
+                except (IOError, OSError):
+                    # Removed since we listed the directory
+                    continue
+            return list(self._mmap_packs.values())
+
+    def _pack_dir_mtime(self):
+        try:
+            return os.stat(self.pack_dir).st_mtime
+        except OSError:
+            return None
+
+    @property
+    def mmap_packs(self):
+        """The MmapPacks, rescanned when packs were added or removed
+        """
+        mtime = self._pack_dir_mtime()
+        if mtime is None or mtime != self._scan_mtime:
+            self._scan_mtime = mtime
+            return self._scan_packs()
+        return list(self._mmap_packs.values())
+
+    @property
+    def packs(self):
+        return self.mmap_packs
+
+    def _update_pack_cache(self):
+        # Never open dulwich Packs, the MmapPacks replace them
+        return []
+
+    def _add_known_pack(self, *args):
+        # Packs dulwich writes are mapped by the next scan,
+        # instead of being kept open as dulwich Packs
+        self._scan_mtime = None
+
+    # Newer dulwichs (0.19+) name it _add_cached_pack
+    _add_cached_pack = _add_known_pack
+
+    def contains_packed(self, sha):
+        return any(sha in pack for pack in self.mmap_packs)
+
+    def __iter__(self):
+        return chain(
+            chain(*self.mmap_packs),
+            self._iter_loose_objects(),
+            self._iter_alternate_objects(),
+        )
+
+    def _get_raw_packed(self, sha, packs):
+        for pack in packs:
+            if sha in pack:
+                return pack.get_raw(sha)
+        return None
+
+    def get_raw(self, name):
+        if len(name) == 40:
+            sha, hexsha = hex_to_sha(name), name
+        else:
+            sha, hexsha = name, sha_to_hex(name)
+
+        raw = self._get_raw_packed(sha, self.mmap_packs)
+        if raw is not None:
+            return raw
+        obj = self._get_loose_object(hexsha)
+        if obj is not None:
+            return obj.type_num, obj.as_raw_string()
+        # Maybe a pack was added since we looked
+        raw = self._get_raw_packed(sha, self._scan_packs())
+        if raw is not None:
+            return raw
+        raise KeyError(hexsha)
+
+    def get_raw_view(self, name):
+        """(type_num, memoryview of the data) of an object,
+        the view shares the decompressed buffer instead of copying it
+        """
+        type_num, data = self.get_raw(name)
+        return type_num, memoryview(data)
+
+    def close(self):
+        with self._mmap_lock:
+            packs, self._mmap_packs = list(self._mmap_packs.values()), {}
+            self._scan_mtime = None
+        for pack in packs:
+            pack.close()
+        if hasattr(super(MmapObjectStore, self), 'close'):
+            super(MmapObjectStore, self).close()
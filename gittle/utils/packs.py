@@ -0,0 +1,279 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import zlib
+import bisect
+
+# Dulwich imports
+from dulwich.errors import ChecksumMismatch
+from dulwich.objects import Commit, sha_to_hex
+from dulwich.pack import PackStreamReader, write_pack_header, compute_file_sha
+
+
+# Name of the file incoming packs are spooled to (in objects/pack)
+SPOOL_NAME = 'tmp_pack_spool'
+
+# Spooled data is synced to disk every CHUNK_SIZE bytes
+CHUNK_SIZE = 1024 * 1024
+
+
+def read_exactly(read):
+    """Wrap a file's read so that short reads (truncated files) raise EOFError
+    """
+    def read_all(size):
+        data = read(size)
+        if len(data) < size:
+            raise EOFError('Truncated pack')
+        return data
+    return read_all
+
+
+class PackSpool(object):
+    """Spools an incoming pack to a file in the pack directory
+    so that an interrupted download can be salvaged by the next fetch
+    """
+
+    def __init__(self, pack_dir, name=None, chunk_size=None):
+        self.path = os.path.join(pack_dir, name or SPOOL_NAME)
+        self.chunk_size = chunk_size or CHUNK_SIZE
+        self._file = None
+        self._unsynced = 0
+
+        # Commits found by complete_objects
+        self.commits = []
+
+    @property
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def write(self, data):
+        # A new download always starts a new spool
+        if self._file is None:
+            self._file = open(self.path, 'wb')
+        self._file.write(data)
+        self._unsynced += len(data)
+        if self._unsynced >= self.chunk_size:
+            self.sync()
+
+    def sync(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+
+    def remove(self):
+        self.close()
+        if self.exists:
+            os.remove(self.path)
+
+    def complete_objects(self):
+        """Walk the spooled pack and validate it
+        Returns a tuple (count, end_offset, complete) where count is the number
+        of whole objects at the start of the spool, end_offset where they end
+        and complete tells if the pack itself is whole
+        """
+        count, end_offset = 0, 0
+        self.commits = []
+        with open(self.path, 'rb') as f:
+            reader = PackStreamReader(read_exactly(f.read), f.read)
+            try:
+                for unpacked in reader.read_objects():
+                    count += 1
+                    end_offset = reader.offset
+                    # Deltified commits are rare and simply not collected
+                    if unpacked.pack_type_num == Commit.type_num:
+                        self.commits.append(sha_to_hex(unpacked.sha()))
+            except (EOFError, AssertionError, ChecksumMismatch, zlib.error):
+                return count, end_offset, False
+        return count, end_offset, True
+
+    def salvage(self, object_store):
+        """Add the whole objects of an interrupted download to object_store
+        Returns the pack they were stored in or None
+        """
+        if not self.exists:
+            return None
+        self.close()
+
+        count, end_offset, complete = self.complete_objects()
+        if not count:
+            self.remove()
+            return None
+
+        # Cut the spool after the last whole object and rewrite it as a valid pack
+        if not complete:
+            with open(self.path, 'r+b') as f:
+                f.truncate(end_offset)
+                f.seek(0)
+                write_pack_header(f, count)
+                f.flush()
+                pack_sha = compute_file_sha(f)
+                f.seek(0, os.SEEK_END)
+                f.write(pack_sha.digest())
+
+        return self.commit(object_store)
+
+    def commit(self, object_store):
+        """Index the spooled pack into object_store, resolving thin pack deltas
+        Returns the new pack or None if nothing was spooled
+        """
+        if not self.exists:
+            return None
+        self.close()
+        with open(self.path, 'rb') as f:
+            pack = object_store.add_thin_pack(read_exactly(f.read), f.read)
+        self.remove()
+        return pack
+
+
+class IndexNames(object):
+    """Sorted hex SHAs of a pack index, read on demand so that
+    bisect can search the index without loading it
+    """
+
+    def __init__(self, index):
+        self.index = index
+        # Binary name of the ith object, dulwich's file indexes or MmapIndex
+        self._unpack_name = getattr(index, '_unpack_name', None) or getattr(index, 'name', None)
+        if self._unpack_name is None:
+            # In memory indexes, just sort them
+            self._names = sorted(index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        if self._unpack_name is None:
+            return self._names[i]
+        return sha_to_hex(self._unpack_name(i))
+
+
+class ShaPrefixIndex(object):
+    """Finds objects by abbreviated SHA, bisecting each pack's index
+    and listing the loose objects directory of the prefix
+    """
+
+    def __init__(self, object_store):
+        self.object_store = object_store
+        # {pack name: IndexNames}
+        self._names = {}
+
+    def _prune(self, packs):
+        """Forget the indexes of packs that were removed (repack, gc)
+        """
+        current = set(pack.name() for pack in packs)
+        for key in set(self._names) - current:
+            self._names.pop(key, None)
+
+    def _pack_names(self, pack):
+        key = pack.name()
+        if not key in self._names:
+            self._names[key] = IndexNames(pack.index)
+        return self._names[key]
+
+    def _pack_matches(self, pack, prefix, limit):
+        names = self._pack_names(pack)
+        i = bisect.bisect_left(names, prefix)
+        matches = []
+        while i < len(names) and len(matches) < limit:
+            name = names[i]
+            if not name.startswith(prefix):
+                break
+            matches.append(name)
+            i += 1
+        return matches
+
+    def _loose_matches(self, prefix):
+        path = getattr(self.object_store, 'path', None)
+        if not path:
+            return []
+        dirname = os.path.join(path, prefix[:2])
+        if not os.path.isdir(dirname):
+            return []
+        return [
+            prefix[:2] + filename
+            for filename in os.listdir(dirname)
+            if filename.startswith(prefix[2:]) and len(filename) == 38
+        ]
+
+    def lookup(self, prefix, limit=2):
+        """Set of (at most limit) SHAs starting with the hex prefix
+        """
+        prefix = prefix.lower()
+        matches = set(self._loose_matches(prefix))
+        packs = list(self.object_store.packs)
+        self._prune(packs)
+        for pack in packs:
+            if len(matches) >= limit:
+                break
+            matches.update(self._pack_matches(pack, prefix, limit))
+        return matches
+
+
+def loose_objects(object_store):
+    """(sha, path) of every loose object of a disk object store
+    """
+    path = getattr(object_store, 'path', None)
+    if not path or not os.path.isdir(path):
+        return
+    for prefix in os.listdir(path):
+        dirname = os.path.join(path, prefix)
+        if len(prefix) != 2 or not os.path.isdir(dirname):
+            continue
+        for filename in os.listdir(dirname):
+            if len(filename) == 38:
+                yield prefix + filename, os.path.join(dirname, filename)
+
+
+class LazyObjects(object):
+    """(object, path) of SHAs, each object read from the store only when
+    the pack writer gets to it (dulwich wants the count up front)
+    """
+
+    def __init__(self, object_store, shas):
+        self.object_store = object_store
+        self.shas = shas
+
+    def __len__(self):
+        return len(self.shas)
+
+    def __iter__(self):
+        for sha in self.shas:
+            yield self.object_store[sha], None
+
+
+def pack_loose_objects(object_store):
+    """Move loose objects into a new pack, then remove the loose copies
+    of packed objects, like: git repack -d && git prune-packed
+    Returns (objects packed, loose files removed)
+    """
+    to_pack = []
+    to_remove = []
+    for sha, path in loose_objects(object_store):
+        to_remove.append(path)
+        if not any(sha in pack for pack in object_store.packs):
+            to_pack.append(sha)
+
+    # Only remove loose objects once they're safely in a pack
+    if to_pack:
+        object_store.add_objects(LazyObjects(object_store, to_pack))
+    for path in to_remove:
+        os.remove(path)
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+    return len(to_pack), len(to_remove)
@@ -112,3 +112,18 @@ def subpaths(root_path, filters=None):
 @arglist
 def globers_to_regex(globers):
     return list(map(fnmatch.translate, globers))
+
+
+def remove_file(root_path, path):
+    """Remove a file and the directories it leaves empty (up to root_path)
+    """
+    abspath = os.path.join(root_path, path)
+    if os.path.lexists(abspath):
+        os.remove(abspath)
+    dirname = os.path.dirname(abspath)
+    while dirname and os.path.abspath(dirname) != os.path.abspath(root_path):
+        try:
+            os.rmdir(dirname)
+        except OSError:
+            break
+        dirname = os.path.dirname(dirname)
@@ -0,0 +1,429 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+
+# Dulwich imports
+from dulwich.file import GitFile
+from dulwich.objects import Tag
+from dulwich.protocol import ZERO_SHA
+from dulwich.refs import SYMREF
+
+# Local imports
+from gittle.exceptions import RefChanged
+
+
+PACKED_REFS = 'packed-refs'
+PACKED_REFS_HEADER = '# pack-refs with: %s\n'
+
+# Symbolic refs are followed at most this deep
+MAX_SYMREF_DEPTH = 5
+
+
+def file_stamp(path):
+    """Something that changes whenever the file or directory at path is replaced,
+    None if it doesn't exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size, st.st_ino)
+
+
+def to_bytes(data):
+    if isinstance(data, bytes):
+        return data
+    return data.encode('utf-8')
+
+
+def read_file(path):
+    """Stripped contents of a (loose ref) file or None
+    """
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def read_packed_refs(path, traits=None):
+    """Parse a packed-refs file
+    Returns a tuple of dicts ({ref: sha}, {ref: peeled_sha})
+    and fills the traits list from the header if given
+    """
+    refs = {}
+    peeled = {}
+    if not os.path.exists(path):
+        return refs, peeled
+    last_ref = None
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('# pack-refs with:') and traits is not None:
+                traits.extend(line.split(':', 1)[1].split())
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('^'):
+                peeled[last_ref] = line[1:]
+                continue
+            sha, last_ref = line.split(' ', 1)
+            refs[last_ref] = sha
+    return refs, peeled
+
+
+def read_loose_refs(controldir, prefix):
+    """Returns ({ref: contents}, {directory: stamp}) for loose refs under prefix
+    """
+    root = os.path.join(controldir, prefix)
+    loose = {}
+    stamps = {root: file_stamp(root)}
+    for dirname, dirnames, filenames in os.walk(root):
+        stamps[dirname] = file_stamp(dirname)
+        relative = os.path.relpath(dirname, controldir).replace(os.path.sep, '/')
+        for filename in filenames:
+            if filename.endswith('.lock'):
+                continue
+            contents = read_file(os.path.join(dirname, filename))
+            # None if removed while we were reading
+            if contents is not None:
+                loose['%s/%s' % (relative, filename)] = contents
+    return loose, stamps
+
+
+class RefsCache(object):
+    """Snapshots of a repository's refs, by prefix (e.g: "refs/heads/")
+
+    A prefix's snapshot only reads the loose refs under it and packed-refs,
+    it is reused until packed-refs or one of the directories it was read from
+    changes (refs are always written by renaming a lock file in place)
+    """
+
+    def __init__(self, controldir):
+        self.controldir = controldir
+        self._packed = None
+        self._snapshots = {}
+        self._resolved = (None, {})
+
+    def invalidate(self):
+        self._packed = None
+        self._snapshots = {}
+        self._resolved = (None, {})
+
+    def packed_refs(self):
+        path = os.path.join(self.controldir, PACKED_REFS)
+        stamp = file_stamp(path)
+        if self._packed is None or self._packed[0] != stamp:
+            self._packed = (stamp, read_packed_refs(path))
+        return self._packed[1]
+
+    def _is_fresh(self, snapshot):
+        packed_stamp, stamps, refs = snapshot
+        if packed_stamp != file_stamp(os.path.join(self.controldir, PACKED_REFS)):
+            return False
+        return all(
+            file_stamp(dirname) == stamp
+            for dirname, stamp in list(stamps.items())
+        )
+
+    def read_ref(self, ref, loose=None, depth=0):
+        """SHA of a full ref name, following symbolic refs, or None
+        """
+        if depth > MAX_SYMREF_DEPTH:
+            return None
+        if loose is not None and ref in loose:
+            contents = loose[ref]
+        else:
+            contents = read_file(os.path.join(self.controldir, ref))
+            if contents is None:
+                contents = self.packed_refs()[0].get(ref)
+        if not contents:
+            return None
+        if contents.startswith(SYMREF):
+            return self.read_ref(contents[len(SYMREF):].strip(), loose, depth + 1)
+        return contents
+
+    def namespace(self, prefix):
+        """Dict of {name: sha} for the refs starting with prefix,
+        names have the prefix removed
+        The returned dict is shared, don't modify it
+        """
+        snapshot = self._snapshots.get(prefix)
+        if snapshot and self._is_fresh(snapshot):
+            return snapshot[2]
+
+        packed_stamp = file_stamp(os.path.join(self.controldir, PACKED_REFS))
+        loose, stamps = read_loose_refs(self.controldir, prefix)
+
+        refs = {
+            ref[len(prefix):]: sha
+            for ref, sha in list(self.packed_refs()[0].items())
+            if ref.startswith(prefix)
+        }
+        for ref in loose:
+            sha = self.read_ref(ref, loose)
+            if sha:
+                refs[ref[len(prefix):]] = sha
+
+        self._snapshots[prefix] = (packed_stamp, stamps, refs)
+        return refs
+
+    def peeled(self, ref):
+        """Peeled SHA of a packed tag if packed-refs knows it
+        """
+        return self.packed_refs()[1].get(ref)
+
+    def resolve(self, ref, formats):
+        """First of the formats (e.g: "refs/heads/%s") giving an existing ref,
+        or None. Resolutions are cached until the refs snapshot changes
+
+        Top level refs (HEAD, FETCH_HEAD, ...) live outside of refs/, so the
+        snapshot doesn't change when they're created : they're checked every
+        time and resolutions they could change aren't cached
+        """
+        refs = self.namespace('refs/')
+        if self._resolved[0] is not refs:
+            self._resolved = (refs, {})
+        resolved = self._resolved[1]
+        if ref in resolved:
+            return resolved[ref]
+
+        cacheable = True
+        fullref = None
+        for f in formats:
+            candidate = f % ref
+            if not '/' in candidate:
+                if candidate.isupper():
+                    if os.path.exists(os.path.join(self.controldir, candidate)):
+                        return candidate
+                    cacheable = False
+                continue
+            if candidate.startswith('refs/') and candidate[len('refs/'):] in refs:
+                fullref = candidate
+                break
+        if cacheable:
+            resolved[ref] = fullref
+        return fullref
+
+    def all(self):
+        """Dict of all refs (full names) including HEAD
+        """
+        refs = dict(
+            ('refs/' + name, sha)
+            for name, sha in list(self.namespace('refs/').items())
+        )
+        head = self.read_ref('HEAD')
+        if head:
+            refs['HEAD'] = head
+        return refs
+
+
+class RefTransaction(object):
+    """Applies many ref creations, updates and deletions at once
+
+    Every ref involved is locked and checked against its expected value
+    (ZERO_SHA meaning it must not exist), then all the new values are written
+    to the lock files before any is renamed in place, so if a lock, check or
+    write fails nothing is changed. Refs are written loose, packed-refs is only
+    rewritten to drop deleted refs, or to pack the refs under refs/ when pack
+    is set (see Gittle.pack_refs). Symbolic refs update their target, unless
+    set with set_symbolic.
+
+    Can be used as a context manager, committing on success
+    """
+
+    def __init__(self, controldir, object_store=None, on_commit=None, pack=False):
+        self.controldir = controldir
+        self.object_store = object_store
+        self.on_commit = on_commit
+        self.pack = pack
+        # {ref: (new value or None to delete, expected_sha or None)},
+        # values are SHAs or the targets of symbolic refs
+        self.updates = {}
+        # Refs whose update is dropped (instead of failing) if they changed
+        self.skip_changed = set()
+        # Refs set to a symbolic ref
+        self.symbolic = set()
+
+    def __len__(self):
+        return len(self.updates)
+
+    def _reset(self):
+        self.updates = {}
+        self.skip_changed = set()
+        self.symbolic = set()
+
+    def set(self, ref, sha, expected=None, skip_changed=False):
+        """skip_changed drops this update if the ref isn't expected anymore,
+        instead of failing the whole transaction
+        """
+        self.updates[ref] = (sha, expected)
+        self.symbolic.discard(ref)
+        if skip_changed:
+            self.skip_changed.add(ref)
+
+    def set_symbolic(self, ref, target, expected=None):
+        """Make ref a symbolic ref to target (e.g: HEAD to refs/heads/master)
+        """
+        self.updates[ref] = (target, expected)
+        self.symbolic.add(ref)
+
+    def delete(self, ref, expected=None):
+        self.updates[ref] = (None, expected)
+        self.symbolic.discard(ref)
+
+    def _path(self, ref):
+        return os.path.join(self.controldir, ref)
+
+    def _follow(self, ref):
+        """Final target of a (possibly symbolic) ref
+        """
+        for i in range(MAX_SYMREF_DEPTH):
+            contents = read_file(self._path(ref))
+            if not contents or not contents.startswith(SYMREF):
+                return ref
+            ref = contents[len(SYMREF):].strip()
+        return ref
+
+    def _lock(self, ref):
+        dirname = os.path.dirname(self._path(ref))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        return GitFile(self._path(ref), 'wb')
+
+    def _peel(self, sha):
+        if self.object_store is None or not sha in self.object_store:
+            return None
+        obj = self.object_store[sha]
+        while isinstance(obj, Tag):
+            obj = self.object_store[obj.object[1]]
+        if obj.id == sha:
+            return None
+        return obj.id
+
+    def _write_packed(self, lock, refs, peeled, traits):
+        lock.write(to_bytes(PACKED_REFS_HEADER % ' '.join(traits)))
+        for ref in sorted(refs):
+            lock.write(to_bytes('%s %s\n' % (refs[ref], ref)))
+            if ref in peeled:
+                lock.write(to_bytes('^%s\n' % peeled[ref]))
+
+    def commit(self):
+        """Apply all updates, returns the dict of {ref: sha} applied (None if deleted)
+        """
+        if not self.updates:
+            return {}
+
+        updates = {}
+        skip_changed = set()
+        symbolic = set()
+        for ref, update in list(self.updates.items()):
+            target = ref if ref in self.symbolic else self._follow(ref)
+            updates[target] = update
+            if ref in self.skip_changed:
+                skip_changed.add(target)
+            if ref in self.symbolic:
+                symbolic.add(target)
+
+        locks = {}
+        packed_lock = None
+        try:
+            for ref in sorted(updates):
+                locks[ref] = self._lock(ref)
+
+            # Deleted refs may be packed, check once packed-refs is locked
+            packed_path = self._path(PACKED_REFS)
+            if self.pack or any(sha is None for sha, expected in list(updates.values())):
+                packed_lock = GitFile(packed_path, 'wb')
+            traits = []
+            packed, peeled = read_packed_refs(packed_path, traits)
+
+            # Check expected values
+            for ref, (sha, expected) in list(updates.items()):
+                if expected is None:
+                    continue
+                current = read_file(self._path(ref)) or packed.get(ref) or ZERO_SHA
+                if current == expected:
+                    continue
+                if ref in skip_changed:
+                    del updates[ref]
+                    locks.pop(ref).abort()
+                    continue
+                raise RefChanged("%s is %s, expected %s" % (ref, current, expected))
+
+            packed_refs = []
+            if self.pack:
+                packed_refs = [
+                    ref for ref, (sha, expected) in list(updates.items())
+                    if ref.startswith('refs/') and sha is not None and not ref in symbolic
+                ]
+            deleted = [ref for ref, (sha, expected) in list(updates.items()) if sha is None]
+
+            if packed_refs or any(ref in packed for ref in deleted):
+                if packed_refs:
+                    # Peeled values are only trustworthy if we can peel the new ones
+                    is_peeled = self.object_store is not None and ('peeled' in traits or not packed)
+                    if not is_peeled:
+                        peeled = {}
+                    traits = ['peeled'] if is_peeled else []
+                for ref in deleted + packed_refs:
+                    packed.pop(ref, None)
+                    peeled.pop(ref, None)
+                for ref in packed_refs:
+                    sha = updates[ref][0]
+                    packed[ref] = sha
+                    peeled_sha = self._peel(sha) if ref.startswith('refs/tags/') else None
+                    if peeled_sha:
+                        peeled[ref] = peeled_sha
+                self._write_packed(packed_lock, packed, peeled, traits)
+            elif packed_lock is not None:
+                packed_lock.abort()
+                packed_lock = None
+
+            # Loose values, nothing is renamed in place until they're all written
+            for ref, (sha, expected) in list(updates.items()):
+                if sha is None or ref in packed_refs:
+                    continue
+                if ref in symbolic:
+                    sha = SYMREF + sha
+                locks[ref].write(to_bytes('%s\n' % sha))
+
+            if packed_lock is not None:
+                packed_lock.close()
+                packed_lock = None
+            for ref, (sha, expected) in list(updates.items()):
+                lock = locks.pop(ref)
+                if sha is None or ref in packed_refs:
+                    # Deleted, or packed (a loose copy would shadow it)
+                    if os.path.exists(self._path(ref)):
+                        os.remove(self._path(ref))
+                    lock.abort()
+                else:
+                    lock.close()
+        finally:
+            if packed_lock is not None:
+                packed_lock.abort()
+            for lock in list(locks.values()):
+                lock.abort()
+
+        self._reset()
+        if self.on_commit:
+            self.on_commit()
+        return dict(
+            (ref, sha)
+            for ref, (sha, expected) in list(updates.items())
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self._reset()
+        return False
@@ -0,0 +1,379 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import io
+import os
+import errno
+import zlib
+import hashlib
+import tempfile
+
+# Dulwich imports
+from dulwich.objects import hex_to_sha, sha_to_hex, Commit, Tree, Blob, Tag
+from dulwich.pack import OFS_DELTA, REF_DELTA
+
+# Local imports
+from .mmaps import MmapPack
+
+
+# Compressed bytes read from disk at once
+READ_CHUNK_SIZE = 64 * 1024
+
+# Type numbers by the type names of loose object headers
+TYPE_NUMS = dict(
+    (cls.type_name, cls.type_num)
+    for cls in (Commit, Tree, Blob, Tag)
+)
+
+
+def read_entry_header(read):
+    """(type_num, size) of the pack entry read(n) is positioned at,
+    deltas' bases are left unread
+    """
+    byte = ord(read(1))
+    type_num = (byte >> 4) & 7
+    size = byte & 15
+    shift = 4
+    while byte & 0x80:
+        byte = ord(read(1))
+        size |= (byte & 0x7f) << shift
+        shift += 7
+    return type_num, size
+
+
+class InflateReader(io.RawIOBase):
+    """Read-only file of an object's data, inflated as it's read
+    from a zlib stream (a loose object or a pack entry)
+
+    Memory use is bounded by the size of the reads, seeking backwards
+    restarts the stream. open_compressed() returns a new file positioned
+    at the start of the zlib stream, skip is how many inflated bytes
+    precede the data (a loose object's header)
+    """
+
+    def __init__(self, open_compressed, size, skip=0, type_num=None):
+        self.open_compressed = open_compressed
+        self.size = size
+        self.skip = skip
+        self.type_num = type_num
+        self._compressed = None
+        self._inflater = None
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _restart(self):
+        if self._compressed is not None:
+            self._compressed.close()
+        self._compressed = self.open_compressed()
+        self._inflater = zlib.decompressobj()
+        self._position = -self.skip
+
+    def _inflate(self, size):
+        """Up to size inflated bytes (less at the end of the stream)
+        """
+        inflater = self._inflater
+        chunks = []
+        while size > 0 and not inflater.eof:
+            data = inflater.unconsumed_tail
+            if not data:
+                data = self._compressed.read(READ_CHUNK_SIZE)
+                if not data:
+                    raise zlib.error('Truncated object stream')
+            chunk = inflater.decompress(data, size)
+            chunks.append(chunk)
+            size -= len(chunk)
+        data = b''.join(chunks)
+        self._position += len(data)
+        return data
+
+    def _skip_to(self, position):
+        if self._inflater is None or position < self._position:
+            self._restart()
+        while self._position < position:
+            if not self._inflate(min(position - self._position, READ_CHUNK_SIZE)):
+                break
+
+    def read(self, size=-1):
+        if self._inflater is None or self._position < 0:
+            self._skip_to(max(self._position, 0))
+        remaining = self.size - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b''
+        return self._inflate(size)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readall(self):
+        return self.read()
+
+    def tell(self):
+        return max(self._position, 0)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._skip_to(min(max(offset, 0), self.size))
+        return self.tell()
+
+    def close(self):
+        if self._compressed is not None:
+            self._compressed.close()
+            self._compressed = None
+        super(InflateReader, self).close()
+
+
+def _open_at(path, offset):
+    def open_compressed():
+        f = open(path, 'rb')
+        f.seek(offset)
+        return f
+    return open_compressed
+
+
+class ViewReader(object):
+    """Reads slices of a memoryview (of a mapped pack) without copying them
+    """
+
+    def __init__(self, view, offset):
+        self.view = view
+        self.offset = offset
+
+    def read(self, size):
+        data = self.view[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def close(self):
+        pass
+
+
+def _mmap_at(pack, offset):
+    def open_compressed():
+        return ViewReader(pack.view, offset)
+    return open_compressed
+
+
+def _pack_offset(pack, sha):
+    index = pack.index
+    if hasattr(index, 'object_offset'):
+        return index.object_offset(sha)
+    return index.object_index(sha)
+
+
+def _open_packed(object_store, sha):
+    """InflateReader of a whole (non delta) packed object, None if it isn't
+    """
+    for pack in object_store.packs:
+        if isinstance(pack, MmapPack):
+            offset = pack.index.find(sha)
+            if offset is None:
+                continue
+            type_num, size, pos, base = pack._header(offset)
+            if base is not None:
+                return None
+            return InflateReader(_mmap_at(pack, pos), size, type_num=type_num)
+
+        try:
+            offset = _pack_offset(pack, sha)
+        except KeyError:
+            continue
+        path = pack._basename + '.pack'
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            type_num, size = read_entry_header(f.read)
+            position = f.tell()
+        if type_num in (OFS_DELTA, REF_DELTA):
+            return None
+        return InflateReader(_open_at(path, position), size, type_num=type_num)
+    return None
+
+
+def _open_loose(object_store, hexsha):
+    """InflateReader of a loose object, None if there's none
+    """
+    path = getattr(object_store, 'path', None)
+    if not path:
+        return None
+    filename = os.path.join(path, hexsha[:2], hexsha[2:])
+    if not os.path.exists(filename):
+        return None
+
+    # The header ("blob 1234\0") is inflated to learn the size
+    with open(filename, 'rb') as f:
+        inflater = zlib.decompressobj()
+        header = b''
+        while not b'\0' in header:
+            data = inflater.unconsumed_tail or f.read(READ_CHUNK_SIZE)
+            if not data:
+                raise zlib.error('Truncated loose object %s' % hexsha)
+            header += inflater.decompress(data, 64)
+    header = header[:header.index(b'\0')]
+    type_name, size = header.split(b' ', 1)
+    type_num = TYPE_NUMS.get(type_name) or TYPE_NUMS.get(type_name.decode('ascii'))
+    return InflateReader(_open_at(filename, 0), int(size), skip=len(header) + 1, type_num=type_num)
+
+
+def open_object(object_store, sha):
+    """Read-only file of an object's data, streamed from disk when it's loose
+    or stored whole in a pack, deltas are resolved in memory
+    Raises KeyError if the object is missing
+    """
+    if len(sha) == 40:
+        binsha, hexsha = hex_to_sha(sha), sha
+    else:
+        binsha, hexsha = sha, sha_to_hex(sha)
+
+    reader = _open_packed(object_store, binsha) or _open_loose(object_store, hexsha)
+    if reader is not None:
+        return reader
+
+    obj = object_store[hexsha]
+    data = obj.as_raw_string()
+    stream = io.BytesIO(data)
+    stream.size = len(data)
+    stream.type_num = obj.type_num
+    return stream
+
+
+def read_range(stream, start, length=None):
+    """Bytes [start, start + length) of a file (to its end if length is None)
+    """
+    stream.seek(start)
+    if length is None:
+        return stream.read()
+    return stream.read(length)
+
+
+def _sized_source(source, size, spool_dir=None):
+    """(binary file, size) for a file object, an iterable of chunks or a
+    string, sources of unknown size are spooled to a temporary file
+    (not to memory). Text (str) is utf-8 encoded
+    """
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    if isinstance(source, bytes):
+        return io.BytesIO(source), len(source)
+    if isinstance(source, io.TextIOBase):
+        # Sizes in characters aren't sizes in bytes, spool the encoded text
+        read = source.read
+        source = iter(lambda: read(READ_CHUNK_SIZE), '')
+    elif hasattr(source, 'read'):
+        if size is not None:
+            return source, size
+        try:
+            position = source.tell()
+            source.seek(0, io.SEEK_END)
+            size = source.tell() - position
+            source.seek(position)
+            return source, size
+        except (AttributeError, IOError, OSError):
+            read = source.read
+            source = iter(lambda: read(READ_CHUNK_SIZE), b'')
+
+    spool = tempfile.TemporaryFile(dir=spool_dir)
+    size = 0
+    for chunk in source:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        spool.write(chunk)
+        size += len(chunk)
+    spool.seek(0)
+    return spool, size
+
+
+def _blob_chunks(source, size):
+    """The chunks of a loose blob (header then data), checking source's size
+    """
+    yield ('blob %d\0' % size).encode('ascii')
+    remaining = size
+    while remaining > 0:
+        chunk = source.read(min(remaining, READ_CHUNK_SIZE))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+    if remaining or source.read(1):
+        raise ValueError('Blob source is not %d bytes long' % size)
+
+
+def hash_blob_file(path):
+    """Hex SHA a file would have as a blob, reading it in chunks
+    (a symlink's blob is its target path, like git stores it)
+    """
+    sha = hashlib.sha1()
+    if os.path.islink(path):
+        target = os.fsencode(os.readlink(path))
+        for chunk in _blob_chunks(io.BytesIO(target), len(target)):
+            sha.update(chunk)
+        return sha.hexdigest()
+    with open(path, 'rb') as f:
+        for chunk in _blob_chunks(f, os.fstat(f.fileno()).st_size):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def write_blob(object_store, source, size=None):
+    """Store a blob read in chunks from source (a file object, an iterable
+    of chunks or a string, see _sized_source) and return its hex SHA
+
+    The blob is hashed and compressed as it's read, straight into a loose
+    object file, so it's never all in memory. Object stores not on disk
+    get a whole Blob
+    """
+    path = getattr(object_store, 'path', None)
+    if not path or not os.path.isdir(path):
+        source, size = _sized_source(source, size)
+        blob = Blob()
+        blob.data = source.read()
+        object_store.add_object(blob)
+        return blob.id
+
+    source, size = _sized_source(source, size, spool_dir=path)
+    sha = hashlib.sha1()
+    compressor = zlib.compressobj()
+    fd, tmp_path = tempfile.mkstemp(prefix='tmp_obj_', dir=path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in _blob_chunks(source, size):
+                sha.update(chunk)
+                f.write(compressor.compress(chunk))
+            f.write(compressor.flush())
+            # The object must be on disk before its name is
+            f.flush()
+            os.fsync(f.fileno())
+        hexsha = sha.hexdigest()
+        dirname = os.path.join(path, hexsha[:2])
+        filename = os.path.join(dirname, hexsha[2:])
+        if os.path.exists(filename):
+            os.remove(tmp_path)
+        else:
+            try:
+                os.makedirs(dirname)
+            except OSError as e:
+                # Another writer may have just created it
+                if e.errno != errno.EEXIST:
+                    raise
+            # Loose objects are read-only, like dulwich and git write them
+            os.chmod(tmp_path, 0o444)
+            os.rename(tmp_path, filename)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return hexsha
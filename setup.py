@@ -38,6 +38,7 @@ setup_kwargs = {
     the python stdlib, dulwich and paramiko (optional).
     """,
     'packages': ['gittle', 'gittle.utils'],
+    'python_requires': '>=3.7',
     'install_requires': [
     # PyPI
     'paramiko>=1.10.0',
@@ -0,0 +1,156 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import time
+import asyncio
+import threading
+import unittest
+
+# Local imports
+from gittle.aio import AsyncGittle, AsyncRunner, CancellableProgress
+from gittle.exceptions import OperationCancelled
+from tests.utils import RepoTestCase
+
+
+class Concurrency(object):
+    """Blocking operation recording how many of its calls ran at once
+    """
+
+    def __init__(self, duration=0.05):
+        self.duration = duration
+        self.running = 0
+        self.highest = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.running += 1
+            self.highest = max(self.highest, self.running)
+        time.sleep(self.duration)
+        with self._lock:
+            self.running -= 1
+        return args
+
+
+class CancellableProgressTest(unittest.TestCase):
+
+    def test_cancel(self):
+        progress = CancellableProgress()
+        progress.update('receiving', objects_received=1)
+        progress.report_activity(10, 'read')
+        self.assertFalse(progress.cancelled)
+
+        progress.cancel()
+        self.assertTrue(progress.cancelled)
+        self.assertRaises(OperationCancelled, progress.check)
+        self.assertRaises(OperationCancelled, progress.update, 'receiving')
+        self.assertRaises(OperationCancelled, progress.report_activity, 10, 'read')
+        self.assertRaises(OperationCancelled, progress, b'Counting objects: 1, done.\n')
+
+
+class AsyncRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = AsyncRunner(concurrency=2)
+        self.addCleanup(self.runner.shutdown)
+
+    def test_run(self):
+        def operation(value, progress=None):
+            self.assertIsInstance(progress, CancellableProgress)
+            return value * 2
+
+        self.assertEqual(asyncio.run(self.runner.run(operation, 21)), 42)
+
+    def test_callback_in_loop_thread(self):
+        events = []
+
+        def callback(event):
+            events.append((event['stage'], threading.current_thread()))
+
+        def operation(progress=None):
+            progress.update('receiving')
+            progress.finish()
+
+        asyncio.run(self.runner.run(operation, callback=callback))
+        self.assertEqual(events, [
+            ('receiving', threading.current_thread()),
+            ('done', threading.current_thread()),
+        ])
+
+    def test_concurrency(self):
+        operation = Concurrency()
+
+        async def main():
+            await asyncio.gather(*[self.runner.run(operation, i) for i in range(6)])
+
+        asyncio.run(main())
+        self.assertEqual(operation.highest, 2)
+
+    def test_cancel(self):
+        started = threading.Event()
+        stopped = []
+
+        def operation(progress=None):
+            started.set()
+            try:
+                while True:
+                    progress.check()
+                    time.sleep(0.01)
+            except OperationCancelled:
+                stopped.append(True)
+                raise
+
+        async def main():
+            task = asyncio.ensure_future(self.runner.run(operation))
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # The thread was done before the task finished
+            self.assertEqual(stopped, [True])
+
+        asyncio.run(main())
+
+
+class AsyncGittleTest(RepoTestCase):
+
+    def setUp(self):
+        super(AsyncGittleTest, self).setUp()
+        self.runner = AsyncRunner(concurrency=4)
+        self.addCleanup(self.runner.shutdown)
+
+    def test_operations_on_a_repository_run_in_turn(self):
+        operation = Concurrency()
+        first = AsyncGittle(self.init_repo('one'), runner=self.runner)
+        second = AsyncGittle(self.init_repo('two'), runner=self.runner)
+        first.gittle.fetch = second.gittle.fetch = operation
+
+        async def main():
+            await asyncio.gather(*[repo.fetch() for repo in (first, first, first)])
+            self.assertEqual(operation.highest, 1)
+            await asyncio.gather(*[repo.fetch() for repo in (first, second)])
+            self.assertEqual(operation.highest, 2)
+
+        asyncio.run(main())
+
+    def test_clone(self):
+        remote = self.init_repo('remote', bare=True)
+        master = self.commit(remote, {'a': 'a\n'})
+        events = []
+
+        async def main():
+            return await AsyncGittle.clone(
+                self.path('remote'), self.path('clone'), runner=self.runner, callback=events.append)
+
+        repo = asyncio.run(main())
+        self.assertEqual(repo.repo.refs['refs/heads/master'], master)
+        self.assertEqual(events[-1]['stage'], 'done')
+
+    def test_blocking_attributes(self):
+        repo = self.init_repo()
+        self.assertEqual(AsyncGittle(repo).path, repo.path)
@@ -0,0 +1,105 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import unittest
+
+# Dulwich imports
+from dulwich.object_store import MemoryObjectStore
+
+# Local imports
+from gittle.utils.blame import Blamer
+from gittle.utils.graph import CommitGraph
+from tests.utils import RepoTestCase, make_commit
+
+
+class BlamerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.object_store = MemoryObjectStore()
+        self.blamer = self.new_blamer()
+
+    def new_blamer(self, **kwargs):
+        return Blamer(self.object_store, CommitGraph(self.object_store), **kwargs)
+
+    def commit(self, files, parents=()):
+        return make_commit(self.object_store, parents, files)
+
+    def test_linear_history(self):
+        c1 = self.commit({'a': 'one\ntwo\n'})
+        c2 = self.commit({'a': 'one\nnew\ntwo\n'}, [c1])
+        c3 = self.commit({'a': 'one\nnew\nTWO\n'}, [c2])
+
+        self.assertEqual(self.blamer.origins(c3, 'a'), [(c1, 0), (c2, 1), (c3, 2)])
+        self.assertEqual(self.blamer.origins(c2, 'a'), [(c1, 0), (c2, 1), (c1, 1)])
+
+    def test_commits_not_touching_the_file(self):
+        c1 = self.commit({'a': 'one\n'})
+        c2 = self.commit({'a': 'one\n', 'b': 'other\n'}, [c1])
+        self.assertEqual(self.blamer.origins(c2, 'a'), [(c1, 0)])
+
+    def test_merges(self):
+        base = self.commit({'a': 'one\ntwo\n'})
+        left = self.commit({'a': 'left\none\ntwo\n'}, [base])
+        right = self.commit({'a': 'one\ntwo\nright\n'}, [base])
+        merge = self.commit({'a': 'left\none\ntwo\nright\nmerge\n'}, [left, right])
+
+        self.assertEqual(self.blamer.origins(merge, 'a'), [
+            (left, 0),
+            (base, 0),
+            (base, 1),
+            (right, 2),
+            (merge, 4),
+        ])
+
+    def test_copied_files_have_their_own_origins(self):
+        c1 = self.commit({'a': 'one\ntwo\n'})
+        # b is a copy of a : same blob, but only introduced by c2
+        c2 = self.commit({'a': 'one\ntwo\n', 'b': 'one\ntwo\n'}, [c1])
+
+        self.assertEqual(self.blamer.origins(c2, 'b'), [(c2, 0), (c2, 1)])
+        self.assertEqual(self.blamer.origins(c2, 'a'), [(c1, 0), (c1, 1)])
+
+        blamer = self.new_blamer()
+        self.assertEqual(blamer.origins(c2, 'a'), [(c1, 0), (c1, 1)])
+        self.assertEqual(blamer.origins(c2, 'b'), [(c2, 0), (c2, 1)])
+
+    def test_missing_path(self):
+        c1 = self.commit({'a': 'one\n'})
+        self.assertRaises(KeyError, self.blamer.origins, c1, 'missing')
+
+    def test_cache_is_bounded(self):
+        shas = [self.commit({'a': 'line\n' * 3})]
+        for i in range(5):
+            shas.append(self.commit({'a': 'line\n' * 3 + 'more\n' * (i + 1)}, [shas[-1]]))
+
+        blamer = self.new_blamer(cache_lines=10)
+        origins = blamer.origins(shas[-1], 'a')
+        self.assertLessEqual(blamer._lines, 10)
+        self.assertEqual(origins, self.blamer.origins(shas[-1], 'a'))
+        self.assertEqual(origins[:4], [(shas[0], 0), (shas[0], 1), (shas[0], 2), (shas[1], 3)])
+
+        blamer.clear()
+        self.assertEqual(blamer._lines, 0)
+        self.assertEqual(blamer.origins(shas[-1], 'a'), origins)
+
+
+class GittleBlameTest(RepoTestCase):
+
+    def test_blame(self):
+        repo = self.init_repo(bare=True)
+        c1 = self.commit(repo, {'a': 'one\ntwo\n'})
+        c2 = self.commit(repo, {'a': 'zero\none\ntwo\n'})
+
+        blame = repo.blame('a')
+        self.assertEqual([line['sha'] for line in blame], [c2, c1, c1])
+        self.assertEqual([line['orig_lineno'] for line in blame], [1, 1, 2])
+        self.assertEqual([line['lineno'] for line in blame], [1, 2, 3])
+        self.assertEqual(repo.blame('a', ref=c1)[1]['sha'], c1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import unittest
+
+# Local imports
+from gittle import Gittle
+from gittle.utils.git import parse_refspec, refspec_expand
+from tests.utils import RepoTestCase, make_tag
+
+
+A = 'a' * 40
+B = 'b' * 40
+C = 'c' * 40
+
+
+class RefspecTest(unittest.TestCase):
+
+    def test_parse_refspec(self):
+        self.assertEqual(
+            parse_refspec('+refs/heads/*:refs/remotes/origin/*'),
+            (True, 'refs/heads/*', 'refs/remotes/origin/*'),
+        )
+        self.assertEqual(parse_refspec('master'), (False, 'master', None))
+
+    def test_refspec_expand(self):
+        self.assertEqual(
+            refspec_expand('refs/heads/*', 'refs/remotes/origin/*', 'refs/heads/dev/x'),
+            'refs/remotes/origin/dev/x',
+        )
+        self.assertIsNone(refspec_expand('refs/heads/*', 'refs/remotes/origin/*', 'refs/tags/v1'))
+        self.assertIsNone(refspec_expand('refs/heads/*', None, 'refs/heads/master'))
+
+
+class MapFetchedRefsTest(RepoTestCase):
+
+    remote_refs = {
+        'HEAD': A,
+        'refs/heads/master': A,
+        'refs/heads/dev': B,
+        'refs/tags/v1': C,
+        'refs/tags/v1^{}': A,
+    }
+
+    def setUp(self):
+        super(MapFetchedRefsTest, self).setUp()
+        self.repo = self.init_repo()
+
+    def test_glob_refspec(self):
+        mapping = self.repo._map_fetched_refs(self.remote_refs, ['+refs/heads/*:refs/remotes/origin/*'])
+        self.assertEqual(mapping, {
+            'refs/remotes/origin/master': 'refs/heads/master',
+            'refs/remotes/origin/dev': 'refs/heads/dev',
+        })
+
+    def test_short_names(self):
+        mapping = self.repo._map_fetched_refs(self.remote_refs, ['dev', 'v1', 'missing'])
+        self.assertEqual(mapping, {
+            'refs/remotes/origin/dev': 'refs/heads/dev',
+            'refs/tags/v1': 'refs/tags/v1',
+        })
+
+    def test_bare_maps_branches_to_branches(self):
+        mapping = self.repo._map_fetched_refs(self.remote_refs, ['dev'], bare=True)
+        self.assertEqual(mapping, {'refs/heads/dev': 'refs/heads/dev'})
+
+    def test_default_refspecs(self):
+        # No remote configured : all branches and tags, plus HEAD
+        self.assertEqual(self.repo._fetch_refspecs(), [
+            '+refs/heads/*:refs/remotes/origin/*',
+            '+refs/tags/*:refs/tags/*',
+            'HEAD',
+        ])
+        self.assertEqual(self.repo._fetch_refspecs(['dev']), ['dev'])
+
+    def test_configured_refspec(self):
+        self.repo.add_remote('upstream', self.path('upstream'))
+        self.assertEqual(self.repo._fetch_refspecs(origin='upstream'), [
+            '+refs/heads/*:refs/remotes/upstream/*',
+            'HEAD',
+        ])
+
+
+class FetchTest(RepoTestCase):
+
+    def setUp(self):
+        super(FetchTest, self).setUp()
+        self.remote = self.init_repo('remote', bare=True)
+        self.master = self.commit(self.remote, {'a': 'a\n'})
+        self.dev = self.commit(self.remote, {'a': 'a\n', 'b': 'b\n'}, branch='dev', parents=[self.master])
+        self.tag = make_tag(self.remote.repo.object_store, 'v1', self.master)
+        self.remote.repo.refs['refs/tags/v1'] = self.tag
+
+        self.local = self.init_repo('local', bare=True)
+        self.local.add_remote('origin', self.remote.path)
+
+    def set_fetch_refspec(self, refspec):
+        config = self.local.repo.get_config()
+        config.set(('remote', 'origin'), 'fetch', refspec)
+        config.write_to_path()
+
+    def test_fetch_follows_configured_refspec(self):
+        self.set_fetch_refspec('+refs/heads/master:refs/remotes/origin/master')
+        self.local.fetch_remote(self.remote.path)
+
+        object_store = self.local.repo.object_store
+        self.assertIn(self.master, object_store)
+        self.assertNotIn(self.dev, object_store)
+        # Tags pointing at fetched commits are followed
+        self.assertIn(self.tag, object_store)
+
+    def test_fetch_explicit_refs(self):
+        remote_refs = self.local.fetch_remote(self.remote.path, refs=['dev'])
+
+        object_store = self.local.repo.object_store
+        self.assertIn(self.dev, object_store)
+        # All of the remote's refs are returned
+        self.assertEqual(remote_refs['refs/heads/master'], self.master)
+
+    def test_fetch_sets_selected_refs(self):
+        self.local.fetch(self.remote.path, bare=True, refs=['dev'])
+
+        self.assertEqual(self.local.repo.refs['refs/heads/dev'], self.dev)
+        self.assertNotIn('refs/heads/master', self.local.repo.refs)
+        self.assertEqual(self.local.repo.refs['refs/tags/v1'], self.tag)
+
+    def test_fetch_wants_nothing_when_up_to_date(self):
+        self.local.fetch_remote(self.remote.path)
+        wants = self.local._wants_refs(self.local._fetch_refspecs())
+        self.assertEqual(wants(self.remote.repo.get_refs()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
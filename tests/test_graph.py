@@ -0,0 +1,171 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import random
+import unittest
+
+# Dulwich imports
+from dulwich.object_store import MemoryObjectStore
+
+# Local imports
+from gittle.utils.graph import CommitGraph
+from tests.utils import RepoTestCase, make_commit
+
+
+def ancestors(object_store, sha):
+    """All the commits reachable from sha (itself included), walked naively
+    """
+    found = set()
+    stack = [sha]
+    while stack:
+        current = stack.pop()
+        if current in found:
+            continue
+        found.add(current)
+        stack.extend(object_store[current].parents)
+    return found
+
+
+def random_history(object_store, count, seed, skew=0):
+    """Commits with one or two random earlier parents, times are
+    increasing but shifted by up to skew seconds either way
+    """
+    rand = random.Random(seed)
+    shas = []
+    for i in range(count):
+        parents = []
+        if shas:
+            parents = rand.sample(shas[-10:], min(len(shas[-10:]), rand.choice((1, 1, 1, 2))))
+        commit_time = 1400000000 + i * 60 + rand.randint(-skew, skew)
+        shas.append(make_commit(object_store, parents, {'n': str(i)}, commit_time=commit_time))
+    return shas
+
+
+class CommitGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.object_store = MemoryObjectStore()
+        self.graph = CommitGraph(self.object_store)
+
+    def commit(self, parents=(), commit_time=None):
+        return make_commit(self.object_store, parents, commit_time=commit_time)
+
+    def test_generations(self):
+        root = self.commit()
+        one = self.commit([root])
+        two = self.commit([one])
+        side = self.commit([root])
+        merge = self.commit([two, side])
+        self.assertEqual(
+            [self.graph.generation(sha) for sha in (root, one, two, side, merge)],
+            [1, 2, 3, 2, 4],
+        )
+
+    def test_is_ancestor(self):
+        root = self.commit()
+        one = self.commit([root])
+        side = self.commit([root])
+        self.assertTrue(self.graph.is_ancestor(root, one))
+        self.assertTrue(self.graph.is_ancestor(one, one))
+        self.assertFalse(self.graph.is_ancestor(one, root))
+        self.assertFalse(self.graph.is_ancestor(side, one))
+
+    def test_is_ancestor_with_clock_skew(self):
+        # An ancestor dated a year after its descendants
+        root = self.commit(commit_time=1400000000)
+        skewed = self.commit([root], commit_time=1400000000 + 365 * 24 * 3600)
+        tip = self.commit([self.commit([skewed], commit_time=1400000100)], commit_time=1400000200)
+        self.assertTrue(self.graph.is_ancestor(skewed, tip))
+        self.assertTrue(CommitGraph(self.object_store).is_ancestor(root, tip))
+
+    def test_merge_bases(self):
+        root = self.commit()
+        base = self.commit([root])
+        one = self.commit([self.commit([base])])
+        two = self.commit([base])
+        self.assertEqual(self.graph.merge_bases(one, two), [base])
+        self.assertEqual(self.graph.merge_bases(one, base), [base])
+        self.assertEqual(self.graph.merge_bases(one, one), [one])
+
+    def test_criss_cross_merge_bases(self):
+        root = self.commit()
+        a = self.commit([root])
+        b = self.commit([root])
+        one = self.commit([a, b])
+        two = self.commit([b, a])
+        self.assertEqual(sorted(self.graph.merge_bases(one, two)), sorted([a, b]))
+
+    def test_unrelated_histories(self):
+        self.assertEqual(self.graph.merge_bases(self.commit(), self.commit()), [])
+
+    def test_ahead_behind(self):
+        base = self.commit()
+        one = self.commit([self.commit([base])])
+        two = self.commit([base])
+        self.assertEqual(self.graph.ahead_behind([(one, two), (two, one), (one, base)]), {
+            (one, two): (2, 1),
+            (two, one): (1, 2),
+            (one, base): (2, 0),
+        })
+
+
+class RandomHistoryTest(unittest.TestCase):
+    """Compare walks with naive ancestor sets, in both walk orders
+    """
+
+    def check(self, shas, object_store, graph):
+        rand = random.Random(1)
+        reachable = dict((sha, ancestors(object_store, sha)) for sha in shas)
+        pairs = [tuple(rand.sample(shas, 2)) for i in range(60)]
+
+        counts = graph.ahead_behind(pairs)
+        for a, b in pairs:
+            self.assertEqual(counts[(a, b)], (len(reachable[a] - reachable[b]), len(reachable[b] - reachable[a])))
+            self.assertEqual(graph.is_ancestor(a, b), a in reachable[b])
+
+            common = reachable[a] & reachable[b]
+            best = set(
+                sha for sha in common
+                if not any(other != sha and sha in reachable[other] for other in common)
+            )
+            self.assertEqual(set(graph.merge_bases(a, b)), best)
+
+    def test_date_order(self):
+        object_store = MemoryObjectStore()
+        shas = random_history(object_store, 120, seed=42)
+        self.check(shas, object_store, CommitGraph(object_store))
+
+    def test_date_order_with_clock_skew(self):
+        object_store = MemoryObjectStore()
+        # Skew of an hour, within DATE_SLACK
+        shas = random_history(object_store, 120, seed=7, skew=3600)
+        self.check(shas, object_store, CommitGraph(object_store))
+
+    def test_generation_order(self):
+        object_store = MemoryObjectStore()
+        shas = random_history(object_store, 120, seed=3, skew=3600)
+        graph = CommitGraph(object_store)
+        for sha in shas:
+            graph.generation(sha)
+        self.check(shas, object_store, graph)
+
+
+class GittleGraphTest(RepoTestCase):
+
+    def test_branches_ahead_behind(self):
+        repo = self.init_repo(bare=True)
+        base = self.commit(repo, {'a': 'a\n'})
+        master = self.commit(repo, {'a': 'b\n'})
+        repo.repo.refs['refs/remotes/origin/master'] = make_commit(repo.repo.object_store, [base], {'a': 'c\n'})
+
+        self.assertEqual(repo.merge_base('master', 'origin/master'), base)
+        self.assertEqual(repo.ahead_behind('master', 'origin/master'), (1, 1))
+        self.assertEqual(repo.branches_ahead_behind(), {'master': (1, 1)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import sys
+import subprocess
+import unittest
+
+# Dulwich imports
+from dulwich.errors import NotGitRepository
+
+# Local imports
+import gittle
+from gittle import Gittle, GittleAuth, ReadOnlyRepository
+from tests.utils import RepoTestCase
+
+
+class LazyConstructionTest(RepoTestCase):
+
+    def test_repository_opened_on_first_use(self):
+        repo = Gittle(self.path('missing'))
+        self.assertIsNone(repo._repo)
+        with self.assertRaises(NotGitRepository):
+            repo.repo
+
+    def test_helpers_built_on_first_use(self):
+        self.init_repo()
+        repo = Gittle(self.path('repo'), username='git', password='secret')
+        self.assertIsNone(repo._filters)
+        self.assertIsNone(repo._authenticator)
+
+        self.assertIsInstance(repo.authenticator, GittleAuth)
+        self.assertEqual(repo.authenticator.username, 'git')
+        self.assertEqual(len(repo.filters), 1)
+
+
+class ReadOnlyTest(RepoTestCase):
+
+    def setUp(self):
+        super(ReadOnlyTest, self).setUp()
+        self.master = self.commit(self.init_repo(bare=True), {'a': 'a\n'})
+        self.repo = Gittle.open_readonly(self.path('repo'))
+
+    def test_reads(self):
+        self.assertTrue(self.repo.readonly)
+        self.assertEqual(self.repo.head, self.master)
+        self.assertEqual(self.repo.refs['refs/heads/master'], self.master)
+
+    def test_writes_refused(self):
+        for method, args in [
+            (self.repo.create_tag, ('v1', self.master)),
+            (self.repo.create_branch, ('master', 'other')),
+            (self.repo.remove_ref, ('refs/heads/master',)),
+            (self.repo.fetch, (self.path('repo'),)),
+            (self.repo.ref_transaction, ()),
+            (self.repo.gc, ()),
+        ]:
+            self.assertRaises(ReadOnlyRepository, method, *args)
+        self.assertEqual(sorted(self.repo.repo.refs.keys()), ['HEAD', 'refs/heads/master'])
+
+
+class LazyExportsTest(unittest.TestCase):
+
+    def python(self, code):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        root = os.path.dirname(os.path.dirname(os.path.abspath(gittle.__file__)))
+        return subprocess.check_output([sys.executable, '-c', code], cwd=root, env=env).decode('utf-8').split()
+
+    def test_imported_on_first_use(self):
+        self.assertEqual(self.python(
+            'import sys, gittle\n'
+            'print("gittle.server" in sys.modules, "asyncio" in sys.modules)\n'
+            'gittle.GitServer, gittle.AsyncGittle\n'
+            'print("gittle.server" in sys.modules, "asyncio" in sys.modules)\n'
+        ), ['False', 'False', 'True', 'True'])
+
+    def test_exports(self):
+        from gittle import GitServer, AsyncGittle, RepoManager, SharedGittle
+        from gittle.multi import RepoManager as manager_class
+        self.assertIs(RepoManager, manager_class)
+        self.assertRaises(AttributeError, getattr, gittle, 'Missing')
@@ -0,0 +1,177 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import json
+import socket
+import unittest
+
+# Local imports
+from gittle.metrics import (
+    RequestTrace, MetricsSink, MultiSink, JSONLinesExporter, PrometheusExporter,
+)
+from tests.utils import RepoTestCase, FakeClock
+
+
+def make_trace(service='git-upload-pack', repo='/srv/repo', duration=0.3, error=None, cached=False, **stats):
+    clock = FakeClock()
+    trace = RequestTrace(service, repo, '127.0.0.1:1234', clock=clock)
+    with trace.span('negotiation'):
+        clock.now += 0.1
+    trace.cached = cached
+    trace.increment(**stats)
+    clock.now = trace.started + duration
+    trace.finish(error)
+    return trace
+
+
+class TraceList(MetricsSink, list):
+
+    def record(self, trace):
+        self.append(trace)
+
+    def close(self):
+        self.closed = True
+
+
+class BrokenSink(MetricsSink):
+
+    def record(self, trace):
+        raise IOError('broken')
+
+
+class RequestTraceTest(unittest.TestCase):
+
+    def test_spans_add_up(self):
+        clock = FakeClock()
+        trace = RequestTrace('git-upload-pack', clock=clock)
+        for i in range(2):
+            with trace.span('transfer'):
+                clock.now += 0.5
+        trace.add('packing', 0.25)
+        self.assertEqual(trace.spans, {'transfer': 1.0, 'packing': 0.25})
+
+    def test_status(self):
+        trace = RequestTrace('git-upload-pack', clock=FakeClock())
+        self.assertEqual(trace.status, 'running')
+        trace.finish()
+        self.assertEqual(trace.status, 'ok')
+        self.assertEqual(make_trace(error=ValueError('bad')).status, 'error')
+
+    def test_counters(self):
+        trace = RequestTrace('git-upload-pack', clock=FakeClock())
+        trace.report_activity(10, 'read')
+        trace.report_activity(100, 'write')
+        trace.report_activity(5, 'write')
+        trace.increment(objects=3)
+        self.assertEqual(trace.stats, {'bytes_received': 10, 'bytes_sent': 105, 'objects': 3})
+
+    def test_as_dict(self):
+        data = make_trace(error=ValueError('bad'), objects=2).as_dict()
+        self.assertEqual(data['service'], 'git-upload-pack')
+        self.assertEqual(data['repo'], '/srv/repo')
+        self.assertEqual(data['client'], '127.0.0.1:1234')
+        self.assertEqual(data['status'], 'error')
+        self.assertEqual(data['error'], 'ValueError: bad')
+        self.assertAlmostEqual(data['duration'], 0.3)
+        self.assertAlmostEqual(data['spans']['negotiation'], 0.1)
+        self.assertEqual(data['objects'], 2)
+        # Serializable as is
+        json.dumps(data)
+
+
+class MultiSinkTest(unittest.TestCase):
+
+    def test_broken_sink_does_not_stop_others(self):
+        first, last = TraceList(), TraceList()
+        sink = MultiSink(first, BrokenSink(), last)
+        trace = make_trace()
+        sink.record(trace)
+        self.assertEqual(first, [trace])
+        self.assertEqual(last, [trace])
+
+        sink.close()
+        self.assertTrue(first.closed and last.closed)
+
+
+class JSONLinesExporterTest(RepoTestCase):
+
+    def test_file(self):
+        exporter = JSONLinesExporter(self.path('metrics.jsonl'))
+        exporter.record(make_trace(objects=1))
+        exporter.record(make_trace(service='git-receive-pack'))
+        exporter.close()
+        with open(self.path('metrics.jsonl')) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['service'] for line in lines], ['git-upload-pack', 'git-receive-pack'])
+        self.assertEqual(lines[0]['objects'], 1)
+
+    def test_unix_socket(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(self.path('metrics.sock'))
+        listener.listen(1)
+
+        exporter = JSONLinesExporter('unix:' + self.path('metrics.sock'))
+        exporter.record(make_trace())
+        connection = listener.accept()[0]
+        self.addCleanup(connection.close)
+        exporter.close()
+        self.assertEqual(json.loads(connection.makefile().readline())['service'], 'git-upload-pack')
+
+    def test_socket_down(self):
+        exporter = JSONLinesExporter('unix:' + self.path('missing.sock'))
+        # Dropped, not raised
+        exporter.record(make_trace())
+        exporter.close()
+
+
+class PrometheusExporterTest(RepoTestCase):
+
+    def test_render(self):
+        exporter = PrometheusExporter()
+        exporter.record(make_trace(duration=0.3, cached=True, objects=5, bytes_sent=100))
+        exporter.record(make_trace(duration=20, error=IOError('gone'), objects=1))
+        exporter.record(make_trace(service='git-receive-pack', repo='/srv/"odd"\nrepo'))
+        lines = exporter.render().splitlines()
+
+        labels = 'repo="/srv/repo",service="git-upload-pack"'
+        for line in [
+            '# TYPE gittle_requests_total counter',
+            'gittle_requests_total{%s,status="error"} 1' % labels,
+            'gittle_requests_total{%s,status="ok"} 1' % labels,
+            'gittle_cached_packs_total{%s} 1' % labels,
+            'gittle_objects_total{%s} 6' % labels,
+            'gittle_bytes_sent_total{%s} 100' % labels,
+            '# TYPE gittle_request_duration_seconds histogram',
+            'gittle_request_duration_seconds_bucket{le="0.5",%s} 1' % labels,
+            'gittle_request_duration_seconds_bucket{le="30",%s} 2' % labels,
+            'gittle_request_duration_seconds_bucket{le="+Inf",%s} 2' % labels,
+            'gittle_request_duration_seconds_count{%s} 2' % labels,
+            'gittle_requests_total{repo="/srv/\\"odd\\"\\nrepo",service="git-receive-pack",status="ok"} 1',
+        ]:
+            self.assertIn(line, lines)
+
+    def test_prefix(self):
+        exporter = PrometheusExporter(prefix='git')
+        exporter.record(make_trace())
+        self.assertIn('# TYPE git_requests_total counter', exporter.render().splitlines())
+
+    def test_file_rewritten_every_interval(self):
+        path = self.path('gittle.prom')
+        exporter = PrometheusExporter(path, interval=60)
+        exporter.record(make_trace())
+        exporter.record(make_trace())
+
+        def requests():
+            with open(path) as f:
+                return [line for line in f if line.startswith('gittle_requests_total')]
+
+        self.assertEqual(requests(), ['gittle_requests_total{repo="/srv/repo",service="git-upload-pack",status="ok"} 1\n'])
+        exporter.close()
+        self.assertEqual(requests(), ['gittle_requests_total{repo="/srv/repo",service="git-upload-pack",status="ok"} 2\n'])
+        with open(path) as f:
+            self.assertEqual(f.read(), exporter.render())
@@ -0,0 +1,124 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import shutil
+import unittest
+
+# Dulwich imports
+from dulwich.objects import Blob, hex_to_sha
+from dulwich.object_store import DiskObjectStore
+
+# Local imports
+from gittle import Gittle
+from gittle.utils.mmaps import MmapObjectStore, MmapPack
+from tests.utils import RepoTestCase, git_delta_pack
+
+
+def blobs(count, prefix=b'blob'):
+    """Blobs similar enough for git to store them as deltas
+    """
+    text = b''.join(b'line %d\n' % i for i in range(100))
+    return [Blob.from_string(b'%s %d\n%s' % (prefix, i, text)) for i in range(count)]
+
+
+def sha_set(store):
+    return set(sha.decode('ascii') if isinstance(sha, bytes) else sha for sha in store)
+
+
+class MmapObjectStoreTest(RepoTestCase):
+
+    def setUp(self):
+        super(MmapObjectStoreTest, self).setUp()
+        self.disk = DiskObjectStore.init(self.path('objects'))
+        self.packed = blobs(5)
+        self.disk.add_objects([(blob, None) for blob in self.packed])
+        self.loose = Blob.from_string(b'loose\n')
+        self.disk.add_object(self.loose)
+        self.store = MmapObjectStore(self.path('objects'))
+        self.addCleanup(self.store.close)
+
+    def assertSameObjects(self, store, disk):
+        self.assertEqual(sha_set(store), sha_set(disk))
+        for sha in sha_set(disk):
+            self.assertEqual(store.get_raw(sha), disk.get_raw(sha))
+            self.assertEqual(store.get_raw(hex_to_sha(sha)), disk.get_raw(sha))
+            self.assertEqual(store[sha].id, disk[sha].id)
+
+    def test_packs_are_mapped(self):
+        self.assertTrue(self.store.packs)
+        self.assertTrue(all(isinstance(pack, MmapPack) for pack in self.store.packs))
+        self.assertSameObjects(self.store, DiskObjectStore(self.path('objects')))
+        # dulwich never opened its own Packs
+        self.assertFalse(self.store._pack_cache)
+
+    def test_contains(self):
+        self.assertTrue(self.store.contains_packed(self.packed[0].id))
+        self.assertFalse(self.store.contains_packed(self.loose.id))
+        self.assertTrue(self.store.contains_loose(self.loose.id))
+        self.assertIn(self.loose.id, self.store)
+        self.assertNotIn(b'0' * 40, self.store)
+
+    def test_missing(self):
+        with self.assertRaises(KeyError) as context:
+            self.store.get_raw(b'0' * 40)
+        self.assertIn('0' * 40, str(context.exception))
+
+    def test_view(self):
+        type_num, view = self.store.get_raw_view(self.packed[0].id)
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(bytes(view), self.packed[0].as_raw_string())
+
+    def test_new_packs_picked_up(self):
+        count = len(self.store.packs)
+        new = Blob.from_string(b'new pack\n')
+        DiskObjectStore(self.path('objects')).add_objects([(new, None)])
+        self.assertEqual(len(self.store.packs), count + 1)
+        self.assertTrue(self.store.contains_packed(new.id))
+        self.assertEqual(self.store[new.id].data, b'new pack\n')
+
+    def test_own_writes(self):
+        new = Blob.from_string(b'written\n')
+        self.store.add_objects([(new, None)])
+        self.assertEqual(self.store[new.id].data, b'written\n')
+        self.assertTrue(all(isinstance(pack, MmapPack) for pack in self.store.packs))
+        self.assertFalse(self.store._pack_cache)
+
+    def test_removed_packs_forgotten(self):
+        pack_dir = self.path('objects', 'pack')
+        self.store.packs
+        for name in os.listdir(pack_dir):
+            os.remove(os.path.join(pack_dir, name))
+        self.assertEqual(self.store.packs, [])
+        self.assertRaises(KeyError, self.store.get_raw, self.packed[0].id)
+
+
+@unittest.skipUnless(shutil.which('git'), 'needs git')
+class MmapDeltasTest(RepoTestCase):
+    """Packs written by git, with offset deltas
+    """
+
+    def test_deltas(self):
+        shas = git_delta_pack(self.path('repo.git'), [blob.data for blob in blobs(20, b'delta')])
+        store = MmapObjectStore(self.path('repo.git', 'objects'))
+        self.addCleanup(store.close)
+        disk = DiskObjectStore(self.path('repo.git', 'objects'))
+        self.assertEqual(len(store.packs), 1)
+        self.assertEqual(sha_set(store), set(shas))
+        for sha in shas:
+            self.assertEqual(store.get_raw(sha), disk.get_raw(sha))
+
+
+class GittleMmapTest(RepoTestCase):
+
+    def test_object_access(self):
+        master = self.commit(self.init_repo(bare=True), {'a': 'a\n'})
+        repo = Gittle(self.path('repo'), object_access=Gittle.OBJECT_ACCESS_MMAP)
+        self.assertIsInstance(repo.repo.object_store, MmapObjectStore)
+        self.assertEqual(repo[master].id, master)
+
+        self.assertRaises(ValueError, lambda: Gittle(self.path('repo'), object_access='other').repo)
@@ -0,0 +1,112 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import time
+import threading
+
+# Local imports
+from gittle import Gittle
+from gittle.multi import RepoManager, RepoResult
+from gittle.pool import ClientPool
+from tests.utils import RepoTestCase
+
+
+class RepoResultTest(RepoTestCase):
+
+    def test_finish(self):
+        result = RepoResult('/repo', 'fetch')
+        result.finish({'updated': {}})
+        self.assertTrue(result.ok)
+        self.assertEqual(result.as_dict()['value'], {'updated': {}})
+        self.assertIsNotNone(result.duration)
+
+        result = RepoResult('/repo', 'fetch')
+        result.finish(error=IOError('gone'))
+        self.assertFalse(result.ok)
+        self.assertEqual(result.as_dict()['error'], 'OSError: gone')
+        self.assertIn('OSError: gone', repr(result))
+
+
+class RepoManagerTest(RepoTestCase):
+
+    def setUp(self):
+        super(RepoManagerTest, self).setUp()
+        self.repos = [self.init_repo('repo%d' % i, bare=True) for i in range(3)]
+        self.heads = [self.commit(repo, {'a': 'repo %d\n' % i}) for i, repo in enumerate(self.repos)]
+        self.manager = RepoManager([repo.path for repo in self.repos], workers=2)
+        self.addCleanup(self.manager.close)
+
+    def test_paths(self):
+        self.manager.add(self.path('repo0'), self.path('repo0', '..', 'repo1'))
+        self.assertEqual(len(self.manager), 3)
+        self.manager.remove(self.path('repo1'))
+        self.assertEqual(list(self.manager), [self.path('repo0'), self.path('repo2')])
+
+    def test_run_in_order(self):
+        results = self.manager.run(lambda repo: repo.repo.refs['refs/heads/master'], operation='head')
+        self.assertEqual([result.path for result in results], list(self.manager))
+        self.assertEqual([result.value for result in results], self.heads)
+        self.assertEqual(set(result.operation for result in results), set(['head']))
+
+    def test_failures_are_results(self):
+        self.manager.add(self.path('missing'))
+        done = []
+        results = self.manager.run(lambda repo: repo.path, callback=done.append)
+        self.assertEqual([result.ok for result in results], [True, True, True, False])
+        self.assertEqual(len(done), 4)
+
+    def test_handles_reused(self):
+        repo = self.manager.get(self.path('repo0'))
+        self.assertIs(self.manager.get(self.path('repo0')), repo)
+
+        # Dropped after a failure
+        def fail(repo):
+            raise ValueError('broken')
+        self.manager.run(fail, paths=[self.path('repo0')])
+        self.assertIsNot(self.manager.get(self.path('repo0')), repo)
+
+    def test_one_operation_per_repository(self):
+        running = set()
+        overlaps = []
+        lock = threading.Lock()
+
+        def operation(repo):
+            with lock:
+                if repo.path in running:
+                    overlaps.append(repo.path)
+                running.add(repo.path)
+            time.sleep(0.02)
+            with lock:
+                running.discard(repo.path)
+
+        self.manager.run(operation, paths=[self.path('repo0')] * 4)
+        self.assertEqual(overlaps, [])
+
+    def test_status(self):
+        results = self.manager.status(paths=[self.path('repo0')])
+        self.assertEqual(results[0].value, {
+            'branch': 'master',
+            'head': self.heads[0],
+            'bare': True,
+        })
+
+    def test_fetch(self):
+        clone = Gittle.clone(self.path('repo0'), self.path('clone'))
+        master = self.commit(self.repos[0], {'a': 'new\n'})
+        result = self.manager.fetch(paths=[clone.path])[0]
+        self.assertTrue(result.ok, result.error)
+        self.assertEqual(result.value['updated'].get('refs/remotes/origin/master'), master)
+        self.assertEqual(result.value['removed'], [])
+
+    def test_gc(self):
+        self.assertTrue(all(result.ok for result in self.manager.gc()))
+
+    def test_pool(self):
+        pool = ClientPool()
+        manager = RepoManager([self.path('repo0')], pool=pool)
+        self.assertIs(manager.get(self.path('repo0')).CLIENT_POOL, pool)
+        self.assertIsNone(Gittle.CLIENT_POOL)
@@ -0,0 +1,182 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import io
+import os
+import unittest
+
+# Dulwich imports
+from dulwich.objects import Blob
+from dulwich.pack import write_pack_objects
+
+# Local imports
+from gittle.utils.packs import PackSpool, ShaPrefixIndex
+from tests.utils import RepoTestCase
+
+
+def pack_data(objects):
+    f = io.BytesIO()
+    write_pack_objects(f, [(obj, None) for obj in objects])
+    return f.getvalue()
+
+
+class FakePack(object):
+    """Pack with an in memory index of hex SHAs
+    """
+
+    def __init__(self, name, shas):
+        self._name = name
+        self.index = list(shas)
+
+    def name(self):
+        return self._name
+
+
+class FakeObjectStore(object):
+
+    def __init__(self, path, packs):
+        self.path = path
+        self.packs = packs
+
+
+class ShaPrefixIndexTest(RepoTestCase):
+
+    def setUp(self):
+        super(ShaPrefixIndexTest, self).setUp()
+        self.store = FakeObjectStore(self.tmpdir, [
+            FakePack('pack-1', ['ab' + '1' * 38, 'ab' + '2' * 38, 'cd' + '0' * 38]),
+        ])
+        self.index = ShaPrefixIndex(self.store)
+
+    def test_packed(self):
+        self.assertEqual(self.index.lookup('AB1'), set(['ab' + '1' * 38]))
+        self.assertEqual(self.index.lookup('ab'), set(['ab' + '1' * 38, 'ab' + '2' * 38]))
+        self.assertEqual(self.index.lookup('ef'), set())
+
+    def test_limit(self):
+        self.assertEqual(len(self.index.lookup('ab', limit=1)), 1)
+
+    def test_loose(self):
+        os.mkdir(self.path('ef'))
+        open(self.path('ef', '3' * 38), 'w').close()
+        self.assertEqual(self.index.lookup('ef3'), set(['ef' + '3' * 38]))
+
+    def test_removed_packs_forgotten(self):
+        self.index.lookup('ab')
+        self.store.packs = [FakePack('pack-2', ['ab' + '3' * 38])]
+        self.assertEqual(self.index.lookup('ab'), set(['ab' + '3' * 38]))
+        self.assertEqual(list(self.index._names), ['pack-2'])
+
+
+class PackSpoolTest(RepoTestCase):
+
+    def setUp(self):
+        super(PackSpoolTest, self).setUp()
+        self.repo = self.init_repo(bare=True)
+        self.object_store = self.repo.repo.object_store
+        self.blobs = [
+            Blob.from_string(b'first blob\n'),
+            Blob.from_string(b'second blob\n'),
+            # Incompressible, so that cutting the pack's end cuts into it
+            Blob.from_string(os.urandom(256)),
+        ]
+        self.data = pack_data(self.blobs)
+        self.spool = PackSpool(self.object_store.pack_dir)
+
+    def test_commit_whole_pack(self):
+        self.spool.write(self.data)
+        pack = self.spool.commit(self.object_store)
+
+        self.assertEqual(len(pack), 3)
+        for blob in self.blobs:
+            self.assertIn(blob.id, self.object_store)
+        self.assertFalse(self.spool.exists)
+
+    def test_complete_objects(self):
+        self.spool.write(self.data[:-30])
+        self.spool.close()
+        count, end_offset, complete = self.spool.complete_objects()
+        self.assertEqual(count, 2)
+        self.assertFalse(complete)
+        self.assertLess(end_offset, len(self.data) - 30)
+
+    def test_salvage_keeps_whole_objects(self):
+        self.spool.write(self.data[:-30])
+        pack = self.spool.salvage(self.object_store)
+
+        self.assertEqual(len(pack), 2)
+        self.assertIn(self.blobs[0].id, self.object_store)
+        self.assertIn(self.blobs[1].id, self.object_store)
+        self.assertNotIn(self.blobs[2].id, self.object_store)
+        self.assertFalse(self.spool.exists)
+
+    def test_salvage_without_whole_objects(self):
+        # Only the pack header
+        self.spool.write(self.data[:12])
+        self.assertIsNone(self.spool.salvage(self.object_store))
+        self.assertFalse(self.spool.exists)
+
+    def test_nothing_to_salvage(self):
+        self.assertIsNone(self.spool.salvage(self.object_store))
+
+    def test_spool_is_synced_in_chunks(self):
+        spool = PackSpool(self.object_store.pack_dir, chunk_size=10)
+        spool.write(b'x' * 5)
+        self.assertEqual(spool._unsynced, 5)
+        spool.write(b'x' * 5)
+        self.assertEqual(spool._unsynced, 0)
+        spool.remove()
+        self.assertFalse(spool.exists)
+
+
+class ResumableFetchTest(RepoTestCase):
+
+    def test_resumable_fetch(self):
+        remote = self.init_repo('remote', bare=True)
+        sha = self.commit(remote, {'a': 'a\n'})
+
+        local = self.init_repo('local', bare=True)
+        local.fetch(remote.path, bare=True, resumable=True)
+
+        self.assertEqual(local.repo.refs['refs/heads/master'], sha)
+        self.assertFalse(local._pack_spool().exists)
+
+    def spool_commit(self, repo, object_store, sha):
+        """Spool a pack of a commit and its tree, as an interrupted download
+        of its history would have left it
+        """
+        commit = object_store[sha]
+        tree = object_store[commit.tree]
+        objects = [commit, tree] + [object_store[entry.sha] for entry in tree.items()]
+        spool = repo._pack_spool()
+        spool.write(pack_data(objects))
+        spool.close()
+
+    def test_resume_heads(self):
+        remote = self.init_repo('remote', bare=True)
+        first = self.commit(remote, {'a': 'a\n'})
+        local = self.init_repo('local', bare=True)
+        self.spool_commit(local, remote.repo.object_store, first)
+
+        self.assertEqual(local._resume_heads(local._pack_spool()), [first])
+        self.assertIn(first, local.repo.object_store)
+
+    def test_fetch_after_interrupted_download(self):
+        remote = self.init_repo('remote', bare=True)
+        first = self.commit(remote, {'a': 'a\n'})
+        second = self.commit(remote, {'a': 'b\n'})
+        local = self.init_repo('local', bare=True)
+        self.spool_commit(local, remote.repo.object_store, first)
+
+        local.fetch(remote.path, bare=True, resumable=True)
+        self.assertEqual(local.repo.refs['refs/heads/master'], second)
+        self.assertIn(first, local.repo.object_store)
+        self.assertFalse(local._pack_spool().exists)
+
+
+if __name__ == '__main__':
+    unittest.main()
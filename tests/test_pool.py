@@ -0,0 +1,249 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import unittest
+
+# Dulwich imports
+from dulwich.client import TCPGitClient
+
+# Local imports
+from gittle import Gittle
+from gittle.auth import get_paramiko
+from gittle.pool import (
+    ClientPool, PooledSSHVendor, AuthSSHVendor, PooledChannel, auth_identity,
+)
+from tests.utils import RepoTestCase
+
+
+class FakeChannel(object):
+
+    def __init__(self, chunks=()):
+        self.chunks = list(chunks)
+        self.command = None
+        self.closed = False
+
+    def exec_command(self, command):
+        self.command = command
+
+    def recv(self, n):
+        if not self.chunks:
+            return b''
+        data = self.chunks.pop(0)
+        if len(data) > n:
+            self.chunks.insert(0, data[n:])
+        return data[:n]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.active = True
+        self.channels = []
+
+    def is_active(self):
+        return self.active
+
+    def open_session(self):
+        channel = FakeChannel()
+        self.channels.append(channel)
+        return channel
+
+
+class FakeClient(object):
+
+    def __init__(self, host, username, kwargs):
+        self.host = host
+        self.username = username
+        self.kwargs = kwargs
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+
+
+class FakeVendor(PooledSSHVendor):
+    """Pooled vendor opening fake connections
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FakeVendor, self).__init__(*args, **kwargs)
+        self.opened = []
+
+    def _connect(self, host, port, username, kwargs):
+        client = FakeClient(host, username, kwargs)
+        self.opened.append(client)
+        return client
+
+
+class RecordingVendor(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def run_command(self, host, command, **kwargs):
+        self.calls.append((host, command, kwargs))
+
+
+class AuthIdentityTest(unittest.TestCase):
+
+    def test_same_credentials(self):
+        self.assertEqual(
+            auth_identity({'username': 'git', 'password': 'secret', 'timeout': None}),
+            auth_identity({'password': 'secret', 'username': 'git'}),
+        )
+
+    def test_secrets_hashed(self):
+        identity = auth_identity({'username': 'git', 'password': 'secret'})
+        self.assertNotIn('secret', repr(identity))
+        self.assertNotEqual(identity, auth_identity({'username': 'git', 'password': 'other'}))
+
+    def test_keys_by_fingerprint(self):
+        class Key(object):
+            def __init__(self, fingerprint):
+                self.fingerprint = fingerprint
+
+            def get_fingerprint(self):
+                return self.fingerprint
+
+        self.assertEqual(auth_identity({'pkey': Key(b'1')}), auth_identity({'pkey': Key(b'1')}))
+        self.assertNotEqual(auth_identity({'pkey': Key(b'1')}), auth_identity({'pkey': Key(b'2')}))
+
+
+class AuthSSHVendorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vendor = RecordingVendor()
+        self.auth_vendor = AuthSSHVendor(self.vendor, {'username': 'auth', 'password': 'secret'})
+
+    def test_url_username_wins(self):
+        self.auth_vendor.run_command('host', 'git-upload-pack', username='url', port=2222)
+        self.assertEqual(self.vendor.calls, [
+            ('host', 'git-upload-pack', {'username': 'url', 'password': 'secret', 'port': 2222}),
+        ])
+
+    def test_credentials_username(self):
+        self.auth_vendor.run_command('host', 'git-upload-pack', password=None)
+        self.assertEqual(self.vendor.calls[0][2]['username'], 'auth')
+        self.assertEqual(self.vendor.calls[0][2]['password'], 'secret')
+
+    def test_with_auth(self):
+        class Auth(object):
+            def kwargs(self):
+                return {'username': 'auth'}
+
+        vendor = PooledSSHVendor()
+        self.assertEqual(vendor.with_auth(Auth()).credentials, {'username': 'auth'})
+        self.assertEqual(vendor.with_auth(None).credentials, {})
+
+
+class PooledSSHVendorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vendor = FakeVendor()
+
+    def run_command(self, *args, **kwargs):
+        kwargs.setdefault('username', 'git')
+        return self.vendor.run_command('host', ['git-upload-pack', "'/repo'"], *args, **kwargs)
+
+    def test_reuses_connection(self):
+        first = self.run_command(password='secret')
+        second = self.run_command(password='secret')
+        self.assertEqual(len(self.vendor.opened), 1)
+        self.assertEqual(len(self.vendor.opened[0].transport.channels), 2)
+        self.assertEqual(first.channel.command, "git-upload-pack '/repo'")
+
+        # Closing a command's channel keeps the connection
+        first.close()
+        self.assertTrue(first.channel.closed)
+        self.assertFalse(self.vendor.opened[0].closed)
+
+    def test_connection_per_credentials(self):
+        self.run_command(password='secret')
+        self.run_command(password='other')
+        self.run_command(username='other', password='secret')
+        self.run_command(password='secret', port=2222)
+        self.assertEqual(len(self.vendor.opened), 4)
+
+    def test_reopens_dead_connection(self):
+        self.run_command()
+        self.vendor.opened[0].transport.active = False
+        self.run_command()
+        self.assertEqual(len(self.vendor.opened), 2)
+        self.assertTrue(self.vendor.opened[0].closed)
+
+    def test_reopens_idle_connection(self):
+        self.run_command()
+        for entry in self.vendor._connections.values():
+            entry[1] -= self.vendor.max_idle + 1
+        self.run_command()
+        self.assertEqual(len(self.vendor.opened), 2)
+
+    def test_bytes_command(self):
+        channel = self.vendor.run_command('host', b"git-receive-pack '/repo'")
+        self.assertEqual(channel.channel.command, "git-receive-pack '/repo'")
+
+    def test_close(self):
+        self.run_command()
+        self.vendor.close()
+        self.assertTrue(self.vendor.opened[0].closed)
+        self.run_command()
+        self.assertEqual(len(self.vendor.opened), 2)
+
+
+class PooledChannelTest(unittest.TestCase):
+
+    def test_read_fills_request(self):
+        channel = PooledChannel(FakeChannel([b'ab', b'cd', b'ef']))
+        self.assertEqual(channel.read(5), b'abcde')
+
+    def test_read_until_closed(self):
+        channel = PooledChannel(FakeChannel([b'ab']))
+        self.assertEqual(channel.read(5), b'ab')
+
+
+class ClientPoolTest(RepoTestCase):
+
+    def test_other_transports_untouched(self):
+        client, path = ClientPool().get_client('git://example.com/repo')
+        self.assertIsInstance(client, TCPGitClient)
+        self.assertEqual(path, '/repo')
+
+    @unittest.skipIf(get_paramiko() is None, 'needs paramiko')
+    def test_ssh_clients_share_vendor(self):
+        pool = ClientPool()
+
+        class Auth(object):
+            def kwargs(self):
+                return {'username': 'auth'}
+
+        first, path = pool.get_client('ssh://git@example.com/repo', auth=Auth())
+        second, path = pool.get_client('ssh://example.com/other')
+        self.assertIsInstance(first.ssh_vendor, AuthSSHVendor)
+        self.assertIs(first.ssh_vendor.vendor, second.ssh_vendor.vendor)
+        self.assertEqual(first.ssh_vendor.credentials, {'username': 'auth'})
+
+    def test_opt_in(self):
+        self.assertIsNone(Gittle.CLIENT_POOL)
+
+        calls = []
+
+        class Pool(object):
+            def get_client(self, uri, auth=None, **kwargs):
+                calls.append((uri, auth))
+                return None, '/repo'
+
+        repo = self.init_repo()
+        repo.CLIENT_POOL = Pool()
+        repo.get_client('ssh://example.com/repo')
+        self.assertEqual(calls, [('ssh://example.com/repo', repo.authenticator)])
@@ -0,0 +1,90 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import unittest
+
+# Local imports
+from gittle import Gittle, TransferProgress
+from tests.utils import RepoTestCase, FakeClock
+
+
+class TransferProgressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.clock = FakeClock()
+        self.progress = TransferProgress(self.events.append, interval=1, clock=self.clock)
+
+    def test_parses_server_messages(self):
+        self.progress(b'Counting objects: 42, done.\n')
+        self.progress(b'Compressing objects:  50% (3/6)\r')
+        self.assertEqual(self.progress.stats['objects_counted'], 42)
+        self.assertEqual(self.progress.stats['objects_compressed'], 3)
+        self.assertEqual(self.progress.stage, 'compressing')
+
+    def test_buffers_partial_lines(self):
+        self.progress('Receiving obj')
+        self.assertEqual(self.progress.stats['objects_received'], 0)
+        self.progress('ects:  10% (1/10)\r')
+        self.assertEqual(self.progress.stats['objects_received'], 1)
+
+    def test_total_line(self):
+        self.progress('Total 42 (delta 12), reused 0 (delta 0)\n')
+        self.assertEqual(self.progress.stats['objects_counted'], 42)
+        self.assertEqual(self.progress.total_deltas, 12)
+
+    def test_events_are_throttled_unless_the_stage_changes(self):
+        self.progress.update('receiving', objects_received=1)
+        self.progress.update('receiving', objects_received=2)
+        self.assertEqual(len(self.events), 1)
+
+        self.clock.now += 1
+        self.progress.update('receiving', objects_received=3)
+        self.assertEqual(len(self.events), 2)
+
+        self.progress.update('resolving', objects_resolved=1)
+        self.assertEqual(len(self.events), 3)
+        self.assertEqual(self.events[-1]['stage'], 'resolving')
+
+    def test_rates_and_byte_counts(self):
+        self.progress.report_activity(1000, 'read')
+        self.progress.report_activity(10, 'write')
+        self.clock.now += 2
+        self.assertEqual(self.progress.stats['bytes_received'], 1000)
+        self.assertEqual(self.progress.stats['bytes_sent'], 10)
+        self.assertEqual(self.progress.rate('bytes_received'), 500.0)
+
+    def test_finish_always_reports(self):
+        self.progress.update('receiving')
+        self.progress.finish()
+        self.assertEqual(self.events[-1]['stage'], 'done')
+        self.assertEqual(self.events[-1]['elapsed'], 0)
+
+    def test_wrap(self):
+        self.assertIs(TransferProgress.wrap(self.progress), self.progress)
+        self.assertIsNone(TransferProgress.wrap(print))
+        self.assertIsNone(TransferProgress.wrap(None))
+
+
+class CloneProgressTest(RepoTestCase):
+
+    def test_clone_reports_progress(self):
+        remote = self.init_repo('remote', bare=True)
+        self.commit(remote, {'a': 'a\n', 'b': 'b\n'})
+
+        events = []
+        progress = TransferProgress(events.append, interval=0)
+        Gittle.clone(remote.path, self.path('clone'), progress=progress)
+
+        stages = [event['stage'] for event in events]
+        self.assertIn('checkout', stages)
+        self.assertEqual(stages[-1], 'done')
+        self.assertEqual(progress.stats['files_written'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import unittest
+
+# Dulwich imports
+from dulwich.objects import Blob
+
+# Local imports
+from gittle import Gittle
+from gittle.exceptions import NonFastForward, WorkingChangesConflict, RefChanged
+from gittle.utils.streams import hash_blob_file
+from tests.utils import RepoTestCase
+
+
+class PullTest(RepoTestCase):
+
+    def setUp(self):
+        super(PullTest, self).setUp()
+        self.remote = self.init_repo('remote', bare=True)
+        self.first = self.commit(self.remote, {'a': 'a\n', 'b': 'b\n'})
+        self.local = Gittle.clone(self.remote.path, self.path('local'))
+
+    def read(self, name):
+        with open(self.local.abspath(name)) as f:
+            return f.read()
+
+    def test_fast_forward_updates_changed_files(self):
+        second = self.commit(self.remote, {'a': 'new a\n', 'c': 'c\n'})
+
+        self.assertEqual(self.local.pull(self.remote.path), second)
+        self.assertEqual(self.local.repo.refs['refs/heads/master'], second)
+        self.assertEqual(self.read('a'), 'new a\n')
+        self.assertEqual(self.read('c'), 'c\n')
+        self.assertFalse(os.path.exists(self.local.abspath('b')))
+        self.assertEqual(self.local.modified_files, [])
+
+    def test_up_to_date(self):
+        self.assertEqual(self.local.pull(self.remote.path), self.first)
+
+    def test_diverged(self):
+        self.commit(self.remote, {'a': 'remote\n'})
+        local_sha = self.commit(self.local, {'a': 'local\n'})
+
+        self.assertRaises(NonFastForward, self.local.pull, self.remote.path)
+        self.assertEqual(self.local.repo.refs['refs/heads/master'], local_sha)
+
+    def test_local_changes_in_the_way(self):
+        self.commit(self.remote, {'a': 'remote\n', 'b': 'b\n'})
+        with open(self.local.abspath('a'), 'w') as f:
+            f.write('edited\n')
+
+        self.assertRaises(WorkingChangesConflict, self.local.pull, self.remote.path)
+        self.assertEqual(self.local.repo.refs['refs/heads/master'], self.first)
+        self.assertEqual(self.read('a'), 'edited\n')
+
+    def test_unrelated_local_changes_are_kept(self):
+        second = self.commit(self.remote, {'a': 'remote\n', 'b': 'b\n'})
+        with open(self.local.abspath('b'), 'w') as f:
+            f.write('edited\n')
+
+        self.assertEqual(self.local.pull(self.remote.path), second)
+        self.assertEqual(self.read('a'), 'remote\n')
+        self.assertEqual(self.read('b'), 'edited\n')
+
+
+class FastForwardTest(RepoTestCase):
+
+    def test_branch_moved_meanwhile(self):
+        repo = self.init_repo(bare=True)
+        first = self.commit(repo, {'a': 'a\n'})
+        second = self.commit(repo, {'a': 'b\n'})
+        moved = self.commit(repo, {'a': 'c\n'}, parents=[first], branch='other')
+        repo.repo.refs['refs/heads/master'] = first
+
+        # Another writer moves the branch while we check the fast forward
+        def is_fast_forward(old_sha, new_sha):
+            repo.repo.refs['refs/heads/master'] = moved
+            return True
+        repo._is_fast_forward = is_fast_forward
+
+        self.assertRaises(RefChanged, repo._merge_fast_forward, 'master', second)
+        self.assertEqual(repo.repo.refs['refs/heads/master'], moved)
+
+
+@unittest.skipUnless(hasattr(os, 'symlink'), 'Needs symlinks')
+class HashBlobFileTest(RepoTestCase):
+
+    def test_regular_file(self):
+        path = self.path('file')
+        with open(path, 'wb') as f:
+            f.write(b'data\n')
+        self.assertEqual(hash_blob_file(path), Blob.from_string(b'data\n').id)
+
+    def test_symlink_is_hashed_as_its_target(self):
+        path = self.path('link')
+        os.symlink('some/target', path)
+        self.assertEqual(hash_blob_file(path), Blob.from_string(b'some/target').id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import unittest
+
+# Dulwich imports
+from dulwich.objects import ZERO_SHA
+from dulwich.pack import apply_delta
+
+# Local imports
+from tests.utils import RepoTestCase
+
+
+# Big enough for a delta against it to be smaller than the blob
+TEXT = ''.join('line %d\n' % i for i in range(200))
+
+
+class PushUpdatesTest(RepoTestCase):
+
+    def setUp(self):
+        super(PushUpdatesTest, self).setUp()
+        self.repo = self.init_repo(bare=True)
+        self.master = self.commit(self.repo, {'a': 'a\n'})
+        self.repo.create_tag('v1', self.master)
+
+    def test_names_and_refspecs(self):
+        updates = self.repo._push_updates(['master', 'v1', 'master:refs/heads/other'])
+        self.assertEqual(updates, {
+            'refs/heads/master': self.master,
+            'refs/tags/v1': self.master,
+            'refs/heads/other': self.master,
+        })
+
+    def test_deletion(self):
+        updates = self.repo._push_updates([':old'])
+        self.assertEqual(updates, {'refs/heads/old': ZERO_SHA})
+
+    def test_selector_records_remote_refs(self):
+        selector = self.repo._wants_push(['master'])
+        new = selector({'refs/heads/dev': 'd' * 40})
+        self.assertEqual(new, {
+            'refs/heads/dev': 'd' * 40,
+            'refs/heads/master': self.master,
+        })
+        self.assertEqual(selector.remote_refs, {'refs/heads/dev': 'd' * 40})
+
+
+class PushTest(RepoTestCase):
+
+    def setUp(self):
+        super(PushTest, self).setUp()
+        self.remote = self.init_repo('remote', bare=True)
+        self.local = self.init_repo('local', bare=True)
+        self.first = self.commit(self.local, {'a': TEXT, 'b': 'b\n'})
+
+    def test_push_several_refs(self):
+        self.local.create_tag('v1', self.first)
+        self.local.push_to(self.remote.path, refs=['master', 'v1'])
+
+        refs = self.remote.repo.get_refs()
+        self.assertEqual(refs['refs/heads/master'], self.first)
+        self.assertEqual(refs['refs/tags/v1'], self.first)
+        self.assertIn(self.first, self.remote.repo.object_store)
+
+    def test_incremental_thin_push(self):
+        self.local.push_to(self.remote.path, refs=['master'])
+        second = self.commit(self.local, {'a': TEXT + 'more\n', 'b': 'b\n'})
+        self.local.push_to(self.remote.path, refs=['master'], thin=True)
+
+        remote_store = self.remote.repo.object_store
+        self.assertEqual(self.remote.repo.refs['refs/heads/master'], second)
+        # Delta bases were resolved : the remote has the whole blobs
+        tree = remote_store[remote_store[second].tree]
+        blobs = [remote_store[entry.sha].data for entry in tree.items()]
+        self.assertIn((TEXT + 'more\n').encode('utf-8'), blobs)
+
+    def test_deleting_a_remote_branch(self):
+        self.local.push_to(self.remote.path, refs=['master', 'master:dev'])
+        self.assertIn('refs/heads/dev', self.remote.repo.refs)
+        self.local.push_to(self.remote.path, refs=[':dev'])
+        self.assertNotIn('refs/heads/dev', self.remote.repo.refs)
+
+
+class ThinPackTest(RepoTestCase):
+
+    def test_blobs_are_deltas_against_the_remote_version(self):
+        repo = self.init_repo(bare=True)
+        object_store = repo.repo.object_store
+        first = self.commit(repo, {'a': TEXT})
+        second = self.commit(repo, {'a': TEXT + 'more\n'})
+
+        commit = object_store[second]
+        tree = object_store[commit.tree]
+        old_blob = object_store[list(object_store[object_store[first].tree].items())[0].sha]
+        new_blob = object_store[list(tree.items())[0].sha]
+        objects = [(commit, None), (tree, ''), (new_blob, 'a')]
+
+        records = list(repo._thin_pack_records(objects, [first]))
+        type_num, sha, base, data = records[-1]
+        self.assertEqual(base, old_blob.sha().digest())
+        self.assertLess(len(data), len(new_blob.as_raw_string()))
+        delta_result = apply_delta(old_blob.as_raw_string(), data)
+        if isinstance(delta_result, list):
+            delta_result = b''.join(delta_result)
+        self.assertEqual(delta_result, new_blob.as_raw_string())
+
+        # Commits and trees are sent whole
+        self.assertIsNone(records[0][2])
+        self.assertIsNone(records[1][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,328 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import unittest
+
+# Dulwich imports
+from dulwich import file as dulwich_file
+from dulwich.protocol import ZERO_SHA
+
+# Local imports
+from gittle.exceptions import RefChanged
+from gittle.utils.refs import RefsCache, RefTransaction, read_packed_refs
+from tests.utils import RepoTestCase
+
+
+# Newer dulwichs raise FileLocked instead of an OSError
+LOCKED_ERRORS = (EnvironmentError, getattr(dulwich_file, 'FileLocked', EnvironmentError))
+
+A = 'a' * 40
+B = 'b' * 40
+C = 'c' * 40
+
+
+class RefsTestCase(RepoTestCase):
+    """A bare control directory whose refs are written like git does
+    """
+
+    def setUp(self):
+        super(RefsTestCase, self).setUp()
+        self.controldir = self.path('repo.git')
+        os.makedirs(os.path.join(self.controldir, 'refs', 'heads'))
+        os.makedirs(os.path.join(self.controldir, 'refs', 'tags'))
+        self.write_ref('HEAD', 'ref: refs/heads/master')
+
+    def write_ref(self, ref, contents):
+        path = os.path.join(self.controldir, ref)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.lock', 'w') as f:
+            f.write(contents + '\n')
+        os.rename(path + '.lock', path)
+
+    def write_packed_refs(self, lines):
+        self.write_ref('packed-refs', '# pack-refs with: peeled fully-peeled \n' + '\n'.join(lines))
+
+    def read_ref_file(self, ref):
+        path = os.path.join(self.controldir, ref)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read().strip()
+
+
+class RefsCacheTest(RefsTestCase):
+
+    def setUp(self):
+        super(RefsCacheTest, self).setUp()
+        self.cache = RefsCache(self.controldir)
+
+    def test_loose_and_packed_refs(self):
+        self.write_packed_refs(['%s refs/heads/master' % A, '%s refs/tags/v1' % C, '^%s' % A])
+        self.write_ref('refs/heads/dev', B)
+
+        self.assertEqual(self.cache.namespace('refs/heads/'), {'master': A, 'dev': B})
+        self.assertEqual(self.cache.namespace('refs/tags/'), {'v1': C})
+        self.assertEqual(self.cache.peeled('refs/tags/v1'), A)
+
+    def test_loose_refs_override_packed_refs(self):
+        self.write_packed_refs(['%s refs/heads/master' % A])
+        self.write_ref('refs/heads/master', B)
+        self.assertEqual(self.cache.namespace('refs/heads/'), {'master': B})
+
+    def test_snapshot_is_reused_until_refs_change(self):
+        self.write_ref('refs/heads/master', A)
+        snapshot = self.cache.namespace('refs/heads/')
+        self.assertIs(self.cache.namespace('refs/heads/'), snapshot)
+
+        self.write_ref('refs/heads/master', B)
+        self.assertEqual(self.cache.namespace('refs/heads/'), {'master': B})
+
+    def test_snapshot_sees_nested_and_packed_changes(self):
+        self.write_ref('refs/heads/master', A)
+        self.cache.namespace('refs/heads/')
+
+        self.write_ref('refs/heads/feature/x', B)
+        self.assertEqual(self.cache.namespace('refs/heads/'), {'master': A, 'feature/x': B})
+
+        self.write_packed_refs(['%s refs/heads/packed' % C])
+        self.assertEqual(self.cache.namespace('refs/heads/')['packed'], C)
+
+    def test_symbolic_refs(self):
+        self.write_ref('refs/heads/master', A)
+        self.write_ref('refs/remotes/origin/HEAD', 'ref: refs/remotes/origin/master')
+        self.write_ref('refs/remotes/origin/master', B)
+
+        self.assertEqual(self.cache.read_ref('HEAD'), A)
+        self.assertEqual(self.cache.namespace('refs/remotes/'), {'origin/HEAD': B, 'origin/master': B})
+        self.assertIsNone(self.cache.read_ref('refs/heads/missing'))
+
+    def test_symbolic_ref_loops(self):
+        self.write_ref('refs/heads/one', 'ref: refs/heads/two')
+        self.write_ref('refs/heads/two', 'ref: refs/heads/one')
+        self.assertIsNone(self.cache.read_ref('refs/heads/one'))
+
+    def test_all(self):
+        self.write_ref('refs/heads/master', A)
+        self.write_packed_refs(['%s refs/tags/v1' % C])
+        self.assertEqual(self.cache.all(), {
+            'HEAD': A,
+            'refs/heads/master': A,
+            'refs/tags/v1': C,
+        })
+
+    def test_lock_files_are_ignored(self):
+        self.write_ref('refs/heads/master', A)
+        with open(os.path.join(self.controldir, 'refs', 'heads', 'dev.lock'), 'w') as f:
+            f.write(B)
+        self.assertEqual(self.cache.namespace('refs/heads/'), {'master': A})
+
+    def test_read_packed_refs(self):
+        self.write_packed_refs(['%s refs/tags/v1' % C, '^%s' % A, '%s refs/heads/master' % B])
+        traits = []
+        refs, peeled = read_packed_refs(os.path.join(self.controldir, 'packed-refs'), traits)
+        self.assertEqual(refs, {'refs/tags/v1': C, 'refs/heads/master': B})
+        self.assertEqual(peeled, {'refs/tags/v1': A})
+        self.assertEqual(traits, ['peeled', 'fully-peeled'])
+
+
+class ResolveTest(RefsTestCase):
+
+    formats = (
+        '%s',
+        'refs/%s',
+        'refs/tags/%s',
+        'refs/heads/%s',
+        'refs/remotes/%s',
+        'refs/remotes/%s/HEAD',
+    )
+
+    def setUp(self):
+        super(ResolveTest, self).setUp()
+        self.cache = RefsCache(self.controldir)
+        self.write_ref('refs/heads/master', A)
+
+    def resolve(self, ref):
+        return self.cache.resolve(ref, self.formats)
+
+    def test_formats_are_tried_in_order(self):
+        self.write_ref('refs/heads/v1', A)
+        self.write_packed_refs(['%s refs/tags/v1' % C])
+        self.write_ref('refs/remotes/origin/HEAD', 'ref: refs/remotes/origin/master')
+        self.write_ref('refs/remotes/origin/master', A)
+
+        self.assertEqual(self.resolve('v1'), 'refs/tags/v1')
+        self.assertEqual(self.resolve('master'), 'refs/heads/master')
+        self.assertEqual(self.resolve('heads/master'), 'refs/heads/master')
+        self.assertEqual(self.resolve('origin'), 'refs/remotes/origin/HEAD')
+        self.assertEqual(self.resolve('HEAD'), 'HEAD')
+        self.assertIsNone(self.resolve('missing'))
+
+    def test_resolutions_follow_new_refs(self):
+        self.assertIsNone(self.resolve('dev'))
+        self.write_ref('refs/heads/dev', B)
+        self.assertEqual(self.resolve('dev'), 'refs/heads/dev')
+
+        # A tag now shadows the branch
+        self.write_ref('refs/tags/dev', C)
+        self.assertEqual(self.resolve('dev'), 'refs/tags/dev')
+
+    def test_new_top_level_refs(self):
+        # Top level refs don't change the refs/ snapshot
+        self.assertIsNone(self.resolve('FETCH_HEAD'))
+        self.write_ref('FETCH_HEAD', B)
+        self.assertEqual(self.resolve('FETCH_HEAD'), 'FETCH_HEAD')
+
+
+class RefTransactionTest(RefsTestCase):
+
+    def setUp(self):
+        super(RefTransactionTest, self).setUp()
+        self.commits = []
+        self.transaction = RefTransaction(self.controldir, on_commit=lambda: self.commits.append(True))
+
+    def packed(self):
+        return read_packed_refs(os.path.join(self.controldir, 'packed-refs'))
+
+    def test_refs_are_written_loose(self):
+        self.write_packed_refs(['%s refs/tags/v1' % C])
+        self.transaction.set('refs/heads/master', A)
+        self.transaction.set('refs/heads/dev', B)
+        self.assertEqual(self.transaction.commit(), {'refs/heads/master': A, 'refs/heads/dev': B})
+
+        self.assertEqual(self.read_ref_file('refs/heads/master'), A)
+        self.assertEqual(self.read_ref_file('refs/heads/dev'), B)
+        self.assertEqual(self.packed()[0], {'refs/tags/v1': C})
+        self.assertEqual(self.commits, [True])
+        self.assertEqual(len(self.transaction), 0)
+
+    def test_symbolic_refs_update_their_target(self):
+        self.transaction.set('HEAD', A)
+        self.transaction.commit()
+        self.assertEqual(self.read_ref_file('HEAD'), 'ref: refs/heads/master')
+        self.assertEqual(self.read_ref_file('refs/heads/master'), A)
+
+    def test_set_symbolic(self):
+        self.transaction.set_symbolic('HEAD', 'refs/heads/dev')
+        self.transaction.commit()
+        self.assertEqual(self.read_ref_file('HEAD'), 'ref: refs/heads/dev')
+
+    def test_changed_ref_fails_everything(self):
+        self.write_ref('refs/heads/master', A)
+        self.transaction.set('refs/heads/dev', B)
+        self.transaction.set('refs/heads/master', B, expected=C)
+
+        self.assertRaises(RefChanged, self.transaction.commit)
+        self.assertIsNone(self.read_ref_file('refs/heads/dev'))
+        self.assertEqual(self.read_ref_file('refs/heads/master'), A)
+        self.assertFalse(os.path.exists(os.path.join(self.controldir, 'refs', 'heads', 'master.lock')))
+        self.assertEqual(self.commits, [])
+
+    def test_zero_sha_expects_a_new_ref(self):
+        self.write_packed_refs(['%s refs/heads/master' % A])
+        self.transaction.set('refs/heads/master', B, expected=ZERO_SHA)
+        self.assertRaises(RefChanged, self.transaction.commit)
+
+        self.transaction.set('refs/heads/dev', B, expected=ZERO_SHA)
+        self.transaction.commit()
+        self.assertEqual(self.read_ref_file('refs/heads/dev'), B)
+
+    def test_skip_changed(self):
+        self.write_ref('refs/heads/master', A)
+        self.transaction.set('refs/heads/master', B, expected=C, skip_changed=True)
+        self.transaction.set('refs/heads/dev', B)
+        self.assertEqual(self.transaction.commit(), {'refs/heads/dev': B})
+        self.assertEqual(self.read_ref_file('refs/heads/master'), A)
+
+    def test_locked_ref(self):
+        self.write_ref('refs/heads/master', A)
+        with open(os.path.join(self.controldir, 'refs', 'heads', 'master.lock'), 'w') as f:
+            f.write(C)
+        self.transaction.set('refs/heads/dev', B)
+        self.transaction.set('refs/heads/master', B)
+
+        self.assertRaises(LOCKED_ERRORS, self.transaction.commit)
+        self.assertIsNone(self.read_ref_file('refs/heads/dev'))
+        self.assertEqual(self.read_ref_file('refs/heads/master'), A)
+
+    def test_delete_packed_and_loose_refs(self):
+        self.write_packed_refs(['%s refs/tags/v1' % C, '^%s' % A, '%s refs/tags/v2' % C])
+        self.write_ref('refs/tags/v1', B)
+        self.transaction.delete('refs/tags/v1', expected=B)
+        self.transaction.commit()
+
+        self.assertIsNone(self.read_ref_file('refs/tags/v1'))
+        self.assertEqual(self.packed(), ({'refs/tags/v2': C}, {}))
+
+    def test_pack(self):
+        self.write_ref('refs/heads/master', A)
+        self.write_packed_refs(['%s refs/tags/v1' % C])
+        transaction = RefTransaction(self.controldir, pack=True)
+        transaction.set('refs/heads/master', A, expected=A)
+        transaction.set('refs/heads/dev', B)
+        transaction.commit()
+
+        self.assertIsNone(self.read_ref_file('refs/heads/master'))
+        self.assertEqual(self.packed()[0], {
+            'refs/heads/master': A,
+            'refs/heads/dev': B,
+            'refs/tags/v1': C,
+        })
+
+    def test_context_manager(self):
+        with self.transaction as transaction:
+            transaction.set('refs/heads/master', A)
+        self.assertEqual(self.read_ref_file('refs/heads/master'), A)
+
+        try:
+            with self.transaction as transaction:
+                transaction.set('refs/heads/master', B)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.read_ref_file('refs/heads/master'), A)
+        self.assertEqual(len(self.transaction), 0)
+
+
+class GittleRefsTest(RepoTestCase):
+
+    def test_branches_and_tags_follow_ref_changes(self):
+        repo = self.init_repo(bare=True)
+        master = self.commit(repo, {'a': 'a\n'})
+        self.assertEqual(repo.branches, {'master': master})
+
+        dev = self.commit(repo, {'a': 'b\n'}, branch='dev')
+        repo.create_tag('v1', master)
+        self.assertEqual(repo.branches, {'master': master, 'dev': dev})
+        self.assertEqual(repo.tags, {'v1': master})
+        self.assertEqual(repo.refs['HEAD'], master)
+
+    def test_dwim_reference(self):
+        repo = self.init_repo(bare=True)
+        master = self.commit(repo, {'a': 'a\n'})
+
+        self.assertEqual(repo.dwim_reference('master'), 'refs/heads/master')
+        self.assertEqual(repo.dwim_reference(master), master)
+        self.assertRaises(Exception, repo.dwim_reference, 'missing')
+
+    def test_pack_refs(self):
+        repo = self.init_repo(bare=True)
+        master = self.commit(repo, {'a': 'a\n'})
+        repo.create_tag('v1', master)
+        repo.pack_refs()
+
+        refs_dir = os.path.join(repo.repo.controldir(), 'refs')
+        loose = [name for dirname, dirnames, names in os.walk(refs_dir) for name in names]
+        self.assertEqual(loose, [])
+        self.assertEqual(repo.branches, {'master': master})
+        self.assertEqual(repo.tags, {'v1': master})
+        self.assertEqual(repo.repo.refs['refs/heads/master'], master)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import unittest
+
+# Local imports
+from gittle.utils.git import split_revision, split_range, is_abbreviated_sha
+from tests.utils import RepoTestCase, make_tag
+
+
+class SplitRevisionTest(unittest.TestCase):
+
+    def test_split_revision(self):
+        self.assertEqual(split_revision('master'), ('master', []))
+        self.assertEqual(
+            split_revision('HEAD~2^2^{tree}'),
+            ('HEAD', [('~', 2), ('^', 2), ('^{}', 'tree')]),
+        )
+        self.assertEqual(split_revision('v1^{}^'), ('v1', [('^{}', ''), ('^', 1)]))
+        self.assertEqual(split_revision('x~'), ('x', [('~', 1)]))
+        self.assertRaises(ValueError, split_revision, 'HEAD^x')
+
+    def test_split_range(self):
+        self.assertEqual(split_range('a..b'), ('a', 'b', False))
+        self.assertEqual(split_range('a...b'), ('a', 'b', True))
+        self.assertEqual(split_range('..b'), ('', 'b', False))
+        self.assertIsNone(split_range('a'))
+
+    def test_is_abbreviated_sha(self):
+        self.assertTrue(is_abbreviated_sha('abc1'))
+        self.assertFalse(is_abbreviated_sha('abc'))
+        self.assertFalse(is_abbreviated_sha('master'))
+        self.assertFalse(is_abbreviated_sha('a' * 40))
+
+
+class RevParseTest(RepoTestCase):
+    """History :
+
+        c1 -- c2 -- c3 -- merge (master)
+          \\              /
+           `---- side --'
+    """
+
+    def setUp(self):
+        super(RevParseTest, self).setUp()
+        self.repo = self.init_repo(bare=True)
+        object_store = self.repo.repo.object_store
+        self.c1 = self.commit(self.repo, {'a': '1\n'})
+        self.c2 = self.commit(self.repo, {'a': '2\n'})
+        self.c3 = self.commit(self.repo, {'a': '3\n'})
+        self.side = self.commit(self.repo, {'b': 'side\n'}, parents=[self.c1], branch='side')
+        self.merge = self.commit(self.repo, {'a': '3\n', 'b': 'side\n'}, parents=[self.c3, self.side])
+        self.tag = make_tag(object_store, 'v1', self.c2)
+        self.repo.repo.refs['refs/tags/v1'] = self.tag
+
+    def test_names(self):
+        self.assertEqual(self.repo.rev_parse('HEAD'), self.merge)
+        self.assertEqual(self.repo.rev_parse('@'), self.merge)
+        self.assertEqual(self.repo.rev_parse('side'), self.side)
+        self.assertEqual(self.repo.rev_parse(self.c2), self.c2)
+        self.assertEqual(self.repo.rev_parse('v1'), self.tag)
+
+    def test_parents(self):
+        self.assertEqual(self.repo.rev_parse('master^'), self.c3)
+        self.assertEqual(self.repo.rev_parse('master^1'), self.c3)
+        self.assertEqual(self.repo.rev_parse('master^2'), self.side)
+        self.assertEqual(self.repo.rev_parse('master^0'), self.merge)
+        self.assertEqual(self.repo.rev_parse('master~2'), self.c2)
+        self.assertEqual(self.repo.rev_parse('master^2~1'), self.c1)
+        self.assertEqual(self.repo.rev_parse('HEAD~3'), self.c1)
+
+    def test_peeling(self):
+        object_store = self.repo.repo.object_store
+        self.assertEqual(self.repo.rev_parse('v1^{}'), self.c2)
+        self.assertEqual(self.repo.rev_parse('v1^{commit}'), self.c2)
+        self.assertEqual(self.repo.rev_parse('v1^{tree}'), object_store[self.c2].tree)
+        self.assertEqual(self.repo.rev_parse('v1~1'), self.c1)
+
+    def test_abbreviated_sha(self):
+        self.assertEqual(self.repo.rev_parse(self.c2[:10]), self.c2)
+        self.assertEqual(self.repo.rev_parse(self.c2[:7] + '^'), self.c1)
+
+        # Also once packed
+        self.repo.gc()
+        self.assertEqual(self.repo.rev_parse(self.c3[:8]), self.c3)
+
+    def test_upstream(self):
+        config = self.repo.repo.get_config()
+        config.set(('branch', 'side'), 'remote', 'origin')
+        config.set(('branch', 'side'), 'merge', 'refs/heads/other')
+        config.write_to_path()
+        self.repo.repo.refs['refs/remotes/origin/other'] = self.c2
+        self.repo.repo.refs['refs/remotes/origin/master'] = self.c3
+
+        self.assertEqual(self.repo.rev_parse('side@{upstream}'), self.c2)
+        self.assertEqual(self.repo.rev_parse('side@{u}~1'), self.c1)
+        # Without configuration, the branch of the same name on origin
+        self.assertEqual(self.repo.rev_parse('master@{u}'), self.c3)
+
+    def test_errors(self):
+        for rev in ('missing', 'master^3', 'HEAD~10', 'master^x', 'v1^{blob}'):
+            self.assertRaises(KeyError, self.repo.rev_parse, rev)
+
+    def test_ranges(self):
+        self.assertEqual(self.repo.rev_range(self.c2), ([self.c2], []))
+        self.assertEqual(self.repo.rev_range('side..master'), ([self.merge], [self.side]))
+        self.assertEqual(self.repo.rev_range('side...master'), ([self.side, self.merge], [self.c1]))
+
+        self.assertEqual(
+            list(self.repo.rev_list('side..master')),
+            [self.merge, self.c3, self.c2],
+        )
+        self.assertEqual(
+            set(self.repo.rev_list('side...master')),
+            set([self.merge, self.c3, self.c2, self.side]),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,448 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import time
+import socket
+import threading
+import shutil
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+# Local imports
+from gittle import Gittle
+from gittle.server import (
+    GitServer, WorkerThreads, SubFileSystemBackend, ResponseStream, make_http_server,
+    PackCache, CachingUploadPackHandler,
+)
+from gittle.metrics import MetricsSink
+from tests.utils import RepoTestCase
+
+
+def wait_for(condition, timeout=5):
+    """Poll condition() until it's true, returns its last value
+    """
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class WorkerThreadsTest(unittest.TestCase):
+
+    def test_runs_submitted_jobs(self):
+        done = []
+        lock = threading.Lock()
+
+        def handle(i):
+            with lock:
+                done.append(i)
+
+        workers = WorkerThreads(3, handle)
+        for i in range(10):
+            workers.submit(i)
+        self.assertTrue(workers.stop(5))
+        self.assertEqual(sorted(done), list(range(10)))
+
+    def test_stop_timeout(self):
+        release = threading.Event()
+        workers = WorkerThreads(1, lambda: release.wait())
+        workers.submit()
+        self.assertFalse(workers.stop(0.1))
+        release.set()
+        self.assertTrue(wait_for(lambda: not any(t.is_alive() for t in workers.threads)))
+
+
+class SubFileSystemBackendTest(RepoTestCase):
+
+    def setUp(self):
+        super(SubFileSystemBackendTest, self).setUp()
+        self.init_repo('one', bare=True)
+        self.init_repo('two', bare=True)
+
+    def touch(self, *parts):
+        """Change a stamped path's mtime, like a new pack or packed-refs would
+        """
+        path = self.path(*parts)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    def test_reuses_repositories(self):
+        backend = SubFileSystemBackend(self.tmpdir)
+        repo = backend.open_repository('/one')
+        self.assertIs(backend.open_repository('one/'), repo)
+        self.assertIsNot(backend.open_repository('two'), repo)
+        self.assertIs(backend.open_repository('one'), repo)
+
+    def test_reopens_on_change(self):
+        backend = SubFileSystemBackend(self.tmpdir)
+        for parts in (('objects', 'pack'), ('config',)):
+            repo = backend.open_repository('one')
+            self.touch('one', *parts)
+            self.assertIsNot(backend.open_repository('one'), repo)
+
+        # packed-refs appearing
+        repo = backend.open_repository('one')
+        with open(self.path('one', 'packed-refs'), 'w') as f:
+            f.write('# pack-refs with: peeled\n')
+        self.assertIsNot(backend.open_repository('one'), repo)
+
+    def test_lru_size(self):
+        backend = SubFileSystemBackend(self.tmpdir, cache_size=1)
+        one = backend.open_repository('one')
+        backend.open_repository('two')
+        self.assertEqual(len(backend._repos), 1)
+        self.assertIsNot(backend.open_repository('one'), one)
+
+    def test_no_cache(self):
+        backend = SubFileSystemBackend(self.tmpdir, cache_size=0)
+        self.assertIsNot(backend.open_repository('one'), backend.open_repository('one'))
+        self.assertEqual(len(backend._repos), 0)
+
+    def test_clear_cache(self):
+        backend = SubFileSystemBackend(self.tmpdir)
+        repo = backend.open_repository('one')
+        backend.clear_cache()
+        self.assertIsNot(backend.open_repository('one'), repo)
+
+    def test_per_thread(self):
+        backend = SubFileSystemBackend(self.tmpdir)
+        repo = backend.open_repository('one')
+        other = []
+        thread = threading.Thread(target=lambda: other.append(backend.open_repository('one')))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], repo)
+        self.assertIs(backend.open_repository('one'), repo)
+
+
+class ServerTestCase(RepoTestCase):
+    """Serves a bare remote repository with a commit on master
+    """
+
+    def setUp(self):
+        super(ServerTestCase, self).setUp()
+        self.remote = self.init_repo('remote', bare=True)
+        self.master = self.commit(self.remote, {'a': 'a\n'})
+
+    def start(self, **kwargs):
+        """Serve tmpdir from a thread, returns the server and the remote's url
+        """
+        server = GitServer(self.tmpdir, 'localhost', port=0, **kwargs)
+        thread = threading.Thread(target=server.serve)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join, 10)
+        self.addCleanup(server.stop)
+        self.thread = thread
+        return server, 'git://localhost:%d/remote' % server.server_address[1]
+
+    def connect(self, server):
+        """An idle connection to server
+        """
+        client = socket.create_connection(server.server_address)
+        self.addCleanup(client.close)
+        return client
+
+    def clone(self, url, name):
+        return Gittle.clone(url, self.path(name), bare=True)
+
+
+class GitServerTest(ServerTestCase):
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, GitServer, self.tmpdir, 'localhost', port=0, mode='green')
+
+    def test_read_only_handlers(self):
+        server = GitServer(self.tmpdir, 'localhost', port=0)
+        self.addCleanup(server.server_close)
+        self.assertIn('git-upload-pack', server.handlers)
+        self.assertNotIn('git-receive-pack', server.handlers)
+
+    def test_concurrent_clones(self):
+        server, url = self.start(workers=4)
+        results = {}
+
+        def clone(i):
+            try:
+                results[i] = self.clone(url, 'clone%d' % i).repo.refs['refs/heads/master']
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=clone, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertEqual(results, dict((i, self.master) for i in range(4)))
+        self.assertTrue(wait_for(lambda: server.active_connections == 0))
+
+    def test_slow_client_does_not_block_others(self):
+        server, url = self.start(workers=2)
+        self.connect(server)
+        self.assertTrue(wait_for(lambda: server.active_connections == 1))
+        self.assertEqual(self.clone(url, 'clone').repo.refs['refs/heads/master'], self.master)
+
+    def test_max_connections(self):
+        server, url = self.start(workers=2, max_connections=1)
+        idle = self.connect(server)
+        self.assertTrue(wait_for(lambda: server.active_connections == 1))
+        self.assertRaises(Exception, self.clone, url, 'refused')
+
+        # The slot is free again once the idle client leaves
+        idle.close()
+        self.assertTrue(wait_for(lambda: server.active_connections == 0))
+        self.assertEqual(self.clone(url, 'clone').repo.refs['refs/heads/master'], self.master)
+
+    def test_idle_timeout(self):
+        server, url = self.start(workers=1, idle_timeout=0.2)
+        self.connect(server)
+        self.assertTrue(wait_for(lambda: server.active_connections == 1))
+        self.assertTrue(wait_for(lambda: server.active_connections == 0))
+
+    def test_stop(self):
+        server, url = self.start(workers=2)
+        server.stop()
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertIsNone(server.pool)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_fork_mode(self):
+        server, url = self.start(workers=2, mode='fork')
+        self.assertTrue(wait_for(lambda: len(server.children) == 2))
+        self.assertEqual(self.clone(url, 'clone').repo.refs['refs/heads/master'], self.master)
+
+        server.stop()
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        self.assertEqual(server.children, set())
+
+
+class TraceList(MetricsSink, list):
+    """Keeps the traces it receives
+    """
+    def record(self, trace):
+        self.append(trace)
+
+
+class PackCacheTest(RepoTestCase):
+
+    def setUp(self):
+        super(PackCacheTest, self).setUp()
+        self.cache = PackCache(self.path('cache'))
+
+    def store(self, key, data):
+        writer = self.cache.writer(key)
+        writer.write(data)
+        writer.commit()
+
+    def read(self, key):
+        f = self.cache.get(key)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def set_times(self, key, atime=None, mtime=None):
+        path = self.cache._path(key)
+        st = os.stat(path)
+        os.utime(path, (st.st_atime if atime is None else atime, st.st_mtime if mtime is None else mtime))
+
+    def test_key(self):
+        refs = {'refs/heads/master': 'a' * 40, 'HEAD': 'a' * 40}
+        key = self.cache.key('/repo', refs, ['a' * 40, 'b' * 40], ['c' * 40], ['thin-pack', 'ofs-delta'])
+        self.assertEqual(key, self.cache.key(
+            '/repo', dict(refs), ['b' * 40, 'a' * 40, 'a' * 40], ['c' * 40], ['ofs-delta', 'thin-pack']))
+
+        others = [
+            self.cache.key('/other', refs, ['a' * 40, 'b' * 40], ['c' * 40], ['thin-pack', 'ofs-delta']),
+            self.cache.key('/repo', {'HEAD': 'd' * 40}, ['a' * 40, 'b' * 40], ['c' * 40], ['thin-pack', 'ofs-delta']),
+            self.cache.key('/repo', refs, ['a' * 40], ['c' * 40], ['thin-pack', 'ofs-delta']),
+            self.cache.key('/repo', refs, ['a' * 40, 'b' * 40, 'c' * 40], [], ['thin-pack', 'ofs-delta']),
+            self.cache.key('/repo', refs, ['a' * 40, 'b' * 40], ['c' * 40], ['ofs-delta']),
+        ]
+        self.assertEqual(len(set(others + [key])), 6)
+
+    def test_commit(self):
+        self.assertIsNone(self.cache.get('k'))
+        self.store('k', b'PACK data')
+        self.assertEqual(self.read('k'), b'PACK data')
+        self.assertEqual(os.listdir(self.cache.path), ['k.pack'])
+
+    def test_abort(self):
+        writer = self.cache.writer('k')
+        writer.write(b'PACK partial')
+        writer.abort()
+        self.assertIsNone(self.cache.get('k'))
+        self.assertEqual(os.listdir(self.cache.path), [])
+
+    def test_too_big(self):
+        self.cache.max_size = 4
+        self.store('k', b'PACK data')
+        self.assertIsNone(self.cache.get('k'))
+        self.assertEqual(os.listdir(self.cache.path), [])
+
+    def test_evicts_least_recently_used(self):
+        self.cache.max_size = 10
+        self.store('old', b'1234')
+        self.store('used', b'1234')
+        self.set_times('old', atime=1000)
+        self.set_times('used', atime=2000)
+        self.store('new', b'1234')
+        self.assertIsNone(self.cache.get('old'))
+        self.assertEqual(self.read('used'), b'1234')
+        self.assertEqual(self.read('new'), b'1234')
+
+    def test_get_marks_used(self):
+        self.store('k', b'1234')
+        self.set_times('k', atime=1000)
+        self.read('k')
+        self.assertGreater(os.stat(self.cache._path('k')).st_atime, 1000)
+
+    def test_expired(self):
+        self.cache.max_age = 60
+        self.store('k', b'1234')
+        self.set_times('k', mtime=time.time() - 120)
+        self.assertIsNone(self.cache.get('k'))
+        self.assertFalse(os.path.exists(self.cache._path('k')))
+
+    def test_clear(self):
+        self.store('a', b'1')
+        self.store('b', b'2')
+        self.cache.clear()
+        self.assertEqual(os.listdir(self.cache.path), [])
+
+    def test_private_directory(self):
+        cache = PackCache()
+        self.addCleanup(shutil.rmtree, cache.path, True)
+        self.assertTrue(os.path.isdir(cache.path))
+
+        os.chmod(self.cache.path, 0o777)
+        self.assertRaises(ValueError, PackCache, self.cache.path)
+
+
+class FakeGraphWalker(object):
+
+    def __init__(self, wants, common=(), shallow=()):
+        self.refs = {'refs/heads/master': 'a' * 40}
+        self.wants = list(wants)
+        self.common = list(common)
+        self.client_shallow = set(shallow)
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PackCache()
+        self.addCleanup(shutil.rmtree, self.cache.path, True)
+        self.handler = CachingUploadPackHandler.__new__(CachingUploadPackHandler)
+        self.handler.repo = type('FakeRepo', (object,), {'path': '/repo'})()
+        self.handler.has_capability = lambda cap: cap in ('ofs-delta', 'side-band-64k')
+
+    def test_key(self):
+        walker = FakeGraphWalker(['a' * 40], ['b' * 40])
+        self.assertEqual(
+            self.handler._cache_key(self.cache, walker),
+            self.cache.key('/repo', walker.refs, ['a' * 40], ['b' * 40], ['ofs-delta']),
+        )
+
+    def test_not_cached(self):
+        self.assertIsNone(self.handler._cache_key(None, FakeGraphWalker(['a' * 40])))
+        self.assertIsNone(self.handler._cache_key(self.cache, FakeGraphWalker([])))
+        self.assertIsNone(self.handler._cache_key(self.cache, FakeGraphWalker(['a' * 40], shallow=['b' * 40])))
+
+
+class ResponseStreamTest(unittest.TestCase):
+
+    def test_gathers_small_writes(self):
+        def run(write):
+            for i in range(1000):
+                write(b'%04d' % i)
+
+        chunks = list(ResponseStream(run))
+        self.assertEqual(b''.join(chunks), b''.join(b'%04d' % i for i in range(1000)))
+        self.assertLess(len(chunks), 1000)
+
+    def test_failing_service_ends_the_stream(self):
+        def run(write):
+            write(b'partial')
+            raise ValueError('broken')
+
+        self.assertEqual(b''.join(ResponseStream(run)), b'partial')
+
+    def test_client_going_away_stops_the_service(self):
+        errors = []
+
+        def run(write):
+            try:
+                while True:
+                    write(b'data')
+            except IOError as e:
+                errors.append(e)
+
+        chunks = iter(ResponseStream(run))
+        next(chunks)
+        chunks.close()
+        self.assertTrue(wait_for(lambda: errors))
+
+    def test_runs_in_pool(self):
+        pool = WorkerThreads(1, lambda stream: stream._produce())
+        self.addCleanup(pool.stop, 5)
+        stream = ResponseStream(lambda write: write(b'pooled'), pool)
+        self.assertEqual(b''.join(stream), b'pooled')
+
+
+class HTTPServerTest(ServerTestCase):
+
+    def setUp(self):
+        super(HTTPServerTest, self).setUp()
+        self.server = make_http_server(self.tmpdir, 'localhost', 0, workers=2)
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://localhost:%d/remote' % self.server.server_address[1]
+
+    def test_clone(self):
+        clone = Gittle.clone(self.url, self.path('clone'), bare=True)
+        self.assertEqual(clone.repo.refs['refs/heads/master'], self.master)
+
+    def test_advertisement(self):
+        response = urlopen(self.url + '/info/refs?service=git-upload-pack')
+        self.assertEqual(response.headers['Content-Type'], 'application/x-git-upload-pack-advertisement')
+        self.assertIn(self.master.encode('ascii'), response.read())
+
+    def test_read_only(self):
+        with self.assertRaises(HTTPError) as context:
+            urlopen(self.url + '/info/refs?service=git-receive-pack')
+        self.assertEqual(context.exception.code, 403)
+
+    def test_missing_repository(self):
+        with self.assertRaises(HTTPError) as context:
+            urlopen(self.url + '-missing/info/refs?service=git-upload-pack')
+        self.assertEqual(context.exception.code, 404)
+
+
+class CachedCloneTest(ServerTestCase):
+
+    def test_clones_reuse_pack(self):
+        traces = TraceList()
+        cache = PackCache(self.path('cache'))
+        server, url = self.start(workers=1, pack_cache=cache, metrics=traces)
+
+        for name in ('one', 'two'):
+            self.assertEqual(self.clone(url, name).repo.refs['refs/heads/master'], self.master)
+        self.assertEqual([trace.cached for trace in traces], [False, True])
+        self.assertEqual(len(os.listdir(cache.path)), 1)
+
+        # A new commit changes the key
+        master = self.commit(self.remote, {'a': 'b\n'})
+        self.assertEqual(self.clone(url, 'three').repo.refs['refs/heads/master'], master)
+        self.assertFalse(traces[-1].cached)
@@ -0,0 +1,164 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import gc
+import threading
+import unittest
+
+# Dulwich imports
+from dulwich.objects import Blob
+from dulwich.object_store import DiskObjectStore
+
+# Local imports
+from gittle import ReadOnlyRepository
+from gittle.shared import ObjectCache, SharedObjectStore, SharedGittle
+from tests.utils import RepoTestCase
+
+
+def in_thread(func, *args):
+    """func(*args) run in a new thread (that has ended when this returns)
+    """
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func(*args)))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+class ClosingStore(DiskObjectStore):
+    """DiskObjectStore recording which instances were closed
+    """
+    closed = []
+
+    def close(self):
+        self.closed.append(self)
+
+
+class ObjectCacheTest(unittest.TestCase):
+
+    def blob(self, i):
+        # 10 bytes each
+        return Blob.from_string(b'%010d' % i)
+
+    def test_get(self):
+        cache = ObjectCache()
+        blob = self.blob(1)
+        self.assertIsNone(cache.get(blob.id))
+        cache.add(blob)
+        self.assertIs(cache.get(blob.id), blob)
+
+    def test_bounded_by_size(self):
+        cache = ObjectCache(max_size=30)
+        blobs = [self.blob(i) for i in range(4)]
+        for blob in blobs[:3]:
+            cache.add(blob)
+        # Recently used
+        cache.get(blobs[0].id)
+        cache.add(blobs[3])
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.size, 30)
+        self.assertIsNone(cache.get(blobs[1].id))
+        self.assertIs(cache.get(blobs[0].id), blobs[0])
+
+    def test_added_once(self):
+        cache = ObjectCache()
+        cache.add(self.blob(1))
+        cache.add(self.blob(1))
+        self.assertEqual((len(cache), cache.size), (1, 10))
+
+    def test_too_big(self):
+        cache = ObjectCache(max_size=5)
+        cache.add(self.blob(1))
+        self.assertEqual(len(cache), 0)
+
+    def test_clear(self):
+        cache = ObjectCache()
+        cache.add(self.blob(1))
+        cache.clear()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+
+class SharedObjectStoreTest(RepoTestCase):
+
+    def setUp(self):
+        super(SharedObjectStoreTest, self).setUp()
+        self.blob = Blob.from_string(b'shared\n')
+        DiskObjectStore.init(self.path('objects')).add_object(self.blob)
+        del ClosingStore.closed[:]
+        self.store = SharedObjectStore(self.path('objects'), store_class=ClosingStore)
+
+    def test_objects_shared_between_threads(self):
+        obj = self.store[self.blob.id]
+        self.assertEqual(obj.data, b'shared\n')
+        self.assertIs(in_thread(self.store.__getitem__, self.blob.id), obj)
+        self.assertIn(self.blob.id, self.store)
+
+    def test_store_per_thread(self):
+        store = self.store.store
+        self.assertIs(self.store.store, store)
+        self.assertIsNot(in_thread(lambda: self.store.store), store)
+
+    def test_thread_store_closed_with_thread(self):
+        other = in_thread(lambda: self.store.store)
+        gc.collect()
+        self.assertEqual(ClosingStore.closed, [other])
+
+    def test_close(self):
+        store = self.store.store
+        self.store[self.blob.id]
+        self.store.close()
+        self.assertEqual(ClosingStore.closed, [store])
+        self.assertEqual(len(self.store.cache), 0)
+        # Still usable
+        self.assertIsNot(self.store.store, store)
+        self.assertEqual(self.store[self.blob.id].data, b'shared\n')
+
+    def test_writes_go_to_disk(self):
+        blob = Blob.from_string(b'new\n')
+        self.store.add_object(blob)
+        self.assertTrue(in_thread(self.store.contains_loose, blob.id))
+
+
+class SharedGittleTest(RepoTestCase):
+
+    def setUp(self):
+        super(SharedGittleTest, self).setUp()
+        self.master = self.commit(self.init_repo(bare=True), {'a': 'a\n'})
+        self.repo = SharedGittle(self.path('repo'))
+        self.addCleanup(self.repo.close)
+
+    def tree_blob(self):
+        store = self.repo.repo.object_store
+        return store[store[self.master].tree][b'a'][1]
+
+    def test_bare_only(self):
+        self.init_repo('working')
+        with self.assertRaises(ValueError):
+            SharedGittle(self.path('working')).repo
+
+    def test_read_only(self):
+        self.assertRaises(ReadOnlyRepository, self.repo.create_tag, 'v1', self.master)
+
+    def test_threads(self):
+        errors = []
+        results = []
+
+        def read():
+            try:
+                for i in range(20):
+                    results.append((self.repo.refs['refs/heads/master'], self.repo.blob_data(self.tree_blob())))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(set(results), set([(self.master, b'a\n')]))
+        self.assertIsInstance(self.repo.repo.object_store, SharedObjectStore)
@@ -0,0 +1,240 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import io
+import os
+import zlib
+import shutil
+import random
+import hashlib
+import unittest
+
+# Dulwich imports
+from dulwich.objects import Blob, Tree
+from dulwich.object_store import DiskObjectStore, MemoryObjectStore
+
+# Local imports
+from gittle.utils.mmaps import MmapObjectStore
+from gittle.utils.streams import (
+    InflateReader, open_object, read_range, write_blob, hash_blob_file, READ_CHUNK_SIZE,
+)
+from tests.utils import RepoTestCase, git_delta_pack
+
+
+# Several read chunks, barely compressible
+BIG_DATA = bytes(bytearray(random.Random(42).getrandbits(8) for i in range(3 * READ_CHUNK_SIZE + 123)))
+
+
+class OpenObjectTest(RepoTestCase):
+
+    def setUp(self):
+        super(OpenObjectTest, self).setUp()
+        self.store = DiskObjectStore.init(self.path('objects'))
+        self.blob = Blob.from_string(BIG_DATA)
+
+    def check_stream(self, stream, data):
+        self.assertEqual(stream.size, len(data))
+        self.assertEqual(stream.type_num, Blob.type_num)
+        # Chunked reads
+        chunks = []
+        chunk = stream.read(1000)
+        while chunk:
+            chunks.append(chunk)
+            chunk = stream.read(1000)
+        self.assertEqual(b''.join(chunks), data)
+        # Seeking backwards and forwards
+        self.assertEqual(read_range(stream, 10, 5), data[10:15])
+        self.assertEqual(read_range(stream, len(data) - 3), data[-3:])
+        self.assertEqual(read_range(stream, 2 * READ_CHUNK_SIZE, 7), data[2 * READ_CHUNK_SIZE:][:7])
+        self.assertEqual(read_range(stream, len(data) + 10, 5), b'')
+        stream.close()
+
+    def test_loose(self):
+        self.store.add_object(self.blob)
+        stream = open_object(self.store, self.blob.id)
+        self.assertIsInstance(stream, InflateReader)
+        self.check_stream(stream, BIG_DATA)
+
+    def test_packed(self):
+        self.store.add_objects([(self.blob, None)])
+        stream = open_object(DiskObjectStore(self.path('objects')), self.blob.id)
+        self.assertIsInstance(stream, InflateReader)
+        self.check_stream(stream, BIG_DATA)
+
+    def test_mmap_packed(self):
+        self.store.add_objects([(self.blob, None)])
+        store = MmapObjectStore(self.path('objects'))
+        self.addCleanup(store.close)
+        stream = open_object(store, self.blob.id)
+        self.assertIsInstance(stream, InflateReader)
+        self.check_stream(stream, BIG_DATA)
+
+    def test_binary_sha(self):
+        self.store.add_object(self.blob)
+        with open_object(self.store, self.blob.sha().digest()) as stream:
+            self.assertEqual(stream.read(5), BIG_DATA[:5])
+
+    def test_other_types(self):
+        tree = Tree()
+        tree.add(b'big', 0o100644, self.blob.id)
+        self.store.add_object(tree)
+        stream = open_object(self.store, tree.id)
+        self.assertEqual(stream.type_num, Tree.type_num)
+        self.assertEqual(stream.read(), tree.as_raw_string())
+
+    def test_missing(self):
+        self.assertRaises(KeyError, open_object, self.store, b'0' * 40)
+
+    @unittest.skipUnless(shutil.which('git'), 'needs git')
+    def test_deltas(self):
+        text = b''.join(b'line %d\n' % i for i in range(100))
+        datas = [b'version %d\n%s' % (i, text) for i in range(10)]
+        shas = git_delta_pack(self.path('deltas.git'), datas)
+        for store in (DiskObjectStore(self.path('deltas.git', 'objects')),
+                      MmapObjectStore(self.path('deltas.git', 'objects'))):
+            for sha, data in zip(shas, datas):
+                stream = open_object(store, sha.encode('ascii'))
+                self.assertEqual(stream.size, len(data))
+                self.assertEqual(read_range(stream, 8, 20), data[8:28])
+                self.assertEqual(read_range(stream, 0), data)
+
+
+def blob_sha(data):
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+class UnseekableFile(object):
+    """A pipe's file interface, read only
+    """
+
+    def __init__(self, data):
+        self.read = io.BytesIO(data).read
+
+
+class WriteBlobTest(RepoTestCase):
+
+    def setUp(self):
+        super(WriteBlobTest, self).setUp()
+        self.store = DiskObjectStore.init(self.path('objects'))
+
+    def object_path(self, sha):
+        return self.path('objects', sha[:2], sha[2:])
+
+    def assertStored(self, sha, data):
+        self.assertEqual(sha, blob_sha(data))
+        with open(self.object_path(sha), 'rb') as f:
+            self.assertEqual(zlib.decompress(f.read()), b'blob %d\0' % len(data) + data)
+
+    def assertNoTemporaryFiles(self):
+        self.assertEqual([name for name in os.listdir(self.path('objects')) if name.startswith('tmp')], [])
+
+    def test_sources(self):
+        data = u'h\xe9llo\n'.encode('utf-8')
+        for source in [
+            data,
+            u'h\xe9llo\n',
+            io.BytesIO(data),
+            io.StringIO(u'h\xe9llo\n'),
+            UnseekableFile(data),
+            iter([b'h', u'\xe9', b'llo\n']),
+        ]:
+            self.assertStored(write_blob(self.store, source), data)
+        self.assertNoTemporaryFiles()
+
+    def test_big_blob_in_chunks(self):
+        chunks = (BIG_DATA[i:i + 1000] for i in range(0, len(BIG_DATA), 1000))
+        self.assertStored(write_blob(self.store, chunks), BIG_DATA)
+        self.assertStored(write_blob(self.store, io.BytesIO(BIG_DATA), len(BIG_DATA)), BIG_DATA)
+
+    def test_read_only_object(self):
+        sha = write_blob(self.store, b'data')
+        self.assertEqual(os.stat(self.object_path(sha)).st_mode & 0o777, 0o444)
+        # Already there
+        self.assertEqual(write_blob(self.store, b'data'), sha)
+        self.assertNoTemporaryFiles()
+
+    def test_wrong_size(self):
+        self.assertRaises(ValueError, write_blob, self.store, io.BytesIO(b'abc'), 5)
+        self.assertRaises(ValueError, write_blob, self.store, io.BytesIO(b'abc'), 2)
+        self.assertNoTemporaryFiles()
+        self.assertFalse(os.path.exists(self.object_path(blob_sha(b'abc'))))
+
+    def test_partial_file(self):
+        f = io.BytesIO(b'skip data')
+        f.seek(5)
+        self.assertStored(write_blob(self.store, f), b'data')
+
+    def test_memory_store(self):
+        store = MemoryObjectStore()
+        sha = write_blob(store, iter([b'in ', b'memory']))
+        self.assertEqual(sha, Blob.from_string(b'in memory').id)
+        self.assertEqual(store[sha].data, b'in memory')
+
+    def test_hash_blob_file(self):
+        with open(self.path('file'), 'wb') as f:
+            f.write(BIG_DATA)
+        self.assertEqual(hash_blob_file(self.path('file')), blob_sha(BIG_DATA))
+        os.symlink('file', self.path('link'))
+        self.assertEqual(hash_blob_file(self.path('link')), blob_sha(b'file'))
+
+
+class InflateReaderTest(unittest.TestCase):
+
+    def test_file_interface(self):
+        import zlib
+        compressed = zlib.compress(b'header\0' + BIG_DATA)
+        reader = InflateReader(lambda: io.BytesIO(compressed), len(BIG_DATA), skip=7)
+        buffered = io.BufferedReader(reader)
+        self.assertEqual(buffered.read(3), BIG_DATA[:3])
+        self.assertEqual(buffered.read(), BIG_DATA[3:])
+        self.assertEqual(reader.seek(-4, io.SEEK_END), len(BIG_DATA) - 4)
+        self.assertEqual(reader.read(), BIG_DATA[-4:])
+
+
+class GittleOpenBlobTest(RepoTestCase):
+
+    def setUp(self):
+        super(GittleOpenBlobTest, self).setUp()
+        self.repo = self.init_repo(bare=True)
+        self.master = self.commit(self.repo, {'big': BIG_DATA, 'small': 'small\n'})
+
+    def test_by_sha_and_path(self):
+        sha = Blob.from_string(BIG_DATA).id
+        for args in ((sha,), ('big',), ('big', 'master'), ('big', self.master)):
+            with self.repo.open_blob(*args) as stream:
+                self.assertEqual(stream.size, len(BIG_DATA))
+                self.assertEqual(stream.read(), BIG_DATA)
+
+    def test_read_blob_range(self):
+        self.assertEqual(self.repo.read_blob_range('big', 100, 50), BIG_DATA[100:150])
+        self.assertEqual(self.repo.read_blob_range('small', 2), b'all\n')
+
+    def test_not_a_blob(self):
+        self.assertRaises(KeyError, self.repo.open_blob, self.master)
+        self.assertRaises(KeyError, self.repo.open_blob, 'missing')
+
+
+class GittleWriteBlobTest(RepoTestCase):
+
+    def test_commit_structure_streams_files(self):
+        repo = self.init_repo(bare=True)
+        repo.commit_structure('Tester', 'tester@example.com', 'Big file', [
+            {'name': 'big', 'mode': 0o100644, 'data': io.BytesIO(BIG_DATA), 'size': len(BIG_DATA)},
+            {'name': 'chunks', 'mode': 0o100644, 'data': iter([b'a', b'b'])},
+        ])
+        self.assertEqual(repo.read_blob_range('big', 0), BIG_DATA)
+        self.assertEqual(repo.read_blob_range('chunks', 0), b'ab')
+
+    def test_stage_streams_big_files(self):
+        repo = self.init_repo()
+        repo.STREAM_BLOB_SIZE = 1000
+        with open(self.path('repo', 'big'), 'wb') as f:
+            f.write(BIG_DATA)
+        repo.stage(['big'])
+        # (ctime, mtime, dev, ino, mode, uid, gid, size, sha, flags)
+        self.assertEqual(repo.index['big'][8], blob_sha(BIG_DATA))
+        self.assertEqual(repo.read_blob_range(blob_sha(BIG_DATA), 0), BIG_DATA)
@@ -0,0 +1,118 @@
+# Copyright 2014 Aaron O'Mullan <aaron.omullan@friendco.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it only under the terms of the GNU GPLv2 and/or the Apache
+# License, Version 2.0.  See the COPYING file for further details.
+
+# Python imports
+import os
+import shutil
+import tempfile
+import subprocess
+import unittest
+import itertools
+
+# Dulwich imports
+from dulwich.objects import Blob, Tree, Commit, Tag
+
+# Local imports
+from gittle import Gittle
+
+
+# Exports
+__all__ = ('RepoTestCase', 'FakeClock', 'make_commit', 'make_tag', 'git_delta_pack', 'AUTHOR')
+
+
+AUTHOR = 'Tester <tester@example.com>'
+
+# Commits made by make_commit are a second apart, unless told otherwise
+_clock = itertools.count(1400000000)
+
+
+def make_commit(object_store, parents=(), files=None, message='Commit', commit_time=None):
+    """Store a commit of files ({name: data}, a flat tree) and return its SHA
+    Names and data are encoded like Gittle.commit_structure does
+    """
+    tree = Tree()
+    for name, data in sorted((files or {}).items()):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        blob = Blob.from_string(data)
+        object_store.add_object(blob)
+        tree.add(name.encode('ascii'), 0o100644, blob.id)
+    object_store.add_object(tree)
+
+    commit = Commit()
+    commit.tree = tree.id
+    commit.parents = list(parents)
+    commit.author = commit.committer = AUTHOR
+    commit.author_time = commit.commit_time = commit_time or next(_clock)
+    commit.author_timezone = commit.commit_timezone = 0
+    commit.message = message
+    object_store.add_object(commit)
+    return commit.id
+
+
+def make_tag(object_store, name, target, message='Tag'):
+    """Store an annotated tag of a commit and return its SHA
+    """
+    tag = Tag()
+    tag.name = name
+    tag.object = (Commit, target)
+    tag.tagger = AUTHOR
+    tag.tag_time = next(_clock)
+    tag.tag_timezone = 0
+    tag.message = message
+    object_store.add_object(tag)
+    return tag.id
+
+
+def git_delta_pack(path, datas):
+    """Bare repository at path (made by the git command) whose objects are
+    blobs of datas, in a single pack with deltas. Returns their hex SHAs
+    """
+    def git(*args, **kwargs):
+        return subprocess.check_output(('git', '--git-dir', path) + args, **kwargs)
+
+    subprocess.check_call(['git', 'init', '-q', '--bare', path])
+    shas = [git('hash-object', '-w', '--stdin', input=data).strip().decode('ascii') for data in datas]
+    git('pack-objects', '-q', '--window=%d' % len(datas), os.path.join(path, 'objects', 'pack', 'pack'),
+        input=''.join(sha + '\n' for sha in shas).encode('ascii'))
+    git('prune-packed')
+    return shas
+
+
+class FakeClock(object):
+    """time.time() replacement, tests move it by setting now
+    """
+
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RepoTestCase(unittest.TestCase):
+    """Creates repositories in a temporary directory removed after each test
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='gittle_tests_')
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+
+    def path(self, *parts):
+        return os.path.join(self.tmpdir, *parts)
+
+    def init_repo(self, name='repo', bare=False, **kwargs):
+        return Gittle.init(self.path(name), bare=bare, **kwargs)
+
+    def commit(self, repo, files=None, parents=None, branch='master', **kwargs):
+        """Commit files on top of branch (or of parents) and move the branch to it
+        """
+        ref = 'refs/heads/' + branch
+        if parents is None:
+            parents = [repo.repo.refs[ref]] if ref in repo.repo.refs else []
+        sha = make_commit(repo.repo.object_store, parents, files, **kwargs)
+        repo.repo.refs[ref] = sha
+        return sha